@@ -1,78 +1,132 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, render_template, request, redirect, url_for, jsonify, g, Response
+import functools
+import hmac
 import logging
 import sys
 import os
+import time
+import uuid
 from config import Config
+import bootstrap
+import metrics
 import notion_client  # Import our new client
+import export
+import importer
+import outbox
+import portfolio
+import reporting
+import startup
 
 # Basic logging
 logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 log = logging.getLogger(__name__)
+logging.getLogger('httpx').setLevel(logging.WARNING)  # httpx logs every request at INFO
 
+Config.validate()
 app = Flask(__name__)
+metrics.describe('http_request_duration_seconds', 'histogram', 'Flask request latency by route, method and status.')
+
+
+@app.before_request
+def _start_background_workers():
+    # Started lazily (not at import) so each gunicorn worker gets its own thread after the fork
+    if Config.OUTBOX_ASYNC:
+        outbox.start_dispatcher()
+    importer.resume_interrupted_jobs()
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    g.caller_token = metrics.default_caller(request.endpoint or 'unmatched')
+    if Config.PROFILE_REQUESTS and (request.args.get('profile') or request.headers.get('X-Profile')):
+        g.profile_token = metrics.start_profile()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    elapsed = time.perf_counter() - g.pop('request_started', time.perf_counter())
+    metrics.observe('http_request_duration_seconds', elapsed, route=route, method=request.method,
+                    status=response.status_code)
+    if 'caller_token' in g:
+        metrics.reset_default_caller(g.pop('caller_token'))
+    token = g.pop('profile_token', None)
+    if token is not None:
+        # Profiling mode: report the slowest spans of this request
+        slowest = metrics.finish_profile(token, top=Config.PROFILE_TOP_N)
+        response.headers['Server-Timing'] = ', '.join(
+            [f'total;dur={elapsed * 1000:.1f}'] +
+            [f'{s.name};desc="{s.labels.get("caller", "")} {s.labels.get("database", "")}";dur={s.duration * 1000:.1f}'
+             for s in slowest])
+        log.info(f"Profile of {request.method} {request.path} ({elapsed * 1000:.1f}ms), slowest calls: " +
+                 "; ".join(f"{s.name} {s.labels} {s.duration * 1000:.1f}ms" for s in slowest))
+    startup.first_request()
+    return response
 
 
 # --- Primary Routes ---
 
 @app.route('/', methods=['GET'])
-def index():
+async def index():
     try:
-        # Per your request, we fetch fresh data every time
-        all_accounts_pages = notion_client.fetch_notion_database_pages(Config.ACCOUNTS_DB_ID)
-        all_pillars_pages = notion_client.fetch_notion_database_pages(Config.PILLARS_DB_ID)
-
-        # ... (Your processing logic remains the same) ...
-        accounts = [
-            {'id': p['id'], 'name': p['properties']['Name']['title'][0]['plain_text'], 'properties': p['properties']}
-            for p in all_accounts_pages]
-        pillars = [{'id': p['id'], 'name': p['properties']['Name']['title'][0]['plain_text']} for p in
-                   all_pillars_pages]
-        pillars.reverse()
-        investment_accounts = [acc for acc in accounts if
-                               acc['properties'].get('Is Investment Account?', {}).get('checkbox') is True]
-        non_investment_accounts = [acc for acc in accounts if
-                                   acc['properties'].get('Is Investment Account?', {}).get('checkbox') is not True]
-
-        # Use the new template file
+        # Accounts, pillars and categories come from the metadata cache (loaded concurrently on a miss)
+        form = await bootstrap.aload()
         return render_template('index.html',
-                               non_investment_accounts=non_investment_accounts,
-                               pillars=pillars,
-                               investment_accounts=investment_accounts)
+                               non_investment_accounts=form.accounts['cash'],
+                               pillars=form.pillars,
+                               investment_accounts=form.accounts['investment'],
+                               bootstrap_version=form.version)
     except Exception as e:
         log.error(f"Error loading index page: {e}")
         return render_template('failure.html', error_message=f"Failed to load page data from Notion: {e}")
 
 
+def _require_api_token(view):
+    """
+    For endpoints that expose or rewrite the ledger: with API_TOKEN set they need an
+    `Authorization: Bearer <token>` header, otherwise they only answer requests from localhost.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if Config.API_TOKEN:
+            supplied = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(supplied.encode(), f"Bearer {Config.API_TOKEN}".encode()):
+                return jsonify({"error": "A valid API token is required."}), 401
+        elif request.remote_addr not in ('127.0.0.1', '::1'):
+            return jsonify({"error": "Set API_TOKEN to use this endpoint from another host."}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _submit(kind, form_data):
+    """
+    Saves the submission to the outbox under its idempotency key, then either hands it to the
+    background dispatcher (OUTBOX_ASYNC) or delivers it inline. A resubmitted key is never logged twice.
+    """
+    key = form_data.get('idempotency_key') or uuid.uuid4().hex
+    entry, created = outbox.submit(kind, form_data.to_dict(), key)
+    if not created:
+        log.info(f"Duplicate submission {key} ({entry.status})")
+        if entry.status == outbox.DONE:
+            return entry.result
+        if entry.status == outbox.FAILED:
+            raise Exception(entry.last_error)
+        if not Config.OUTBOX_ASYNC and entry.status == outbox.PENDING:
+            # No dispatcher runs in this mode, so the resubmission is what retries a failed inline delivery
+            return outbox.dispatch(key, ignore_backoff=True)
+        return "⏳ This entry was already received and is being logged."
+    if Config.OUTBOX_ASYNC:
+        outbox.wake()
+        return "⏳ Saved. It is being logged to Notion in the background."
+    return outbox.dispatch(key)
+
+
 @app.route('/log_transaction', methods=['POST'])
 def log_transaction():
     try:
-        form_data = request.form
-        transaction_type = form_data.get('type')
-        message = ""
-
-        if transaction_type in ['expense', 'income']:
-            # Call our new client function
-            notion_client.create_expense_or_income(
-                ttype=transaction_type,
-                description=form_data.get('description', 'No description'),
-                amount=float(form_data.get('amount', 0)),
-                account_id=form_data.get('from_account_id'),
-                category_id=form_data.get('category_id'),
-                pillar_id=form_data.get('pillar_id'),
-                currency=form_data.get('currency', 'ILS')
-            )
-            message = "✅ Successfully logged transaction."
-
-        elif transaction_type == 'transfer':
-            # This function now returns the success message
-            message = notion_client.create_transfer_entries(
-                from_account_id=form_data.get('from_account_id'),
-                to_account_id=form_data.get('to_account_id'),
-                amount=float(form_data.get('amount', 0)),
-                currency=form_data.get('currency', 'ILS')
-            )
-
+        message = _submit('transaction', request.form)
         return redirect(url_for('success', message=message))
 
     except Exception as e:
@@ -84,8 +138,8 @@ def log_transaction():
 @app.route('/log_investment', methods=['POST'])
 def log_investment():
     try:
-        # All the complex logic is now in the client!
-        message = notion_client.log_investment_transaction(request.form)
+        # All the complex logic is in notion_client; the outbox decides when it runs
+        message = _submit('investment', request.form)
         return redirect(url_for('success', message=message))
 
     except Exception as e:
@@ -95,13 +149,67 @@ def log_investment():
         return render_template('failure.html', error_message=str(e))
 
 
+@app.route('/import', methods=['POST'])
+@_require_api_token
+def import_statement():
+    """Starts a background import of an uploaded CSV/OFX statement; poll the returned status URL."""
+    upload = request.files.get('statement')
+    account_id = request.form.get('account_id')
+    if not upload or not account_id:
+        return jsonify({'error': "A 'statement' file and an 'account_id' are required."}), 400
+    csv_options = {k: request.form[k] for k in ('date_column', 'description_column', 'amount_column',
+                                                'debit_column', 'credit_column', 'date_format') if request.form.get(k)}
+    try:
+        job_id = importer.start_import_job(upload.stream, upload.filename or '', account_id,
+                                           currency=request.form.get('currency', 'ILS'),
+                                           category_id=request.form.get('category_id') or None,
+                                           pillar_id=request.form.get('pillar_id') or None,
+                                           invert_sign=request.form.get('invert_sign', '').lower() == 'true',
+                                           **csv_options)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'job_id': job_id, 'status_url': url_for('import_status', job_id=job_id)}), 202
+
+
+@app.route('/import/<job_id>', methods=['GET'])
+@_require_api_token
+def import_status(job_id):
+    state = importer.job_status(job_id)
+    if state is None:
+        return jsonify({'error': 'Unknown import job'}), 404
+    return jsonify(state)
+
+
 # --- API and Utility Routes ---
 
+@app.route('/api/bootstrap')
+async def get_bootstrap():
+    """
+    Accounts, pillars and the category tree of every type in one response. ?v=<version> (as the
+    form page requests it) is cached by the browser for good; otherwise clients revalidate by ETag.
+    """
+    try:
+        form = await bootstrap.aload()
+    except Exception as e:
+        log.error(f"Error building bootstrap payload: {e}")
+        return jsonify({"error": str(e)}), 500
+    if request.args.get('v') == form.version:
+        cache_control = 'private, max-age=31536000, immutable'
+    else:
+        cache_control = f'private, max-age={Config.BOOTSTRAP_MAX_AGE}'
+    if request.if_none_match.contains(form.version):
+        response = Response(status=304)
+    else:
+        response = Response(form.body, mimetype='application/json')
+    response.set_etag(form.version)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
 @app.route('/api/categories/<transaction_type>')
-def get_categories_by_type(transaction_type):
+async def get_categories_by_type(transaction_type):
     try:
-        # This logic is fine to keep here, or move to notion_client
-        parents, children_map = notion_client.fetch_and_process_categories(transaction_type)
+        parents, children_map = (await bootstrap.aload()).categories_for(transaction_type)
         return jsonify({'parents': parents, 'children_map': children_map})
     except Exception as e:
         log.error(f"Error fetching categories: {e}")
@@ -119,8 +227,137 @@ def health():
     return jsonify({'status': 'ok'}), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus-style metrics for this worker: route latency, Notion calls, retries, cache hit ratios."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/outbox', methods=['GET'])
+@_require_api_token
+def outbox_status():
+    """Queued/failed submission counts, plus the failed entries and their errors."""
+    return jsonify(outbox.stats())
+
+
+@app.route('/api/holdings/enrich', methods=['POST'])
+@_require_api_token
+def enrich_holdings():
+    """Runs one market-data enrichment pass (meant for a scheduler such as Cloud Scheduler)."""
+    try:
+        return jsonify(notion_client.enrich_holdings_with_more_info(request.args.get('ticker')))
+    except Exception as e:
+        log.error(f"Error enriching holdings: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/portfolio/reconcile', methods=['POST'])
+@_require_api_token
+def reconcile_portfolio():
+    """Rebuilds holdings from the investment ledger (?dry_run=true to only report, ?method=fifo)."""
+    dry_run = request.args.get('dry_run', 'false').lower() in ('true', '1', 'yes')
+    try:
+        return jsonify(portfolio.reconcile(method=request.args.get('method'), dry_run=dry_run))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.error(f"Error reconciling portfolio: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+def _base_currency_arg():
+    """?base=USD converts to USD; a bare ?base (or ?base=default) uses FX_BASE_CURRENCY."""
+    if 'base' not in request.args:
+        return None
+    base = request.args.get('base', '').strip().upper()
+    return Config.FX_BASE_CURRENCY if base in ('', 'DEFAULT') else base
+
+
+@app.route('/api/reports/<dimension>', methods=['GET'])
+@_require_api_token
+def report(dimension):
+    """
+    Monthly spend/income by month, account, category or pillar (?from=YYYY-MM&to=YYYY-MM&currency=ILS).
+    ?base=ILS converts every currency to ILS at each month's average rate.
+    """
+    if not reporting.is_enabled():
+        return jsonify({"error": "Reporting is disabled (REPORTING_DB_PATH is empty)."}), 404
+    try:
+        rows = reporting.rollup(dimension, start_month=request.args.get('from'), end_month=request.args.get('to'),
+                                currency=request.args.get('currency'), base_currency=_base_currency_arg())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.error(f"Error building {dimension} report: {e}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({'dimension': dimension, 'rows': rows})
+
+
+@app.route('/api/balances', methods=['GET'])
+@_require_api_token
+def account_balances():
+    """Balance of every account per currency; ?base=ILS adds a total converted at today's (or ?date=) rates."""
+    if not reporting.is_enabled():
+        return jsonify({"error": "Reporting is disabled (REPORTING_DB_PATH is empty)."}), 404
+    try:
+        rows = reporting.balances(base_currency=_base_currency_arg(), rate_date=request.args.get('date'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.error(f"Error computing balances: {e}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({'accounts': rows})
+
+
+@app.route('/export/<database>', methods=['GET'])
+@_require_api_token
+def export_changes(database):
+    """
+    Rows created or edited after ?cursor= (or at/after ?since=<ISO timestamp>) as NDJSON, or
+    ?format=parquet. The next cursor is in X-Next-Cursor; X-Has-More says whether to call again now.
+    """
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"Unknown format: {fmt}. Use one of: {', '.join(export.FORMATS)}"}), 400
+    try:
+        feed = export.changes(database, since=request.args.get('since'), cursor=request.args.get('cursor'),
+                              limit=request.args.get('limit', type=int))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.error(f"Error exporting {database}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    etag = feed.etag(fmt)
+    headers = {'X-Next-Cursor': feed.next_cursor, 'X-Has-More': 'true' if feed.has_more else 'false',
+               'X-Row-Count': str(len(feed)), 'Cache-Control': 'no-cache'}
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+    if fmt == 'parquet':
+        try:
+            response = Response(export.to_parquet(feed.rows()), mimetype='application/vnd.apache.parquet',
+                                headers=headers)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 501
+    else:
+        response = Response(export.to_ndjson(feed), mimetype='application/x-ndjson', headers=headers)
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/api/cache/refresh', methods=['POST'])
+def refresh_cache():
+    """Drops the cached accounts/pillars/categories so the next page load reads Notion again."""
+    notion_client.invalidate_metadata()
+    return jsonify({'status': 'ok', 'cache': notion_client.metadata_cache_stats()}), 200
+
+
+startup.mark('app_imported')
+
+
 # --- Main Run Block ---
 if __name__ == '__main__':
-    notion_client.enrich_holdings_with_more_info("INTC")
-    # port = int(os.environ.get('PORT', 5000))
-    # app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    port = int(os.environ.get('PORT', 5000))
+    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
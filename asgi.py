@@ -0,0 +1,7 @@
+# asgi.py
+"""ASGI entry point, for serving the app with an ASGI server (e.g. `uvicorn asgi:asgi_app`) instead of gunicorn."""
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app
+
+asgi_app = WsgiToAsgi(app)
@@ -0,0 +1,188 @@
+# benchmark.py
+"""Throughput/latency benchmark of the app against the local Notion stand-in (fake_notion.py)."""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_notion
+
+SCENARIOS = ('index', 'expense', 'transfer', 'buy', 'sell', 'conversion')
+
+
+def _configure_app(base_url, args, workdir):
+    """Env for the app under test; must run before config (or anything importing it) is imported."""
+    os.environ.update(fake_notion.app_environment(base_url))
+    os.environ.update({
+        'OUTBOX_ASYNC': 'false',
+        'OUTBOX_DB_PATH': os.path.join(workdir, 'outbox.db'),
+        'REPORTING_DB_PATH': os.path.join(workdir, 'reporting.db') if args.reporting else '',
+        'MIRROR_DB_PATH': os.path.join(workdir, 'mirror.db') if args.mirror else '',
+        'FX_STORE_DIR': os.path.join(workdir, 'fx_rates'),
+        'NOTION_REQUESTS_PER_SECOND': str(args.notion_rps or 10_000),
+        'NOTION_RATE_BURST': str(args.notion_rps or 10_000),
+        'WEB_CONCURRENCY': '1',
+    })
+
+
+def _scenario_request(name, ids):
+    """(method, path, form data) for one request of a scenario."""
+    key = uuid.uuid4().hex
+    if name == 'index':
+        return 'GET', '/', None
+    if name == 'expense':
+        return 'POST', '/log_transaction', {
+            'type': 'expense', 'description': 'Benchmark expense', 'amount': '12.5', 'currency': 'ILS',
+            'from_account_id': ids['cash'][0], 'category_id': ids['category'], 'pillar_id': ids['pillar'],
+            'idempotency_key': key}
+    if name == 'transfer':
+        return 'POST', '/log_transaction', {
+            'type': 'transfer', 'amount': '100', 'currency': 'ILS', 'from_account_id': ids['cash'][0],
+            'to_account_id': ids['cash'][1], 'idempotency_key': key}
+    if name in ('buy', 'sell'):
+        return 'POST', '/log_investment', {
+            'action': name.capitalize(), 'account_id': ids['investment'][0], 'ticker': fake_notion.TICKERS[0],
+            'quantity': '1', 'price_per_share': '150', 'fees': '1', 'idempotency_key': key}
+    if name == 'conversion':
+        return 'POST', '/log_investment', {
+            'action': 'Money Conversion', 'account_id': ids['investment'][0], 'from_amount': '3700',
+            'from_currency': 'ILS', 'to_amount': '1000', 'to_currency': 'USD', 'conversion_rate': '3.7',
+            'conversion_fee': '2', 'idempotency_key': key}
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+def _seeded_ids(notion):
+    def pages(attr):
+        database_id = fake_notion.DATABASES[attr][1]
+        return [notion.pages[page_id] for page_id in notion.by_database[database_id]]
+    accounts = pages('ACCOUNTS_DB_ID')
+    return {
+        'cash': [a['id'] for a in accounts if not a['properties']['Is Investment Account?']['checkbox']],
+        'investment': [a['id'] for a in accounts if a['properties']['Is Investment Account?']['checkbox']],
+        'category': pages('CATEGORIES_DB_ID')[0]['id'],
+        'pillar': pages('PILLARS_DB_ID')[0]['id'],
+    }
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def run_scenario(app, notion, name, ids, requests, concurrency, warmup):
+    """Runs one scenario and returns its summary dict."""
+    local = threading.local()
+
+    def one_request():
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        method, path, data = _scenario_request(name, ids)
+        started = time.perf_counter()
+        response = local.client.open(path, method=method, data=data)
+        elapsed = time.perf_counter() - started
+        # Failures render failure.html; successes are a 200 page or a redirect to /success
+        ok = (response.status_code == 302 and '/success' in response.headers.get('Location', '')) if method == 'POST' \
+            else response.status_code == 200 and b'Failed to load' not in response.data
+        return elapsed, ok
+
+    for _ in range(warmup):
+        one_request()
+    calls_before = notion.stats['requests']
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: one_request(), range(requests)))
+    wall = time.perf_counter() - started
+    calls = notion.stats['requests'] - calls_before
+
+    latencies = sorted(elapsed for elapsed, _ in results)
+    return {
+        'scenario': name, 'requests': requests, 'errors': sum(1 for _, ok in results if not ok),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2), 'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2), 'requests_per_second': round(requests / wall, 2),
+        'notion_calls_per_request': round(calls / requests, 2),
+    }
+
+
+def compare(results, baseline, max_regression):
+    """Regression messages for scenarios slower (p95) or chattier (Notion calls) than the baseline."""
+    previous = {r['scenario']: r for r in baseline.get('results', [])}
+    problems = []
+    for result in results:
+        before = previous.get(result['scenario'])
+        if not before:
+            continue
+        if before['p95_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+            problems.append(f"{result['scenario']}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+        if result['notion_calls_per_request'] > before['notion_calls_per_request'] + 0.01:
+            problems.append(f"{result['scenario']}: Notion calls/request {before['notion_calls_per_request']} -> "
+                            f"{result['notion_calls_per_request']}")
+        if result['errors'] > before.get('errors', 0):
+            problems.append(f"{result['scenario']}: {result['errors']} errors (was {before.get('errors', 0)})")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app against a local fake Notion API.")
+    parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run (default: all). One of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=50, help="Requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests per scenario")
+    parser.add_argument('--latency', type=float, default=50, help="Fake Notion latency per call, in ms")
+    parser.add_argument('--jitter', type=float, default=10, help="Fake Notion latency jitter, in ms")
+    parser.add_argument('--rate-limit', type=float, default=0, help="Probability the fake answers 429")
+    parser.add_argument('--transactions', type=int, default=1000, help="Seeded Transactions rows")
+    parser.add_argument('--notion-rps', type=float, help="Client-side Notion rate limit (default: effectively off)")
+    parser.add_argument('--mirror', action='store_true', help="Enable the SQLite mirror")
+    parser.add_argument('--reporting', action='store_true', help="Enable the materialized reports")
+    parser.add_argument('--json', metavar='PATH', help="Also write the results to this file")
+    parser.add_argument('--baseline', metavar='PATH', help="Fail if results regress against this saved run")
+    parser.add_argument('--max-regression', type=float, default=0.2, help="Allowed p95 slowdown vs the baseline")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    notion = fake_notion.FakeNotion(latency=args.latency / 1000, jitter=args.jitter / 1000,
+                                    rate_limit_probability=args.rate_limit, retry_after=0)
+    notion.seed(args.transactions)
+    server, base_url = fake_notion.start(notion)
+    workdir = tempfile.mkdtemp(prefix='notion-bench-')
+    _configure_app(base_url, args, workdir)
+
+    import logging
+    from app import app  # Imported only now, so Config reads the fake's settings
+    logging.getLogger().setLevel(logging.WARNING)
+
+    ids = _seeded_ids(notion)
+    results = []
+    print(f"{'scenario':<12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'calls/req':>11}{'errors':>8}")
+    for name in args.scenarios or SCENARIOS:
+        result = run_scenario(app, notion, name, ids, args.requests, args.concurrency, args.warmup)
+        results.append(result)
+        print(f"{name:<12}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+              f"{result['requests_per_second']:>9.1f}{result['notion_calls_per_request']:>11.2f}{result['errors']:>8}")
+    server.shutdown()
+
+    report = {'settings': {k: v for k, v in vars(args).items() if k not in ('json', 'baseline')}, 'results': results}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            problems = compare(results, json.load(f), args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            return 1
+    return 0 if not any(r['errors'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# bootstrap.py
+"""Everything the entry form needs (accounts, pillars, category tree) in one cached, versioned payload."""
+import asyncio
+import hashlib
+import json
+import threading
+from collections import defaultdict
+
+from config import Config
+import notion_async
+import notion_client
+
+FORM_TYPES = ('expense', 'income')  # Always present in the payload, even without categories of that type
+
+
+def category_tree(categories, transaction_type=None):
+    """Category records -> (sorted parents, {parent_id: sorted children}) for one transaction type."""
+    if not categories: return [], {}
+    all_categories = [{'id': c.id, 'name': c.name, 'parent_id': c.parent_id} for c in categories
+                      if c.name and not (transaction_type and c.type and c.type.lower() != transaction_type.lower())]
+    parents = [cat for cat in all_categories if not cat['parent_id']]
+    children_map = defaultdict(list)
+    for cat in all_categories:
+        if cat['parent_id']:
+            children_map[cat['parent_id']].append({'id': cat['id'], 'name': cat['name']})
+    def sort_key_other_last(category):
+        is_other = 1 if 'other' in category['name'].lower() else 0
+        return (is_other, category['name'])
+    parents.sort(key=sort_key_other_last)
+    for parent_id in children_map:
+        children_map[parent_id].sort(key=sort_key_other_last)
+    return parents, dict(children_map)
+
+
+class FormBootstrap:
+    __slots__ = ('sources', 'accounts', 'pillars', 'categories', 'version', 'body')
+
+    def __init__(self, accounts, pillars, categories):
+        self.sources = (accounts, pillars, categories)
+        self.accounts = {'cash': [a for a in accounts if not a.is_investment],
+                         'investment': [a for a in accounts if a.is_investment]}
+        self.pillars = list(reversed(pillars))
+        types = set(FORM_TYPES) | {c.type.lower() for c in categories if c.type}
+        self.categories = {}
+        for transaction_type in sorted(types):
+            parents, children_map = category_tree(categories, transaction_type)
+            self.categories[transaction_type] = {'parents': parents, 'children_map': children_map}
+
+        payload = {
+            'accounts': {kind: [{'id': a.id, 'name': a.name} for a in group] for kind, group in self.accounts.items()},
+            'pillars': [{'id': p.id, 'name': p.name} for p in self.pillars],
+            'categories': self.categories,
+        }
+        content = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+        self.version = hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+        # The version is spliced in front rather than re-serializing the payload
+        self.body = f'{{"version":"{self.version}",{content[1:]}'.encode('utf-8')
+
+    def categories_for(self, transaction_type):
+        """(parents, children_map) for one type, as /api/categories/<type> returns them."""
+        tree = self.categories.get((transaction_type or '').lower())
+        if tree is None:
+            tree = dict(zip(('parents', 'children_map'), category_tree(self.sources[2], transaction_type)))
+        return tree['parents'], tree['children_map']
+
+
+_current = None
+_lock = threading.Lock()
+
+
+def build(accounts, pillars, categories):
+    """The FormBootstrap for these record sets, rebuilt only when one of them was reloaded."""
+    global _current
+    sources = (accounts, pillars, categories)
+    current = _current
+    if current is not None and all(a is b for a, b in zip(current.sources, sources)):
+        return current
+    with _lock:
+        if _current is None or not all(a is b for a, b in zip(_current.sources, sources)):
+            _current = FormBootstrap(accounts, pillars, categories)
+        return _current
+
+
+def load():
+    return build(notion_client.fetch_cached_records(Config.ACCOUNTS_DB_ID),
+                 notion_client.fetch_cached_records(Config.PILLARS_DB_ID),
+                 notion_client.fetch_cached_records(Config.CATEGORIES_DB_ID))
+
+
+async def aload():
+    """load() for async views: the three cached databases are fetched concurrently on a miss."""
+    accounts, pillars, categories = await asyncio.gather(
+        notion_async.fetch_cached_records(Config.ACCOUNTS_DB_ID),
+        notion_async.fetch_cached_records(Config.PILLARS_DB_ID),
+        notion_async.fetch_cached_records(Config.CATEGORIES_DB_ID))
+    return build(accounts, pillars, categories)
@@ -16,8 +16,105 @@ class Config:
 
     # Here is the SSL toggle you requested
     SSL_VERIFY = os.environ.get('SSL_VERIFY', 'true').lower() != 'false'
+    # Point at a local stand-in (e.g. fake_notion.py) for benchmarks and offline work
+    NOTION_API_BASE_URL = os.environ.get('NOTION_API_BASE_URL', 'https://api.notion.com/v1').rstrip('/')
 
-    # Check for the most critical key
-    if not NOTION_API_KEY:
-        print("CRITICAL ERROR: NOTION_API_KEY is not set.", file=sys.stderr)
-        raise ValueError("CRITICAL ERROR: NOTION_API_KEY is not set.")
\ No newline at end of file
+    # Notion transport (notion_async): pooled httpx client, rate limit and retries.
+    # Notion allows ~3 req/s per integration; the budget is split across gunicorn workers (WEB_CONCURRENCY).
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '2'))
+    NOTION_REQUESTS_PER_SECOND = float(os.environ.get('NOTION_REQUESTS_PER_SECOND', '3'))
+    NOTION_RATE_BURST = float(os.environ.get('NOTION_RATE_BURST', '3'))
+    NOTION_POOL_SIZE = int(os.environ.get('NOTION_POOL_SIZE', '10'))
+    NOTION_TIMEOUT = float(os.environ.get('NOTION_TIMEOUT', '30'))
+    NOTION_MAX_RETRIES = int(os.environ.get('NOTION_MAX_RETRIES', '3'))
+    NOTION_BACKOFF_BASE = float(os.environ.get('NOTION_BACKOFF_BASE', '0.5'))
+    NOTION_BACKOFF_MAX = float(os.environ.get('NOTION_BACKOFF_MAX', '8'))
+
+    # Metadata cache for the slowly changing databases (accounts, pillars, categories).
+    # TTLs are in seconds; each database can override the default.
+    METADATA_CACHE_TTL = int(os.environ.get('METADATA_CACHE_TTL', '300'))
+    ACCOUNTS_CACHE_TTL = int(os.environ.get('ACCOUNTS_CACHE_TTL', METADATA_CACHE_TTL))
+    PILLARS_CACHE_TTL = int(os.environ.get('PILLARS_CACHE_TTL', METADATA_CACHE_TTL))
+    CATEGORIES_CACHE_TTL = int(os.environ.get('CATEGORIES_CACHE_TTL', METADATA_CACHE_TTL))
+    METADATA_CACHE_MAX_ENTRIES = int(os.environ.get('METADATA_CACHE_MAX_ENTRIES', '32'))
+    # Serve an expired entry (up to MAX_STALE seconds past its TTL) while it refreshes in the background
+    METADATA_CACHE_STALE_WHILE_REVALIDATE = os.environ.get('METADATA_CACHE_STALE_WHILE_REVALIDATE', 'true').lower() != 'false'
+    METADATA_CACHE_MAX_STALE = int(os.environ.get('METADATA_CACHE_MAX_STALE', '3600'))
+
+    # Optional local SQLite mirror of the Notion databases (see mirror.py). Empty disables it.
+    MIRROR_DB_PATH = os.environ.get('MIRROR_DB_PATH', '')
+    # Reads from the mirror trigger an incremental sync once it is older than this (seconds)
+    MIRROR_MAX_AGE = int(os.environ.get('MIRROR_MAX_AGE', '300'))
+    # Incremental syncs miss pages archived or deleted in Notion; a sync becomes a full reload (dropping them)
+    # once the last full one is older than this (seconds)
+    MIRROR_FULL_SYNC_MAX_AGE = int(os.environ.get('MIRROR_FULL_SYNC_MAX_AGE', '3600'))
+
+    # Durable outbox for form submissions (see outbox.py). With OUTBOX_ASYNC the request returns as soon as
+    # the submission is saved and a background thread sends it to Notion. On Cloud Run, background threads
+    # only get CPU outside requests with --no-cpu-throttling.
+    OUTBOX_DB_PATH = os.environ.get('OUTBOX_DB_PATH', 'outbox.db')
+    OUTBOX_ASYNC = os.environ.get('OUTBOX_ASYNC', 'true').lower() != 'false'
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+    OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', '5'))
+    # An in_progress entry whose claim was not renewed for this long (seconds) is assumed to belong to a dead
+    # worker and is retried. The claim is renewed at every write, so it must outlast the slowest single write
+    # with its lookups: by default three Notion requests, each with every retry timing out
+    OUTBOX_CLAIM_TIMEOUT = int(os.environ.get('OUTBOX_CLAIM_TIMEOUT', str(int(
+        3 * (NOTION_MAX_RETRIES + 1) * NOTION_TIMEOUT + 3 * NOTION_MAX_RETRIES * NOTION_BACKOFF_MAX))))
+
+    # Statement imports (see importer.py): checkpoint directory and concurrent creates per import
+    IMPORT_DIR = os.environ.get('IMPORT_DIR', 'imports')
+    IMPORT_CONCURRENCY = int(os.environ.get('IMPORT_CONCURRENCY', '3'))
+
+    # Holdings enrichment (see yfinance_updater.py): on-disk reference data cache, and the Holdings
+    # number property that receives the latest price. The Holdings database has no such property out
+    # of the box, so prices are skipped unless you add one and name it here.
+    ENRICH_CACHE_PATH = os.environ.get('ENRICH_CACHE_PATH', 'reference_cache.json')
+    ENRICH_PRICE_PROPERTY = os.environ.get('ENRICH_PRICE_PROPERTY', '')
+
+    # Portfolio replay (see portfolio.py): 'average' matches the live Buy/Sell logic, or 'fifo'
+    COST_BASIS_METHOD = os.environ.get('COST_BASIS_METHOD', 'average').lower()
+
+    # Per-request profiling: with this on, ?profile=1 or an X-Profile header logs the slowest calls
+    # of that request and returns them in a Server-Timing header
+    PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', 'false').lower() in ('true', '1', 'yes')
+    PROFILE_TOP_N = int(os.environ.get('PROFILE_TOP_N', '10'))
+
+    # Materialized spending/income reports (see reporting.py). Empty (the default) disables them; the first
+    # build scans every transaction, so gunicorn runs it in startup.prewarm rather than in a request
+    REPORTING_DB_PATH = os.environ.get('REPORTING_DB_PATH', '')
+    REPORTING_MAX_AGE = int(os.environ.get('REPORTING_MAX_AGE', '300'))  # Seconds before a catch-up sync
+
+    # Bearer token for the endpoints that read or rewrite the ledger (reports, balances, export, outbox,
+    # import, reconcile, enrich). Empty (the default): they only answer requests from localhost
+    API_TOKEN = os.environ.get('API_TOKEN', '')
+
+    # Browser cache lifetime (seconds) of an unversioned /api/bootstrap; versioned URLs are cached for good
+    BOOTSTRAP_MAX_AGE = int(os.environ.get('BOOTSTRAP_MAX_AGE', '60'))
+
+    # Historical FX rates (see fx.py): one memory-mapped file per currency, and the currency that
+    # reports and balances are converted to when a base currency is asked for without naming one.
+    # Put FX_STORE_DIR on persistent storage shared by every instance (a mounted volume): rates
+    # recorded as conversions are logged live only there. The store re-seeds itself from the Money
+    # Conversions in Notion when it was never seeded or was seeded more than FX_SEED_MAX_AGE
+    # seconds ago (0 turns automatic seeding off)
+    FX_STORE_DIR = os.environ.get('FX_STORE_DIR', 'fx_rates')
+    FX_SEED_MAX_AGE = int(os.environ.get('FX_SEED_MAX_AGE', '3600'))
+    FX_BASE_CURRENCY = os.environ.get('FX_BASE_CURRENCY', 'ILS').upper()
+
+    # Change-feed export (see export.py): rows per batch by default, and the most a caller can ask for
+    EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '1000'))
+    EXPORT_MAX_PAGE_SIZE = int(os.environ.get('EXPORT_MAX_PAGE_SIZE', '10000'))
+
+    # Cold start (see startup.py and gunicorn.conf.py): fill the metadata cache in the gunicorn master before forking
+    PREWARM_ON_START = os.environ.get('PREWARM_ON_START', 'true').lower() != 'false'
+
+    @classmethod
+    def validate(cls):
+        """
+        Checks the settings nothing works without. Runs when the app starts and before each Notion
+        call rather than at import, so tools that only read settings don't need a key.
+        """
+        if not cls.NOTION_API_KEY:
+            print("CRITICAL ERROR: NOTION_API_KEY is not set.", file=sys.stderr)
+            raise ValueError("CRITICAL ERROR: NOTION_API_KEY is not set.")
\ No newline at end of file
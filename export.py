@@ -0,0 +1,286 @@
+# export.py
+"""Incremental change feed of the Notion databases (NDJSON/Parquet), read after a cursor."""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+from config import Config
+import mirror
+import notion_client
+
+log = logging.getLogger(__name__)
+
+FORMATS = ('ndjson', 'parquet')
+
+
+# --- CURSORS ---
+
+def encode_cursor(last_edited_time, page_id=''):
+    raw = json.dumps([last_edited_time, page_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Cursor -> (last_edited_time, page id). Raises ValueError for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        last_edited_time, page_id = json.loads(raw)
+    except Exception:
+        raise ValueError(f"Invalid export cursor: {cursor}")
+    return str(last_edited_time), str(page_id)
+
+
+def normalize_since(since):
+    """
+    An ISO date or timestamp (any offset; naive means UTC) -> Notion's own format, e.g.
+    2024-01-01T10:00:00.000Z, so it compares correctly with stored last_edited_time strings.
+    Raises ValueError when it can't be parsed.
+    """
+    try:
+        moment = datetime.fromisoformat(since.strip())
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid since timestamp: {since}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}Z"
+
+
+def _start_position(since=None, cursor=None):
+    if cursor:
+        return decode_cursor(cursor)
+    # Every id sorts after '', so this includes pages edited exactly at `since`
+    return (normalize_since(since) if since else '', '')
+
+
+# --- FLATTENING ---
+
+def _plain_text(items):
+    return ''.join(t.get('plain_text', '') for t in items or [])
+
+
+def _flatten_property(prop):
+    kind = prop.get('type') or next((key for key in prop if key != 'id'), None)
+    value = prop.get(kind) if kind else None
+    if kind in ('title', 'rich_text'):
+        return _plain_text(value)
+    if kind in ('select', 'status'):
+        return (value or {}).get('name')
+    if kind == 'multi_select':
+        return ', '.join(option.get('name', '') for option in value or [])
+    if kind == 'relation':
+        return ', '.join(related['id'] for related in value or [])
+    if kind == 'date':
+        return (value or {}).get('start')
+    if kind == 'people':
+        return ', '.join(person.get('name') or person.get('id', '') for person in value or [])
+    if kind in ('formula', 'rollup'):
+        inner = (value or {}).get('type')
+        inner_value = (value or {}).get(inner)
+        if inner == 'date':
+            return (inner_value or {}).get('start')
+        if inner == 'array':
+            return json.dumps(inner_value)
+        return inner_value
+    if kind == 'unique_id':
+        return f"{value.get('prefix') or ''}{'-' if value.get('prefix') else ''}{value.get('number')}" if value else None
+    if kind in ('created_by', 'last_edited_by'):
+        return (value or {}).get('id')
+    if kind == 'files':
+        return ', '.join(f.get('name', '') for f in value or [])
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value  # number, checkbox, url, email, phone_number, created_time, last_edited_time
+
+
+def flatten_page(page):
+    """A page as one flat row: id, created_time, last_edited_time, then one column per property."""
+    row = {'id': page['id'], 'created_time': page.get('created_time'), 'last_edited_time': page.get('last_edited_time')}
+    for name, prop in (page.get('properties') or {}).items():
+        row[name] = _flatten_property(prop)
+    return row
+
+
+# --- FEED ---
+
+class ChangeFeed:
+    """One batch of the change feed: entries are (last_edited_time, id, page JSON or dict)."""
+
+    def __init__(self, database, entries, next_cursor, has_more):
+        self.database = database
+        self.entries = entries
+        self.next_cursor = next_cursor
+        self.has_more = has_more
+
+    def __len__(self):
+        return len(self.entries)
+
+    def etag(self, fmt='ndjson'):
+        """Changes whenever the batch's rows or their edit times change; cheap (no page is decoded)."""
+        digest = hashlib.sha1(f"{self.database}|{fmt}|{self.next_cursor}".encode('utf-8'))
+        for last_edited_time, page_id, _ in self.entries:
+            digest.update(f"|{page_id}@{last_edited_time}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def rows(self):
+        """Flattened rows, decoded one at a time."""
+        for _, _, page in self.entries:
+            yield flatten_page(json.loads(page) if isinstance(page, str) else page)
+
+
+def _database_id(database):
+    if database not in mirror.MIRRORED_DATABASES:
+        raise ValueError(f"Unknown database: {database}. Use one of: {', '.join(mirror.MIRRORED_DATABASES)}")
+    database_id = getattr(Config, mirror.MIRRORED_DATABASES[database])
+    if not database_id:
+        raise ValueError(f"The {database} database id is not configured.")
+    return database_id
+
+
+def _entries_from_mirror(database, position, limit):
+    mirror.ensure_fresh(database)
+    last_edited_time, page_id = position
+    page = mirror.MirroredPage
+    query = (page.select(page.id, page.last_edited_time, page.data)
+             .where((page.database == database) &
+                    ((page.last_edited_time > last_edited_time) |
+                     ((page.last_edited_time == last_edited_time) & (page.id > page_id))))
+             .order_by(page.last_edited_time, page.id)
+             .limit(limit + 1)
+             .tuples())
+    return [(row_time, row_id, data) for row_id, row_time, data in query]
+
+
+def _entries_from_notion(database_id, position, limit):
+    last_edited_time, page_id = position
+    filters = None
+    if last_edited_time:
+        filters = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": last_edited_time}}
+    sorts = [{"timestamp": "last_edited_time", "direction": "ascending"}]
+    entries, cutoff = [], None
+    for page in notion_client.iter_notion_database_pages(database_id, filters=filters, sorts=sorts,
+                                                         page_size=limit + 1):
+        entry = (page.get('last_edited_time', ''), page['id'], page)
+        if cutoff is not None and entry[0] > cutoff:
+            break  # Pages come in time order, so nothing later can be among the first limit + 1
+        if (entry[0], entry[1]) > position:
+            entries.append(entry)
+            if cutoff is None and len(entries) > limit:
+                # Keep reading only the rest of this timestamp: Notion does not order pages within one
+                cutoff = entry[0]
+    entries.sort(key=lambda entry: (entry[0], entry[1]))
+    return entries[:limit + 1]
+
+
+def changes(database, since=None, cursor=None, limit=None):
+    """
+    The next batch of rows of `database` (a mirror name such as 'transactions') after `cursor`,
+    or edited at/after `since` (an ISO timestamp) when there is no cursor. Returns a ChangeFeed;
+    pass its next_cursor to the following call.
+    """
+    database_id = _database_id(database)
+    limit = min(max(1, int(limit or Config.EXPORT_PAGE_SIZE)), Config.EXPORT_MAX_PAGE_SIZE)
+    position = _start_position(since, cursor)
+    if mirror.is_enabled():
+        entries = _entries_from_mirror(database, position, limit)
+    else:
+        entries = _entries_from_notion(database_id, position, limit)
+
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        next_cursor = encode_cursor(*position)
+    elif has_more:
+        next_cursor = encode_cursor(entries[-1][0], entries[-1][1])
+    else:
+        # Caught up: rewind to the newest (minute-precision) timestamp so late edits within it are re-sent
+        next_cursor = encode_cursor(entries[-1][0])
+    return ChangeFeed(database, entries, next_cursor, has_more)
+
+
+# --- SERIALIZATION ---
+
+def to_ndjson(feed):
+    """Streams the feed as newline-delimited JSON."""
+    for row in feed.rows():
+        yield json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def to_parquet(rows):
+    """Rows (dicts) -> Parquet bytes. Needs pyarrow."""
+    import pandas as pd
+
+    try:
+        import pyarrow  # noqa: F401  (pandas picks it up as the Parquet engine)
+    except ImportError:
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow).")
+    frame = pd.DataFrame(list(rows))
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+# --- CLI ---
+
+def _load_state(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(path, state):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export rows created or edited since a cursor/watermark.")
+    parser.add_argument('database', help=f"One of: {', '.join(mirror.MIRRORED_DATABASES)}")
+    parser.add_argument('--since', help="ISO timestamp to start from (ignored when a cursor is known)")
+    parser.add_argument('--cursor', help="Cursor from a previous export")
+    parser.add_argument('--state', help="JSON file that remembers the cursor per database between runs")
+    parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--out', help="Output file (NDJSON is appended; default: stdout). Required for Parquet.")
+    parser.add_argument('--limit', type=int, help="Rows per batch")
+    args = parser.parse_args(argv)
+    if args.format == 'parquet' and not args.out:
+        parser.error("--out is required for Parquet")
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    state = _load_state(args.state) if args.state else {}
+    cursor = args.cursor or state.get(args.database)
+    out = open(args.out, 'a', encoding='utf-8') if args.out and args.format == 'ndjson' else sys.stdout
+    collected, total = [], 0
+    try:
+        while True:
+            feed = changes(args.database, since=args.since, cursor=cursor, limit=args.limit)
+            if args.format == 'ndjson':
+                out.writelines(to_ndjson(feed))
+            else:
+                collected.extend(feed.rows())
+            total += len(feed)
+            cursor = feed.next_cursor
+            if not feed.has_more:
+                break
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if args.format == 'parquet':
+        with open(args.out, 'wb') as f:
+            f.write(to_parquet(collected))
+    if args.state:
+        state[args.database] = cursor
+        _save_state(args.state, state)
+    log.info(f"Exported {total} {args.database} rows; next cursor {cursor}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
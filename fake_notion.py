@@ -0,0 +1,389 @@
+# fake_notion.py
+"""Local stand-in for the parts of the Notion API this app uses, for benchmarks and offline runs."""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Config attribute -> env var and fixed id of each fake database
+DATABASES = {
+    'TRANSACTIONS_DB_ID': ('NOTION_TRANSACTIONS_DB_ID', '10000000000000000000000000000001'),
+    'ACCOUNTS_DB_ID': ('NOTION_ACCOUNTS_DB_ID', '10000000000000000000000000000002'),
+    'CATEGORIES_DB_ID': ('NOTION_CATEGORIES_DB_ID', '10000000000000000000000000000003'),
+    'PILLARS_DB_ID': ('NOTION_PILLARS_DB_ID', '10000000000000000000000000000004'),
+    'INVESTMENT_TRANSACTIONS_DB_ID': ('NOTION_INVESTMENT_TRANSACTIONS_DB_ID', '10000000000000000000000000000005'),
+    'HOLDINGS_DB_ID': ('NOTION_HOLDINGS_DB_ID', '10000000000000000000000000000006'),
+}
+TICKERS = ('AAPL', 'MSFT', 'INTC', 'VOO', 'NVDA')
+API_KEY = 'secret_fake'
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def _rich_text(value):
+    return [{'type': 'text', 'text': {'content': value}, 'plain_text': value}]
+
+
+def _response_properties(properties):
+    """Request-style property values -> the shape Notion returns (plain_text filled in)."""
+    result = {}
+    for name, value in properties.items():
+        value = dict(value)
+        for kind in ('title', 'rich_text'):
+            if kind in value:
+                value[kind] = [dict(item, plain_text=item.get('plain_text', item.get('text', {}).get('content', '')),
+                                    type='text') for item in value[kind] or []]
+        result[name] = value
+    return result
+
+
+class FakeNotion:
+    """The in-memory workspace plus fault injection."""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_probability=0.0, max_rps=None, retry_after=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_probability = rate_limit_probability
+        self.max_rps = max_rps
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.pages = {}  # page id -> page
+        self.by_database = defaultdict(list)  # normalized database id -> [page id] in creation order
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'by_endpoint': defaultdict(int)}
+        self._window = []  # Request timestamps of the last second, for max_rps
+
+    # --- Data ---
+
+    def add_page(self, database_id, properties, created_time=None):
+        page_id = str(uuid.UUID(int=self.random.getrandbits(128)))
+        created_time = created_time or _now()
+        page = {'object': 'page', 'id': page_id, 'created_time': created_time, 'last_edited_time': created_time,
+                'parent': {'type': 'database_id', 'database_id': database_id}, 'archived': False, 'in_trash': False,
+                'properties': _response_properties(properties)}
+        with self.lock:
+            self.pages[page_id] = page
+            self.by_database[database_id.replace('-', '')].append(page_id)
+        return page
+
+    def update_page(self, page_id, payload):
+        with self.lock:
+            page = self.pages.get(page_id)
+            if page is None:
+                return None
+            page['properties'].update(_response_properties(payload.get('properties', {})))
+            if 'archived' in payload:
+                page['archived'] = page['in_trash'] = bool(payload['archived'])
+            page['last_edited_time'] = _now()
+            return json.loads(json.dumps(page))
+
+    def seed(self, transactions=1000, investment_transactions=200):
+        ids = {attr: database_id for attr, (_, database_id) in DATABASES.items()}
+        start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+        def stamp(i):
+            return (start + timedelta(minutes=i)).strftime('%Y-%m-%dT%H:%M:00.000Z')
+
+        accounts = []
+        for i, (name, investment) in enumerate([('Checking', False), ('Savings', False), ('Credit Card', False),
+                                                ('Brokerage', True), ('Pension', True)]):
+            accounts.append(self.add_page(ids['ACCOUNTS_DB_ID'], {
+                'Name': {'title': _rich_text(name)}, 'Is Investment Account?': {'checkbox': investment}}, stamp(i)))
+        pillars = [self.add_page(ids['PILLARS_DB_ID'], {'Name': {'title': _rich_text(name)}}, stamp(i))
+                   for i, name in enumerate(['Needs', 'Wants', 'Savings'])]
+        categories = []
+        for i, (name, category_type, children) in enumerate([
+                ('Food', 'Expense', ['Groceries', 'Restaurants', 'Other Food']),
+                ('Housing', 'Expense', ['Rent', 'Utilities']),
+                ('Transport', 'Expense', ['Fuel', 'Public Transport']),
+                ('Other', 'Expense', []),
+                ('Salary', 'Income', []),
+                ('Side Income', 'Income', ['Freelance', 'Interest'])]):
+            parent = self.add_page(ids['CATEGORIES_DB_ID'], {
+                'Name': {'title': _rich_text(name)}, 'Type': {'select': {'name': category_type}}}, stamp(i))
+            categories.append(parent)
+            for child in children:
+                categories.append(self.add_page(ids['CATEGORIES_DB_ID'], {
+                    'Name': {'title': _rich_text(child)}, 'Type': {'select': {'name': category_type}},
+                    'Parent Category': {'relation': [{'id': parent['id']}]}}, stamp(i)))
+
+        cash_accounts = [a for a in accounts if not a['properties']['Is Investment Account?']['checkbox']]
+        investment_accounts = [a for a in accounts if a['properties']['Is Investment Account?']['checkbox']]
+        for i in range(transactions):
+            expense = self.random.random() < 0.85
+            amount = round(self.random.uniform(5, 500), 2)
+            self.add_page(ids['TRANSACTIONS_DB_ID'], {
+                'Description': {'title': _rich_text(f"Seeded transaction {i}")},
+                'Amount': {'number': -amount if expense else amount * 10},
+                'Transaction Date': {'date': {'start': (start + timedelta(hours=i)).strftime('%Y-%m-%d')}},
+                'Type': {'select': {'name': 'Expense' if expense else 'Income'}},
+                'Account': {'relation': [{'id': self.random.choice(cash_accounts)['id']}]},
+                'Category': {'relation': [{'id': self.random.choice(categories)['id']}]},
+                'Pillar': {'relation': [{'id': self.random.choice(pillars)['id']}]},
+                'Currency': {'select': {'name': 'ILS'}}}, stamp(i))
+        for i in range(investment_transactions):
+            ticker = self.random.choice(TICKERS)
+            self.add_page(ids['INVESTMENT_TRANSACTIONS_DB_ID'], {
+                'Transaction Name': {'title': _rich_text(f"Buy {ticker}")},
+                'Date': {'date': {'start': (start + timedelta(hours=i)).strftime('%Y-%m-%d')}},
+                'Action': {'select': {'name': 'Buy'}},
+                'Account': {'relation': [{'id': self.random.choice(investment_accounts)['id']}]},
+                'Ticker': {'rich_text': _rich_text(ticker)}, 'Quantity': {'number': 10},
+                'Price Per Share USD': {'number': round(self.random.uniform(20, 400), 2)},
+                'Currency': {'select': {'name': 'USD'}}}, stamp(i))
+        # Large positions, so benchmark sells never run out of shares
+        for account in investment_accounts:
+            for ticker in TICKERS:
+                self.add_page(ids['HOLDINGS_DB_ID'], {
+                    'Holding ID': {'title': _rich_text(f"{ticker} ({account['properties']['Name']['title'][0]['plain_text']})")},
+                    'Ticker': {'rich_text': _rich_text(ticker)}, 'Account': {'relation': [{'id': account['id']}]},
+                    'Quantity': {'number': 1_000_000}, 'Total Cost Basis USD': {'number': 100_000_000}})
+        return self
+
+    # --- Queries ---
+
+    def _matches(self, page, condition):
+        if 'and' in condition:
+            return all(self._matches(page, c) for c in condition['and'])
+        if 'or' in condition:
+            return any(self._matches(page, c) for c in condition['or'])
+        if 'timestamp' in condition:
+            kind = condition['timestamp']
+            return _compare(page.get(kind, ''), condition[kind])
+        prop = page['properties'].get(condition.get('property'), {})
+        for kind in ('rich_text', 'title'):
+            if kind in condition:
+                text = ''.join(t.get('plain_text', '') for t in prop.get('title') or prop.get('rich_text') or [])
+                rule = condition[kind]
+                if 'equals' in rule: return text == rule['equals']
+                if 'contains' in rule: return rule['contains'] in text
+                if 'starts_with' in rule: return text.startswith(rule['starts_with'])
+                if 'is_empty' in rule: return not text
+                raise ValueError(f"Unsupported {kind} filter: {rule}")
+        if 'relation' in condition:
+            rule = condition['relation']
+            ids = [r['id'] for r in prop.get('relation', [])]
+            if 'contains' in rule: return rule['contains'] in ids
+            if 'is_empty' in rule: return not ids
+            raise ValueError(f"Unsupported relation filter: {rule}")
+        if 'select' in condition:
+            rule = condition['select']
+            name = (prop.get('select') or {}).get('name')
+            if 'equals' in rule: return name == rule['equals']
+            if 'is_empty' in rule: return name is None
+            raise ValueError(f"Unsupported select filter: {rule}")
+        if 'checkbox' in condition:
+            return bool(prop.get('checkbox')) == condition['checkbox'].get('equals')
+        if 'number' in condition:
+            return _compare(prop.get('number'), condition['number'])
+        if 'date' in condition:
+            return _compare((prop.get('date') or {}).get('start'), condition['date'])
+        raise ValueError(f"Unsupported filter: {condition}")
+
+    def query(self, database_id, body, filter_properties=None):
+        with self.lock:
+            page_ids = list(self.by_database.get(database_id.replace('-', ''), []))
+            pages = [self.pages[page_id] for page_id in page_ids]
+        if not pages and database_id.replace('-', '') not in {d for _, d in DATABASES.values()}:
+            return None
+        pages = [p for p in pages if not p['archived']]
+        if body.get('filter'):
+            pages = [p for p in pages if self._matches(p, body['filter'])]
+        for sort in reversed(body.get('sorts') or []):
+            if 'timestamp' in sort:
+                key = lambda p, s=sort: p.get(s['timestamp'], '')
+            else:
+                key = lambda p, s=sort: _sort_value(p['properties'].get(s['property'], {}))
+            pages.sort(key=key, reverse=sort.get('direction') == 'descending')
+
+        start = int(body.get('start_cursor') or 0)
+        page_size = max(1, min(int(body.get('page_size') or 100), 100))
+        results = pages[start:start + page_size]
+        has_more = start + page_size < len(pages)
+        results = json.loads(json.dumps(results))
+        if filter_properties:
+            for page in results:
+                page['properties'] = {k: v for k, v in page['properties'].items() if k in filter_properties}
+        return {'object': 'list', 'results': results, 'has_more': has_more,
+                'next_cursor': str(start + page_size) if has_more else None, 'type': 'page_or_database'}
+
+    # --- Fault injection ---
+
+    def should_rate_limit(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.max_rps:
+                self._window = [t for t in self._window if now - t < 1.0]
+                if len(self._window) >= self.max_rps:
+                    return True
+                self._window.append(now)
+            return self.rate_limit_probability and self.random.random() < self.rate_limit_probability
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+
+def _compare(value, rule):
+    if value is None:
+        return 'is_empty' in rule
+    for op, expected in rule.items():
+        if op == 'is_empty': return False
+        if op == 'is_not_empty': return True
+        checks = {'equals': value == expected, 'on_or_after': value >= expected, 'after': value > expected,
+                  'on_or_before': value <= expected, 'before': value < expected,
+                  'greater_than': value > expected, 'greater_than_or_equal_to': value >= expected,
+                  'less_than': value < expected, 'less_than_or_equal_to': value <= expected}
+        if op not in checks:
+            raise ValueError(f"Unsupported condition: {op}")
+        if not checks[op]:
+            return False
+    return True
+
+
+def _sort_value(prop):
+    for kind in ('title', 'rich_text'):
+        if kind in prop:
+            return ''.join(t.get('plain_text', '') for t in prop[kind])
+    if 'number' in prop: return prop['number'] or 0
+    if 'date' in prop: return (prop['date'] or {}).get('start') or ''
+    if 'select' in prop: return (prop['select'] or {}).get('name') or ''
+    return ''
+
+
+class Handler(BaseHTTPRequestHandler):
+    notion = None  # Set by make_server
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, code, message, headers=None):
+        with self.notion.lock:
+            self.notion.stats['errors'] += 1
+        self._send(status, {'object': 'error', 'status': status, 'code': code, 'message': message}, headers)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        body = self._body() if method in ('POST', 'PATCH') else {}
+        if parts[:2] == ['_fake', 'stats']:
+            with self.notion.lock:
+                return self._send(200, dict(self.notion.stats, by_endpoint=dict(self.notion.stats['by_endpoint'])))
+
+        endpoint = f"{method} /{'/'.join(parts[:2])}" + ('/{id}/' + parts[3] if len(parts) > 3 else
+                                                         '/{id}' if len(parts) == 3 else '')
+        with self.notion.lock:
+            self.notion.stats['requests'] += 1
+            self.notion.stats['by_endpoint'][endpoint] += 1
+        if self.headers.get('Authorization') != f"Bearer {API_KEY}":
+            return self._error(401, 'unauthorized', 'API token is invalid.')
+        self.notion.delay()
+        if self.notion.should_rate_limit():
+            with self.notion.lock:
+                self.notion.stats['rate_limited'] += 1
+            return self._error(429, 'rate_limited', 'You have been rate limited.',
+                               {'Retry-After': str(self.notion.retry_after)})
+
+        try:
+            if method == 'POST' and parts[:2] == ['v1', 'databases'] and len(parts) == 4 and parts[3] == 'query':
+                result = self.notion.query(parts[2], body, parse_qs(url.query).get('filter_properties'))
+                if result is None:
+                    return self._error(404, 'object_not_found', f"Could not find database with ID: {parts[2]}.")
+                return self._send(200, result)
+            if method == 'POST' and parts == ['v1', 'pages']:
+                database_id = body.get('parent', {}).get('database_id')
+                if not database_id:
+                    return self._error(400, 'validation_error', 'body.parent.database_id should be defined.')
+                return self._send(200, self.notion.add_page(database_id, body.get('properties', {})))
+            if method == 'PATCH' and parts[:2] == ['v1', 'pages'] and len(parts) == 3:
+                page = self.notion.update_page(parts[2], body)
+                if page is None:
+                    return self._error(404, 'object_not_found', f"Could not find page with ID: {parts[2]}.")
+                return self._send(200, page)
+        except ValueError as e:
+            return self._error(400, 'validation_error', str(e))
+        return self._error(400, 'invalid_request_url', 'Invalid request URL.')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_GET(self):
+        self._handle('GET')
+
+
+def make_server(notion, host='127.0.0.1', port=0):
+    handler = type('BoundHandler', (Handler,), {'notion': notion})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start(notion=None, host='127.0.0.1', port=0, **options):
+    """Starts a seeded fake on a background thread. Returns (server, base_url); stop with server.shutdown()."""
+    notion = notion or FakeNotion(**options).seed()
+    server = make_server(notion, host, port)
+    threading.Thread(target=server.serve_forever, name='fake-notion', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def app_environment(base_url):
+    """Environment variables that point the app at the fake."""
+    env = {'NOTION_API_BASE_URL': base_url, 'NOTION_API_KEY': API_KEY}
+    env.update({var: database_id for var, database_id in DATABASES.values()})
+    return env
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Notion API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--transactions', type=int, default=1000, help="Seeded Transactions rows")
+    parser.add_argument('--investment-transactions', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0, help="Added latency per request, in ms")
+    parser.add_argument('--jitter', type=float, default=0, help="Random +/- latency, in ms")
+    parser.add_argument('--rate-limit', type=float, default=0, help="Probability of answering 429")
+    parser.add_argument('--max-rps', type=float, help="Answer 429 above this many requests per second")
+    args = parser.parse_args(argv)
+
+    notion = FakeNotion(latency=args.latency / 1000, jitter=args.jitter / 1000,
+                        rate_limit_probability=args.rate_limit, max_rps=args.max_rps)
+    notion.seed(args.transactions, args.investment_transactions)
+    server = make_server(notion, args.host, args.port)
+    base_url = f"http://{args.host}:{server.server_address[1]}/v1"
+    print("Fake Notion listening. Point the app at it with:")
+    for name, value in app_environment(base_url).items():
+        print(f"export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
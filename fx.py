@@ -0,0 +1,317 @@
+# fx.py
+"""Local store of historical daily FX rates (one memory-mapped file per currency), and vectorized conversion."""
+import argparse
+import csv
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+PIVOT = 'USD'
+RATE_DTYPE = np.dtype([('day', '<i4'), ('rate', '<f8')])
+CONVERSION_PREFIX = 'Convert:'  # Transaction Name prefix of the legs log_investment_transaction writes
+SEED_MARKER = '.seeded'  # Touched in FX_STORE_DIR after each seed; its mtime is the last seed time
+
+_lock = threading.Lock()
+_arrays = {}  # currency -> ((inode, mtime_ns, size), memmapped array)
+_seed_lock = threading.Lock()
+_seed_checked_at = None  # When this process last checked the seed marker
+
+
+# --- STORE ---
+
+def _path(currency):
+    return os.path.join(Config.FX_STORE_DIR, f"{currency.upper()}.npy")
+
+
+def to_days(dates):
+    """ISO dates (strings, datetime64, or None) -> int64 days since the epoch; missing dates are -1."""
+    values = np.asarray(dates, dtype='datetime64[D]')
+    return np.where(np.isnat(values), -1, values.astype(np.int64))
+
+
+def _load(currency):
+    """The (day, rate) array of a currency, memory-mapped; None when the store has no rates for it."""
+    path = _path(currency)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _arrays.get(currency)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    array = np.load(path, mmap_mode='r')
+    _arrays[currency] = (signature, array)
+    return array
+
+
+def currencies():
+    """Currencies with stored rates (the pivot always converts)."""
+    ensure_seeded()
+    if not os.path.isdir(Config.FX_STORE_DIR):
+        return [PIVOT]
+    stored = {name[:-4] for name in os.listdir(Config.FX_STORE_DIR) if name.endswith('.npy')}
+    return sorted(stored | {PIVOT})
+
+
+@contextmanager
+def _write_lock(currency):
+    """Serializes the read-merge-replace of one currency's file across threads and processes."""
+    os.makedirs(Config.FX_STORE_DIR, exist_ok=True)
+    with _lock, open(_path(currency) + '.lock', 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the file is closed
+        yield
+
+
+def add_rates(currency, dates, rates):
+    """
+    Merges daily rates (units of `currency` per 1 USD) into the store. A day that already has a
+    rate is overwritten. Returns the number of days stored for the currency.
+    """
+    currency = currency.upper()
+    if currency == PIVOT:
+        return 0
+    days = to_days(dates)
+    rates = np.asarray(rates, dtype=np.float64)
+    valid = (days >= 0) & np.isfinite(rates) & (rates > 0)
+    if not valid.any():
+        return 0
+    incoming = np.empty(int(valid.sum()), dtype=RATE_DTYPE)
+    incoming['day'], incoming['rate'] = days[valid], rates[valid]
+
+    with _write_lock(currency):
+        # Read under the file lock, so a merge another worker just finished is included
+        existing = _load(currency)
+        merged = incoming if existing is None else np.concatenate([np.asarray(existing), incoming])
+        # Stable sort by day, then keep the last entry of each day, so new rates win
+        merged = merged[np.argsort(merged['day'], kind='stable')]
+        last_of_day = np.append(merged['day'][1:] != merged['day'][:-1], True)
+        merged = merged[last_of_day]
+        temporary = _path(currency) + f".{os.getpid()}.tmp"
+        with open(temporary, 'wb') as f:
+            np.save(f, merged)
+        os.replace(temporary, _path(currency))
+        _arrays.pop(currency, None)
+    return len(merged)
+
+
+# --- LOOKUPS ---
+
+def rates_as_of(currency, days):
+    """Units of `currency` per 1 USD as of each day (int days, see to_days); NaN where no rate is known yet."""
+    days = np.asarray(days, dtype=np.int64)
+    if currency.upper() == PIVOT:
+        return np.where(days >= 0, 1.0, np.nan)
+    ensure_seeded()
+    array = _load(currency.upper())
+    if array is None or len(array) == 0:
+        return np.full(days.shape, np.nan)
+    index = np.searchsorted(array['day'], days, side='right') - 1
+    found = (index >= 0) & (days >= 0)
+    return np.where(found, np.asarray(array['rate'])[np.clip(index, 0, None)], np.nan)
+
+
+def convert(amounts, currencies, dates, to):
+    """
+    Converts amounts (each in its own currency, on its own date) to `to`, at the as-of rate of
+    each date. Returns a float array; NaN where either currency had no rate yet on that date.
+    """
+    amounts = np.asarray(amounts, dtype=np.float64)
+    currencies = np.asarray(currencies, dtype=object)
+    days = to_days(dates)
+    if days.shape != amounts.shape:
+        days = np.broadcast_to(days, amounts.shape)
+    result = np.full(amounts.shape, np.nan)
+    target = rates_as_of(to, days)
+    for currency in {c for c in currencies.tolist() if c}:
+        mask = currencies == currency
+        if currency.upper() == to.upper():
+            result[mask] = amounts[mask]
+            continue
+        result[mask] = amounts[mask] / rates_as_of(currency, days[mask]) * target[mask]
+    return result
+
+
+def month_average_rates(currencies, months, to):
+    """
+    Average daily rate (units of `to` per 1 unit of each currency) over each YYYY-MM month, for
+    converting monthly totals. NaN where no rate covers the month.
+    """
+    pairs = list(zip(currencies, months))
+    result = np.full(len(pairs), np.nan)
+    by_pair = defaultdict(list)
+    for i, pair in enumerate(pairs):
+        by_pair[pair].append(i)
+    for (currency, month), positions in by_pair.items():
+        if not currency or not month:
+            continue
+        start = np.datetime64(month[:7], 'M')
+        days = np.arange(start.astype('datetime64[D]'), (start + 1).astype('datetime64[D]')).astype(np.int64)
+        if currency.upper() == to.upper():
+            result[positions] = 1.0
+            continue
+        daily = rates_as_of(to, days) / rates_as_of(currency, days)
+        if np.isfinite(daily).any():
+            result[positions] = np.nanmean(daily)
+    return result
+
+
+# --- SOURCES ---
+
+def conversion_rates(trades):
+    """
+    (date, currency, units per USD) from logged Money Conversions: the Withdrawal and Deposit legs
+    of one conversion share an account and a date, and were created back to back.
+    """
+    legs = defaultdict(lambda: {'Withdrawal': [], 'Deposit': []})
+    for trade in trades:
+        if (trade.name or '').startswith(CONVERSION_PREFIX) and trade.action in ('Withdrawal', 'Deposit'):
+            legs[(trade.account_id, trade.date)][trade.action].append(trade)
+    quotes = []
+    for (_, date), group in legs.items():
+        withdrawals = sorted(group['Withdrawal'], key=lambda t: t.created_time or '')
+        deposits = sorted(group['Deposit'], key=lambda t: t.created_time or '')
+        for sold, bought in zip(withdrawals, deposits):
+            if not sold.price or not bought.price or not sold.currency or not bought.currency:
+                continue
+            if sold.currency == PIVOT and bought.currency != PIVOT:
+                quotes.append((date, bought.currency, abs(bought.price) / abs(sold.price)))
+            elif bought.currency == PIVOT and sold.currency != PIVOT:
+                quotes.append((date, sold.currency, abs(sold.price) / abs(bought.price)))
+    return quotes
+
+
+def record_conversion(date, from_currency, from_amount, to_currency, to_amount):
+    """Stores the rate implied by one Money Conversion (called as conversions are logged)."""
+    if from_currency == to_currency or not from_amount or not to_amount or PIVOT not in (from_currency, to_currency):
+        return
+    if to_currency == PIVOT:
+        add_rates(from_currency, [date], [abs(from_amount) / abs(to_amount)])
+    else:
+        add_rates(to_currency, [date], [abs(to_amount) / abs(from_amount)])
+
+
+def _add_quotes(quotes):
+    by_currency = defaultdict(lambda: ([], []))
+    for date, currency, rate in quotes:
+        by_currency[currency][0].append(date)
+        by_currency[currency][1].append(rate)
+    return {currency: add_rates(currency, dates, rates) for currency, (dates, rates) in by_currency.items()}
+
+
+def seed_from_notion():
+    """Adds the rate of every logged Money Conversion. Returns {currency: days stored}."""
+    import notion_client
+    import records
+
+    m = notion_client._mirror()
+    if m:
+        m.ensure_fresh('investment_transactions')
+        pages = m.iter_pages('investment_transactions')
+    else:
+        filters = {"property": "Transaction Name", "title": {"starts_with": CONVERSION_PREFIX}}
+        pages = notion_client.iter_notion_database_pages(Config.INVESTMENT_TRANSACTIONS_DB_ID, filters=filters)
+    return _add_quotes(conversion_rates(records.InvestmentTransaction.from_page(page) for page in pages))
+
+
+def ensure_seeded():
+    """
+    Seeds the store from Notion when it was never seeded (a fresh disk) or was last seeded more
+    than FX_SEED_MAX_AGE seconds ago, which also picks up rates other instances recorded. Each
+    process checks at most once per FX_SEED_MAX_AGE; a failed seed is logged and retried then.
+    """
+    global _seed_checked_at
+    max_age = Config.FX_SEED_MAX_AGE
+    if max_age <= 0 or (_seed_checked_at is not None and time.time() - _seed_checked_at < max_age):
+        return
+    with _seed_lock:
+        now = time.time()
+        if _seed_checked_at is not None and now - _seed_checked_at < max_age:
+            return
+        _seed_checked_at = now
+        marker = os.path.join(Config.FX_STORE_DIR, SEED_MARKER)
+        try:
+            if now - os.stat(marker).st_mtime < max_age:
+                return  # Another worker or instance seeded it recently
+        except FileNotFoundError:
+            pass
+        try:
+            seeded = seed_from_notion()
+        except Exception as e:
+            log.warning(f"Could not seed FX rates from Notion: {e}")
+            return
+        os.makedirs(Config.FX_STORE_DIR, exist_ok=True)
+        with open(marker, 'a'):
+            pass
+        os.utime(marker)
+        log.info(f"Seeded FX rates from Notion: {seeded}")
+
+
+def import_rate_file(path, inverse=False, currency=None):
+    """
+    Loads a CSV of daily rates: date,currency,rate (units per 1 USD; with inverse=True, USD per
+    unit). A file without a currency column needs `currency`. Returns {currency: days stored}.
+    """
+    quotes = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            row = {k.strip().lower(): (v or '').strip() for k, v in row.items() if k}
+            row_currency = (row.get('currency') or currency or '').upper()
+            if not row_currency:
+                raise ValueError(f"{path} has no currency column; pass a currency.")
+            try:
+                rate = float(row['rate'])
+            except (KeyError, ValueError):
+                continue
+            if rate > 0:
+                quotes.append((row['date'][:10], row_currency, 1 / rate if inverse else rate))
+    return _add_quotes(quotes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the local FX rate store.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('seed', help="Add rates from the Money Conversions logged in Notion.")
+    import_parser = sub.add_parser('import', help="Add rates from a date,currency,rate CSV file.")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--currency', help="Currency of every row, for files without a currency column")
+    import_parser.add_argument('--inverse', action='store_true', help="Rates are USD per unit, not units per USD")
+    convert_parser = sub.add_parser('convert', help="Convert an amount as of a date.")
+    convert_parser.add_argument('amount', type=float)
+    convert_parser.add_argument('from_currency')
+    convert_parser.add_argument('to_currency')
+    convert_parser.add_argument('--date', default=str(np.datetime64('today')))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.command == 'seed':
+        print(seed_from_notion())
+    elif args.command == 'import':
+        print(import_rate_file(args.path, inverse=args.inverse, currency=args.currency))
+    else:
+        value = convert([args.amount], [args.from_currency.upper()], [args.date], args.to_currency)[0]
+        if np.isnan(value):
+            print(f"No {args.from_currency}/{args.to_currency} rate on or before {args.date}", file=sys.stderr)
+            return 1
+        print(f"{args.amount} {args.from_currency.upper()} = {value:.4f} {args.to_currency.upper()} ({args.date})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+# gunicorn.conf.py
+"""gunicorn settings for the container: preloaded app, prewarmed in the master before the fork."""
+import os
+import time
+
+# Startup phases are timed from here (see startup.py); workers inherit it through the environment
+os.environ.setdefault('APP_BOOT_TIME', str(time.time()))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Threaded workers let one process hold many requests waiting on Notion; their Notion calls share
+# notion_async's connection pool
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+timeout = 30
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported, before any worker is forked
+    import startup
+    from app import app
+    from config import Config
+    if Config.PREWARM_ON_START:
+        startup.prewarm(app)
+    server.log.info(f"Startup: {startup.report()}")
+
+
+def post_fork(server, worker):
+    import metrics
+    import startup
+    metrics.reset()  # Each worker reports only its own requests, not the master's prewarm calls
+    startup.mark('worker_forked')
@@ -0,0 +1,445 @@
+# importer.py
+"""Bulk import of bank / card statements (CSV or OFX) into the Transactions database."""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+from config import Config
+import notion_client
+import records
+
+try:
+    import fcntl
+except ImportError:  # Windows: interrupted upload jobs are not resumed automatically
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d.%m.%Y', '%d-%m-%Y', '%d/%m/%y', '%m/%d/%Y', '%Y%m%d']
+
+# Header names we recognise when no explicit column mapping is given (compared lower-cased)
+DATE_COLUMNS = ['date', 'transaction date', 'posted date', 'posting date', 'value date']
+DESCRIPTION_COLUMNS = ['description', 'payee', 'name', 'merchant', 'memo', 'details']
+AMOUNT_COLUMNS = ['amount', 'transaction amount', 'sum']
+DEBIT_COLUMNS = ['debit', 'withdrawal', 'charge']
+CREDIT_COLUMNS = ['credit', 'deposit']
+
+CHECKPOINT_FLUSH_SECONDS = 2
+DEFAULT_DESCRIPTION = 'Imported transaction'  # Written for rows without a description
+
+_resume_lock = threading.Lock()
+_resumed_pid = None
+
+
+# --- PARSING ---
+
+def _parse_amount(text):
+    """'1,234.50', '(12.00)', '-12', '₪12' -> float. Empty -> None."""
+    text = (text or '').strip()
+    if not text:
+        return None
+    negative = text.startswith('(') and text.endswith(')')
+    cleaned = re.sub(r'[^0-9.\-]', '', text)
+    if not cleaned or cleaned in ('-', '.'):
+        return None
+    value = float(cleaned)
+    return -abs(value) if negative else value
+
+
+def _parse_date(text, date_format=None):
+    text = (text or '').strip()
+    for fmt in [date_format] if date_format else DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date: {text!r}")
+
+
+def _pick_column(fieldnames, explicit, candidates):
+    if explicit:
+        if explicit not in fieldnames:
+            raise ValueError(f"Column {explicit!r} not found in statement (columns: {', '.join(fieldnames)})")
+        return explicit
+    lowered = {name.strip().lower(): name for name in fieldnames}
+    return next((lowered[c] for c in candidates if c in lowered), None)
+
+
+def parse_csv(stream, date_column=None, description_column=None, amount_column=None,
+              debit_column=None, credit_column=None, date_format=None):
+    """
+    Yields {'date', 'description', 'amount'} dicts from a CSV statement. Amounts are signed
+    (negative = money out); statements with separate debit/credit columns are combined.
+    """
+    reader = csv.DictReader(stream)
+    fieldnames = reader.fieldnames or []
+    date_col = _pick_column(fieldnames, date_column, DATE_COLUMNS)
+    description_col = _pick_column(fieldnames, description_column, DESCRIPTION_COLUMNS)
+    amount_col = _pick_column(fieldnames, amount_column, AMOUNT_COLUMNS)
+    debit_col = _pick_column(fieldnames, debit_column, DEBIT_COLUMNS)
+    credit_col = _pick_column(fieldnames, credit_column, CREDIT_COLUMNS)
+    if not date_col or not (amount_col or debit_col or credit_col):
+        raise ValueError(f"Could not find date/amount columns in statement (columns: {', '.join(fieldnames)})")
+
+    for line_number, row in enumerate(reader, start=2):
+        if not any((value or '').strip() for value in row.values()):
+            continue
+        if amount_col:
+            amount = _parse_amount(row.get(amount_col))
+        else:
+            debit = _parse_amount(row.get(debit_col)) if debit_col else None
+            credit = _parse_amount(row.get(credit_col)) if credit_col else None
+            amount = (abs(credit) if credit else 0) - (abs(debit) if debit else 0)
+        if amount is None:
+            log.warning(f"Skipping statement line {line_number}: no amount")
+            continue
+        yield {'date': _parse_date(row.get(date_col), date_format),
+               'description': (row.get(description_col) or '').strip() if description_col else '',
+               'amount': amount}
+
+
+_OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.S | re.I)
+_OFX_FIELD = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+def parse_ofx(stream):
+    """Yields {'date', 'description', 'amount', 'external_id'} dicts from an OFX/QFX statement."""
+    text = stream.read()
+    for block in _OFX_TRANSACTION.findall(text):
+        fields = {tag.upper(): value.strip() for tag, value in _OFX_FIELD.findall(block)}
+        if 'TRNAMT' not in fields or 'DTPOSTED' not in fields:
+            continue
+        yield {'date': _parse_date(fields['DTPOSTED'][:8], '%Y%m%d'),
+               'description': fields.get('NAME') or fields.get('MEMO') or '',
+               'amount': _parse_amount(fields['TRNAMT']),
+               'external_id': fields.get('FITID')}
+
+
+def parse_statement(stream, filename='', **csv_options):
+    """Picks the parser from the file extension (falling back to sniffing for OFX headers)."""
+    if filename.lower().endswith(('.ofx', '.qfx')):
+        return parse_ofx(stream)
+    if not filename.lower().endswith('.csv'):
+        head = stream.read(512)
+        stream.seek(0)
+        if 'OFXHEADER' in head.upper() or '<OFX>' in head.upper():
+            return parse_ofx(stream)
+    return parse_csv(stream, **csv_options)
+
+
+# --- DEDUPE & CHECKPOINTS ---
+
+def _dedupe_key(date, amount, description):
+    return date, round(amount, 2), ' '.join(description.lower().split())
+
+
+def _row_dedupe_key(row):
+    # Keyed on the description actually written, so rows without one match their earlier import
+    return _dedupe_key(row['date'], row['amount'], row['description'] or DEFAULT_DESCRIPTION)
+
+
+def _row_fingerprint(row, occurrence):
+    """Stable id for a statement row; occurrence keeps identical rows on the same day distinct."""
+    raw = row.get('external_id') or f"{row['date']}|{row['amount']:.2f}|{row['description']}|{occurrence}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def existing_transaction_keys(account_id, start_date, end_date):
+    """Multiset of (date, amount, description) already logged for this account in the date range."""
+    filters = {"and": [{"property": "Account", "relation": {"contains": account_id}},
+                       {"property": "Transaction Date", "date": {"on_or_after": start_date}},
+                       {"property": "Transaction Date", "date": {"on_or_before": end_date}}]}
+    keys = Counter()
+    for page in notion_client.iter_notion_database_pages(Config.TRANSACTIONS_DB_ID, filters=filters):
+        transaction = records.Transaction.from_page(page)
+        if transaction.amount is not None:
+            keys[_dedupe_key(transaction.date or '', transaction.amount, transaction.description)] += 1
+    return keys
+
+
+def checkpoint_path(job_id):
+    return os.path.join(Config.IMPORT_DIR, f"{job_id}.checkpoint.json")
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return None
+
+
+def _write_checkpoint(path, state):
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)  # Atomic, so readers never see a half-written file
+
+
+# --- IMPORT ---
+
+def import_statement(rows, account_id, currency='ILS', category_id=None, pillar_id=None, invert_sign=False,
+                     concurrency=None, checkpoint=None, progress=None, dedupe=True):
+    """
+    Imports parsed statement rows into the Transactions database.
+    `checkpoint` is a file path; rows recorded there as done are skipped, so re-running resumes.
+    `progress` is called with the current state dict as rows complete. Returns the final state.
+    """
+    rows = list(rows)
+    state = load_checkpoint(checkpoint) or {}
+    done = set(state.get('done', []))
+    # imported/duplicates carry over from a previous run; failed rows are retried, so start from zero
+    state.update({'status': 'running', 'total': len(rows), 'imported': state.get('imported', 0),
+                  'duplicates': state.get('duplicates', 0), 'failed': 0, 'errors': [], 'started_at': state.get('started_at', time.time())})
+
+    occurrences = Counter()
+    pending, already_done = [], []
+    for row in rows:
+        if invert_sign:
+            row['amount'] = -row['amount']
+        occurrence_key = (row['date'], row['amount'], row['description'])
+        occurrences[occurrence_key] += 1
+        fingerprint = _row_fingerprint(row, occurrences[occurrence_key])
+        (already_done if fingerprint in done else pending).append((fingerprint, row))
+
+    if dedupe and pending:
+        dates = [row['date'] for _, row in pending]
+        existing = existing_transaction_keys(account_id, min(dates), max(dates))
+        # Rows a previous run imported are in Notion too; don't let them mask identical pending rows
+        for _, row in already_done:
+            key = _row_dedupe_key(row)
+            if existing[key] > 0:
+                existing[key] -= 1
+        unique = []
+        for fingerprint, row in pending:
+            key = _row_dedupe_key(row)
+            if existing[key] > 0:
+                existing[key] -= 1
+                state['duplicates'] += 1
+                done.add(fingerprint)
+            else:
+                unique.append((fingerprint, row))
+        pending = unique
+
+    lock = threading.Lock()
+    last_flush = [0.0]
+
+    def _report(force=False):
+        state['done'] = sorted(done)
+        if force or time.monotonic() - last_flush[0] > CHECKPOINT_FLUSH_SECONDS:
+            _write_checkpoint(checkpoint, state)
+            last_flush[0] = time.monotonic()
+        if progress:
+            progress({k: v for k, v in state.items() if k != 'done'})
+
+    def _create(row):
+        notion_client.create_expense_or_income(
+            ttype='expense' if row['amount'] < 0 else 'income',
+            description=row['description'] or DEFAULT_DESCRIPTION,
+            amount=row['amount'], account_id=account_id, category_id=category_id,
+            pillar_id=pillar_id, currency=currency, transaction_date=row['date'])
+
+    _report(force=True)
+    concurrency = concurrency or Config.IMPORT_CONCURRENCY
+    # Bounded submission: never more than `concurrency` creates in flight, so memory stays flat
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='import') as executor:
+        in_flight = {}
+        queue = iter(pending)
+        while True:
+            while len(in_flight) < concurrency:
+                item = next(queue, None)
+                if item is None:
+                    break
+                in_flight[executor.submit(_create, item[1])] = item
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                fingerprint, row = in_flight.pop(future)
+                with lock:
+                    try:
+                        future.result()
+                        done.add(fingerprint)
+                        state['imported'] += 1
+                    except Exception as e:
+                        state['failed'] += 1
+                        if len(state['errors']) < 20:
+                            state['errors'].append(f"{row['date']} {row['description']} {row['amount']}: {e}")
+                    _report()
+
+    state['status'] = 'failed' if state['failed'] else 'done'
+    state['finished_at'] = time.time()
+    _report(force=True)
+    return state
+
+
+def statement_path(job_id):
+    return os.path.join(Config.IMPORT_DIR, f"{job_id}.statement")
+
+
+def _read_statement(job_id, job):
+    with open(statement_path(job_id), 'rb') as f:
+        return _parse_upload(f.read(), job['source'], job['csv_options'])
+
+
+def _parse_upload(data, filename, csv_options):
+    stream = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+    return list(parse_statement(stream, filename, **csv_options))
+
+
+def _lock_job(job_id):
+    """The job's lock file, locked; None when a live process already holds it (the lock dies with its process)."""
+    lock_file = open(os.path.join(Config.IMPORT_DIR, f"{job_id}.lock"), 'a')
+    if fcntl:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
+
+
+def _start_job(job_id, lock_file, rows=None):
+    """Runs a saved job on a background thread, holding its lock until the import finishes."""
+    path = checkpoint_path(job_id)
+    job = load_checkpoint(path)['job']
+
+    def _run():
+        try:
+            job_rows = rows if rows is not None else _read_statement(job_id, job)
+            import_statement(job_rows, job['account_id'], checkpoint=path, **job['options'])
+        except Exception as e:
+            log.error(f"Import job {job_id} failed: {e}")
+            state = load_checkpoint(path) or {}
+            state.update({'status': 'failed', 'errors': state.get('errors', []) + [str(e)]})
+            _write_checkpoint(path, state)
+        finally:
+            lock_file.close()
+
+    threading.Thread(target=_run, name=f"import-{job_id}", daemon=True).start()
+
+
+def start_import_job(stream, filename, account_id, **options):
+    """Saves an uploaded statement to IMPORT_DIR and imports it on a background thread. Returns the job id."""
+    os.makedirs(Config.IMPORT_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex[:12]
+    # Parse up front so a malformed file is reported to the caller straight away
+    csv_options = {k: options.pop(k) for k in list(options) if k.endswith('_column') or k == 'date_format'}
+    data = stream.read()
+    rows = _parse_upload(data, filename, csv_options)
+    lock_file = _lock_job(job_id)
+    with open(statement_path(job_id), 'wb') as f:
+        f.write(data)
+    job = {'source': filename, 'account_id': account_id, 'csv_options': csv_options, 'options': options}
+    _write_checkpoint(checkpoint_path(job_id), {'job_id': job_id, 'source': filename, 'status': 'queued',
+                                                'total': len(rows), 'job': job})
+    _start_job(job_id, lock_file, rows)
+    return job_id
+
+
+def resume_interrupted_jobs():
+    """
+    Restarts the upload jobs left queued or running by a worker that died (nobody holds their
+    lock). Runs once per process; returns the resumed job ids.
+    """
+    global _resumed_pid
+    with _resume_lock:
+        if _resumed_pid == os.getpid():
+            return []
+        _resumed_pid = os.getpid()
+    if fcntl is None or not os.path.isdir(Config.IMPORT_DIR):
+        return []
+    resumed = []
+    for name in sorted(os.listdir(Config.IMPORT_DIR)):
+        job_id = name[:-len('.checkpoint.json')]
+        if not name.endswith('.checkpoint.json') or not re.fullmatch(r'[0-9a-f]{12}', job_id):
+            continue
+        state = load_checkpoint(checkpoint_path(job_id)) or {}
+        if state.get('status') not in ('queued', 'running'):
+            continue
+        lock_file = _lock_job(job_id)
+        if lock_file is None:
+            continue  # Its worker is alive
+        state = load_checkpoint(checkpoint_path(job_id)) or {}  # It may have finished before we locked it
+        if state.get('status') not in ('queued', 'running'):
+            lock_file.close()
+        elif 'job' not in state or not os.path.exists(statement_path(job_id)):
+            state.update({'status': 'failed',
+                          'errors': state.get('errors', []) + ["Interrupted, and its statement was not saved."]})
+            _write_checkpoint(checkpoint_path(job_id), state)
+            lock_file.close()
+        else:
+            log.info(f"Resuming import job {job_id} ({state['job']['source']}) after an interrupted run")
+            _start_job(job_id, lock_file)
+            resumed.append(job_id)
+    return resumed
+
+
+def job_status(job_id):
+    """Progress of an import job, read from its checkpoint (works from any gunicorn worker)."""
+    if not re.fullmatch(r'[0-9a-f]{12}', job_id or ''):
+        return None
+    state = load_checkpoint(checkpoint_path(job_id))
+    if state is not None:
+        state.pop('done', None)
+        state.pop('job', None)
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a CSV/OFX bank statement into the Notion Transactions DB.")
+    parser.add_argument('statement', help="Path to the .csv / .ofx / .qfx export")
+    parser.add_argument('--account', required=True, help="Notion page id of the account")
+    parser.add_argument('--currency', default='ILS')
+    parser.add_argument('--category', help="Category page id to assign to every row")
+    parser.add_argument('--pillar', help="Pillar page id to assign to every row")
+    parser.add_argument('--invert-sign', action='store_true',
+                        help="Statement lists charges as positive numbers (typical for card statements)")
+    parser.add_argument('--concurrency', type=int, default=Config.IMPORT_CONCURRENCY)
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: <statement>.checkpoint.json)")
+    parser.add_argument('--no-dedupe', action='store_true', help="Skip the check against rows already in Notion")
+    parser.add_argument('--date-column')
+    parser.add_argument('--description-column')
+    parser.add_argument('--amount-column')
+    parser.add_argument('--debit-column')
+    parser.add_argument('--credit-column')
+    parser.add_argument('--date-format', help="strptime format, e.g. %%d/%%m/%%Y")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    with open(args.statement, encoding='utf-8-sig', newline='') as f:
+        rows = list(parse_statement(f, args.statement, date_column=args.date_column,
+                                    description_column=args.description_column, amount_column=args.amount_column,
+                                    debit_column=args.debit_column, credit_column=args.credit_column,
+                                    date_format=args.date_format))
+
+    def _print_progress(state):
+        finished = state['imported'] + state['duplicates'] + state['failed']
+        print(f"\r{finished}/{state['total']} rows  imported={state['imported']} "
+              f"duplicates={state['duplicates']} failed={state['failed']}", end='', file=sys.stderr)
+
+    state = import_statement(rows, args.account, currency=args.currency, category_id=args.category,
+                             pillar_id=args.pillar, invert_sign=args.invert_sign, concurrency=args.concurrency,
+                             checkpoint=args.checkpoint or f"{args.statement}.checkpoint.json",
+                             progress=_print_progress, dedupe=not args.no_dedupe)
+    print(file=sys.stderr)
+    for error in state['errors']:
+        print(f"  {error}", file=sys.stderr)
+    return 0 if state['status'] == 'done' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
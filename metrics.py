@@ -0,0 +1,229 @@
+# metrics.py
+"""In-process latency metrics in the Prometheus text format."""
+import bisect
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Function names that never count as "the caller" of a Notion request (transport/cache plumbing)
+INTERNAL_FRAMES = {'notion_api_request', 'iter_notion_database_pages', 'fetch_notion_database_pages',
+                   'fetch_cached_records', 'refresh_metadata', 'get', 'aget', 'refresh', 'wrapper', 'run',
+                   'commit', 'create_page', 'decode'}
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_caller = contextvars.ContextVar('metrics_caller', default=None)
+_default_caller = contextvars.ContextVar('metrics_default_caller', default=None)
+_profile = contextvars.ContextVar('metrics_profile', default=None)
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> Histogram
+_counters = {}  # (name, labels) -> float
+_help = {}  # name -> (type, help text)
+_collectors = []
+
+
+class Histogram:
+    """Cumulative-bucket histogram (le buckets, sum, count), as Prometheus expects."""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def describe(name, metric_type, help_text):
+    """Sets the # TYPE / # HELP lines for a metric."""
+    _help[name] = (metric_type, help_text)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name, value, **labels):
+    key = (name, _label_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+def inc(name, amount=1, **labels):
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_collector(collector):
+    """collector() returns [(name, type, labels, value), ...], read at every scrape."""
+    _collectors.append(collector)
+
+
+# --- SPANS ---
+
+class Span:
+    __slots__ = ('name', 'labels', 'started', 'duration')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.duration = None
+
+
+@contextmanager
+def span(name, **labels):
+    """
+    Times the block into the `<name>_duration_seconds` histogram. Labels can still be changed
+    on the yielded span (e.g. once a response says which database a page belongs to).
+    """
+    current = Span(name, labels)
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.started
+        observe(f"{name}_duration_seconds", current.duration, **current.labels)
+        profile = _profile.get()
+        if profile is not None:
+            profile.append(current)
+
+
+# --- CALLERS ---
+
+def caller_name():
+    """
+    The function this work is done for: an explicit calling() name, else the first app frame on
+    the stack, else the default_caller() of the request (tasks spawned by asyncio.gather have no
+    app frames on their stack), else 'background'.
+    """
+    explicit = _caller.get()
+    if explicit:
+        return explicit
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        name = code.co_name
+        if (code.co_filename.startswith(_APP_DIR) and 'site-packages' not in code.co_filename
+                and code.co_filename != __file__ and not name.startswith(('_', '<'))
+                and name not in INTERNAL_FRAMES):
+            return name
+        frame = frame.f_back
+    return _default_caller.get() or 'background'
+
+
+@contextmanager
+def calling(name):
+    token = _caller.set(name)
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def default_caller(name):
+    """Sets the caller used when the stack has no app frame (e.g. the Flask endpoint); returns a reset token."""
+    return _default_caller.set(name)
+
+
+def reset_default_caller(token):
+    _default_caller.reset(token)
+
+
+def bind(fn):
+    """Wraps fn to run (e.g. on a thread pool) with the current caller and profile."""
+    context = contextvars.copy_context()
+    caller = caller_name()
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        def run_as_caller():
+            with calling(caller):
+                return fn(*args, **kwargs)
+        return context.copy().run(run_as_caller)
+    return bound
+
+
+
+# --- PROFILING ---
+
+def start_profile():
+    """Starts recording every span of the current request; returns the token for finish_profile."""
+    return _profile.set([])
+
+
+def finish_profile(token, top=10):
+    """Stops the profile and returns its slowest spans (longest first)."""
+    spans = _profile.get() or []
+    _profile.reset(token)
+    return sorted(spans, key=lambda s: s.duration, reverse=True)[:top]
+
+
+# --- EXPOSITION ---
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in _histograms.items()}
+        counters = dict(_counters)
+    samples = {}  # name -> (type, [lines])
+    for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+        lines = samples.setdefault(name, ('histogram', []))[1]
+        cumulative = 0
+        for bound, bucket_count in zip(list(buckets) + [float('inf')], counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(float(bound))),))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    for (name, labels), value in sorted(counters.items()):
+        samples.setdefault(name, ('counter', []))[1].append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for collector in _collectors:
+        for name, metric_type, labels, value in collector():
+            samples.setdefault(name, (metric_type, []))[1].append(
+                f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+
+    output = []
+    for name, (metric_type, lines) in samples.items():
+        help_type, help_text = _help.get(name, (metric_type, None))
+        if help_text:
+            output.append(f"# HELP {name} {help_text}")
+        output.append(f"# TYPE {name} {help_type}")
+        output.extend(lines)
+    return '\n'.join(output) + '\n'
+
+
+def reset():
+    """Drops every recorded sample (collectors stay registered)."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
@@ -0,0 +1,247 @@
+# mirror.py
+"""Local SQLite mirror of the Notion databases, synced incrementally by last_edited_time."""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+
+from peewee import SqliteDatabase, Model, CharField, TextField, FloatField, IntegerField
+from playhouse.migrate import SqliteMigrator, migrate
+
+from config import Config
+import notion_client
+from sqlite_store import SqliteStore
+
+log = logging.getLogger(__name__)
+
+# Logical name -> Config attribute holding the Notion database id
+MIRRORED_DATABASES = {
+    'transactions': 'TRANSACTIONS_DB_ID',
+    'accounts': 'ACCOUNTS_DB_ID',
+    'categories': 'CATEGORIES_DB_ID',
+    'pillars': 'PILLARS_DB_ID',
+    'investment_transactions': 'INVESTMENT_TRANSACTIONS_DB_ID',
+    'holdings': 'HOLDINGS_DB_ID',
+}
+
+db = SqliteDatabase(None, pragmas={'journal_mode': 'wal', 'synchronous': 'normal'})
+_sync_locks = {name: threading.Lock() for name in MIRRORED_DATABASES}
+
+
+class BaseModel(Model):
+    class Meta:
+        database = db
+
+
+class MirroredPage(BaseModel):
+    id = CharField(primary_key=True)
+    database = CharField(index=True)
+    created_time = CharField()
+    last_edited_time = CharField()
+    title = CharField(null=True)
+    ticker = CharField(null=True)
+    account_id = CharField(null=True)
+    data = TextField()  # The full page JSON as Notion returned it
+
+    class Meta:
+        indexes = ((('database', 'ticker', 'account_id'), False),
+                   (('database', 'last_edited_time'), False))
+
+
+class SyncState(BaseModel):
+    database = CharField(primary_key=True)
+    watermark = CharField(null=True)  # Highest last_edited_time seen
+    synced_at = FloatField(default=0)
+    full_synced_at = FloatField(default=0)  # Last sync that also dropped deleted pages
+    row_count = IntegerField(default=0)
+
+
+def is_enabled():
+    return bool(Config.MIRROR_DB_PATH)
+
+
+def _add_missing_columns():
+    # Mirrors created before full_synced_at existed get the column (0: the next sync is a full one)
+    columns = {column.name for column in db.get_columns(SyncState._meta.table_name)}
+    if 'full_synced_at' not in columns:
+        migrate(SqliteMigrator(db).add_column(SyncState._meta.table_name, 'full_synced_at', SyncState.full_synced_at))
+
+
+_store = SqliteStore(db, 'MIRROR_DB_PATH', [MirroredPage, SyncState], setup=_add_missing_columns)
+init = _store.init
+_ensure_init = _store.ensure_init
+
+
+def database_name_for(database_id):
+    """Maps a Notion database id (dashed or not) to its logical mirror name."""
+    wanted = notion_client._normalize_id(database_id)
+    for name, attr in MIRRORED_DATABASES.items():
+        configured = getattr(Config, attr)
+        if configured and notion_client._normalize_id(configured) == wanted:
+            return name
+    return None
+
+
+def _row_for_page(page, database):
+    properties = page.get('properties', {})
+    title = next((''.join(t.get('plain_text', '') for t in prop.get('title', []))
+                  for prop in properties.values() if 'title' in prop), None)
+    ticker = ''.join(t.get('plain_text', '') for t in properties.get('Ticker', {}).get('rich_text', [])) or None
+    account_relation = properties.get('Account', {}).get('relation', [])
+    return {
+        'id': page['id'],
+        'database': database,
+        'created_time': page.get('created_time', ''),
+        'last_edited_time': page.get('last_edited_time', ''),
+        'title': title,
+        'ticker': ticker,
+        'account_id': account_relation[0]['id'] if account_relation else None,
+        'data': json.dumps(page, separators=(',', ':')),
+    }
+
+
+def _upsert_rows(rows):
+    # Stay under SQLite's bound-variable limit (8 columns per row)
+    for i in range(0, len(rows), 100):
+        MirroredPage.insert_many(rows[i:i + 100]).on_conflict_replace().execute()
+
+
+def upsert_page(page, database=None):
+    """Writes a single page (e.g. the response of a create/update) into the mirror."""
+    if not is_enabled():
+        return
+    database = database or database_name_for(page.get('parent', {}).get('database_id'))
+    if not database:
+        return
+    _ensure_init()
+    if page.get('archived') or page.get('in_trash'):
+        MirroredPage.delete().where(MirroredPage.id == page['id']).execute()
+    else:
+        _upsert_rows([_row_for_page(page, database)])
+
+
+def sync(databases=None, full=False):
+    """Pulls pages edited since each watermark; a full or overdue sync also drops deleted pages. Returns {db: rows}."""
+    _ensure_init()
+    results = {}
+    for name in databases or MIRRORED_DATABASES:
+        database_id = getattr(Config, MIRRORED_DATABASES[name])
+        if not database_id:
+            log.warning(f"Skipping mirror sync of {name}: database id is not configured.")
+            continue
+        with _sync_locks[name]:
+            results[name] = _sync_database(name, database_id, full)
+    return results
+
+
+def _sync_database(name, database_id, full):
+    started = time.perf_counter()
+    state = SyncState.get_or_none(SyncState.database == name)
+    if state is None or time.time() - state.full_synced_at >= Config.MIRROR_FULL_SYNC_MAX_AGE:
+        full = True  # Deletions and archives are only noticed by a full sync
+    watermark = None if full or state is None else state.watermark
+
+    filters = None
+    if watermark:
+        # last_edited_time is minute-granular, so re-read the watermark minute; upserts make that harmless
+        filters = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": watermark}}
+    sorts = [{"timestamp": "last_edited_time", "direction": "ascending"}]
+
+    reports = notion_client._reporting() if name == 'transactions' else None
+    batch, pages, seen_ids, count = [], [], set(), 0
+    new_watermark = watermark
+    for page in notion_client.iter_notion_database_pages(database_id, filters=filters, sorts=sorts):
+        batch.append(_row_for_page(page, name))
+        if reports:
+            pages.append(page)
+        if full:
+            seen_ids.add(page['id'])
+        if not new_watermark or page.get('last_edited_time', '') > new_watermark:
+            new_watermark = page.get('last_edited_time')
+        count += 1
+        if len(batch) >= 500:
+            with db.atomic():
+                _upsert_rows(batch)
+            if reports:
+                reports.apply_pages(pages)
+            batch, pages = [], []
+
+    stale = []
+    with db.atomic():
+        if batch:
+            _upsert_rows(batch)
+        if full:
+            stale = [p.id for p in MirroredPage.select(MirroredPage.id).where(MirroredPage.database == name)
+                     if p.id not in seen_ids]
+            for i in range(0, len(stale), 500):
+                MirroredPage.delete().where(MirroredPage.id.in_(stale[i:i + 500])).execute()
+        total = MirroredPage.select().where(MirroredPage.database == name).count()
+        now = time.time()
+        SyncState.replace(database=name, watermark=new_watermark, synced_at=now,
+                          full_synced_at=now if full else state.full_synced_at, row_count=total).execute()
+    if reports:
+        # Synced pages feed the materialized reports (see reporting.py)
+        reports.apply_pages(pages)
+        reports.remove_pages(stale)
+
+    log.info(f"Mirror sync of {name}: {count} pages in {time.perf_counter() - started:.2f}s "
+             f"({'full' if full else 'incremental'}, {total} rows mirrored)")
+    return count
+
+
+def is_fresh(database, max_age=None):
+    """True when the database has been synced within max_age seconds (MIRROR_MAX_AGE by default)."""
+    if not is_enabled():
+        return False
+    _ensure_init()
+    state = SyncState.get_or_none(SyncState.database == database)
+    if state is None:
+        return False
+    max_age = Config.MIRROR_MAX_AGE if max_age is None else max_age
+    return time.time() - state.synced_at < max_age
+
+
+def ensure_fresh(database):
+    """Runs an incremental sync of one database if it is older than MIRROR_MAX_AGE."""
+    if not is_fresh(database):
+        sync([database])
+
+
+def iter_pages(database):
+    """Streams the mirrored pages of a database, oldest first (Notion's default query order)."""
+    _ensure_init()
+    query = (MirroredPage.select(MirroredPage.data)
+             .where(MirroredPage.database == database)
+             .order_by(MirroredPage.created_time))
+    for row in query.iterator():
+        yield json.loads(row.data)
+
+
+def get_pages(database):
+    """All mirrored pages of a database, oldest first."""
+    return list(iter_pages(database))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync the local SQLite mirror of the Notion databases.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sync_parser = sub.add_parser('sync', help="Pull changes from Notion into the mirror.")
+    sync_parser.add_argument('databases', nargs='*',
+                             help=f"Databases to sync (default: all). One of: {', '.join(MIRRORED_DATABASES)}")
+    sync_parser.add_argument('--full', action='store_true', help="Reload everything and drop deleted pages.")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.databases if name not in MIRRORED_DATABASES]
+    if unknown:
+        parser.error(f"unknown database(s): {', '.join(unknown)}")
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.command == 'sync':
+        results = sync(args.databases or None, full=args.full)
+        for name, count in results.items():
+            print(f"{name}: {count} pages synced")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+# notion_async.py
+"""Async Notion transport: every Notion request runs on one background event loop with a shared httpx client."""
+import asyncio
+import functools
+import logging
+import os
+import threading
+
+import httpx
+
+from config import Config
+import metrics
+import notion_client
+import records
+from notion_client import (CREATE_RETRYABLE_STATUS_CODES, RETRYABLE_STATUS_CODES, UncertainWriteError, _rate_limiter,
+                           _record_call, _backoff_delay, _note_page_write, _get_auth_headers, _api_url)
+
+log = logging.getLogger(__name__)
+
+_loop = None
+_loop_pid = None
+_loop_thread = None
+_client = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    """Starts (once per process, so it survives gunicorn's fork) the loop thread that owns the HTTP client."""
+    global _loop, _loop_pid, _loop_thread, _client
+    pid = os.getpid()
+    if _loop is not None and _loop_pid == pid:
+        return _loop
+    with _loop_lock:
+        if _loop is None or _loop_pid != pid:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='notion-async-loop', daemon=True)
+            thread.start()
+            # A client inherited from the gunicorn master (prewarm) belongs to the master's loop
+            _loop, _loop_pid, _loop_thread, _client = loop, pid, thread, None
+    return _loop
+
+
+def shutdown(timeout=5):
+    """Closes this process's HTTP client and stops its loop thread; the next request starts new ones."""
+    global _loop, _loop_pid, _loop_thread, _client
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            return
+        loop, thread, client = _loop, _loop_thread, _client
+        _loop = _loop_pid = _loop_thread = _client = None
+    if client is not None:
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout)
+    loop.close()
+
+
+def _get_client():
+    # Only ever called on the background loop, so no lock is needed
+    global _client
+    if _client is None:
+        limits = httpx.Limits(max_connections=Config.NOTION_POOL_SIZE,
+                              max_keepalive_connections=Config.NOTION_POOL_SIZE)
+        _client = httpx.AsyncClient(limits=limits, timeout=Config.NOTION_TIMEOUT, verify=Config.SSL_VERIFY)
+    return _client
+
+
+def _on_client_loop(fn):
+    """Makes a coroutine function run on the background loop, whichever loop awaits it."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        loop = _get_loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            return await fn(*args, **kwargs)
+        # The task copies this context, so the caller name (and any profile) carries over to the loop
+        with metrics.calling(metrics.caller_name()):
+            future = asyncio.run_coroutine_threadsafe(fn(*args, **kwargs), loop)
+        return await asyncio.wrap_future(future)
+    return wrapper
+
+
+def run(coro, timeout=None):
+    """Runs a coroutine from this module on the background loop and blocks for its result (sync wrapper)."""
+    loop = _get_loop()
+    if threading.current_thread().name == 'notion-async-loop':
+        coro.close()
+        raise RuntimeError("Sync Notion calls would deadlock the loop thread; await the async API instead.")
+    # The task copies this context, so the caller name (found on this thread's stack) carries over
+    with metrics.calling(metrics.caller_name()):
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+    return future.result(timeout)
+
+
+@_on_client_loop
+async def notion_api_request(method, url, headers, payload=None, params=None):
+    """The one Notion request path: rate limit, retries, counters and metrics (notion_client wraps it for sync code)."""
+    labels = {'method': method.lower(), 'database': notion_client._database_label(url, payload),
+              'caller': metrics.caller_name(), 'outcome': 'ok'}
+    with metrics.span('notion_request', **labels) as span:
+        try:
+            response_data = await _send_notion_request(method, url, headers, payload, params)
+        except Exception:
+            span.labels['outcome'] = 'error'
+            raise
+        if span.labels['database'] == 'page':
+            span.labels['database'] = notion_client._database_label(url, response_data)
+        return response_data
+
+
+def _request_was_sent(error):
+    """False when the connection was never made (refused, DNS, connect or pool timeout), so Notion cannot have seen it."""
+    return not isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+async def _send_notion_request(method, url, headers, payload=None, params=None):
+    if payload is None: payload = {}
+    method = method.lower()
+    is_page_create = method == 'post' and url.rstrip('/').endswith('/pages')
+    is_write = is_page_create or method == 'patch'
+    retry_statuses = CREATE_RETRYABLE_STATUS_CODES if is_page_create else RETRYABLE_STATUS_CODES
+    client = _get_client()
+    attempt = 0
+
+    while True:
+        wait = _rate_limiter.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        try:
+            response = await client.request(method.upper(), url, headers=headers, params=params,
+                                            json=payload if method in ('post', 'patch') else None)
+        except httpx.TransportError as e:
+            # A read timeout on a create is ambiguous (the page may exist), so only connect failures are retried there
+            can_retry = not is_page_create or not _request_was_sent(e)
+            will_retry = can_retry and attempt < Config.NOTION_MAX_RETRIES
+            _record_call(method, retried=will_retry, error=not will_retry)
+            if will_retry:
+                attempt += 1
+                delay = _backoff_delay(attempt)
+                log.warning(f"Notion request to {url} failed ({e!r}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            log.error(f"Error making Notion API request to {url}: {e!r}")
+            if is_write and _request_was_sent(e):
+                raise UncertainWriteError(f"Notion API Error (it may have been saved, check Notion): {e!r}")
+            raise Exception(f"Notion API Error: {e!r}")
+        except httpx.HTTPError as e:
+            _record_call(method, error=True)
+            log.error(f"Error making Notion API request to {url}: {e!r}")
+            raise Exception(f"Notion API Error: {e!r}")
+
+        status = response.status_code
+        if status in retry_statuses and attempt < Config.NOTION_MAX_RETRIES:
+            retry_after = notion_client._retry_after_seconds(response)
+            _record_call(method, retried=True, rate_limited=status == 429)
+            if status == 429:
+                _rate_limiter.pause(retry_after or 1.0)
+            attempt += 1
+            delay = max(retry_after or 0, _backoff_delay(attempt))
+            log.warning(f"Notion returned {status} for {url}, retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        if response.is_error:
+            _record_call(method, rate_limited=status == 429, error=True)
+            log.error(f"Error making Notion API request to {url}: HTTP {status}")
+            log.error(f"Response body: {response.text}")
+            if is_write and status >= 500 and status != 503:
+                raise UncertainWriteError(f"Notion API Error (it may have been saved, check Notion): {response.text}")
+            raise Exception(f"Notion API Error: {response.text}")
+
+        _record_call(method)
+        response_data = response.json()
+        if method in ('post', 'patch'):
+            # Mirror/report write-through is SQLite work, so keep it off the loop every request shares
+            await asyncio.to_thread(_note_page_write, response_data)
+        return response_data
+
+
+@_on_client_loop
+async def fetch_notion_database_pages(database_id, filters=None, sorts=None, page_size=100, max_rows=None,
+                                      filter_properties=None):
+    """Async twin of notion_client.fetch_notion_database_pages (follows every cursor)."""
+    if not database_id:
+        log.warning("fetch_notion_database_pages called but database_id is missing.")
+        return []
+    url = _api_url(f"databases/{database_id}/query")
+    headers = _get_auth_headers()
+    params = {'filter_properties': list(filter_properties)} if filter_properties else None
+    page_size = max(1, min(page_size, 100))
+    pages, cursor = [], None
+
+    while max_rows is None or len(pages) < max_rows:
+        payload = {'page_size': page_size if max_rows is None else min(page_size, max_rows - len(pages))}
+        if filters: payload['filter'] = filters
+        if sorts: payload['sorts'] = sorts
+        if cursor: payload['start_cursor'] = cursor
+        response_data = await notion_api_request('post', url, headers, payload=payload, params=params)
+        pages.extend(response_data.get('results', []))
+        cursor = response_data.get('next_cursor')
+        if not response_data.get('has_more') or not cursor:
+            break
+    return pages if max_rows is None else pages[:max_rows]
+
+
+async def _load_database_records(database_id):
+    if notion_client._mirror():
+        # The mirror is local SQLite (plus an occasional sync), so keep it off the event loop
+        return await asyncio.to_thread(notion_client._load_database_records, database_id)
+    pages = await fetch_notion_database_pages(database_id)
+    return records.decode(notion_client._record_type(database_id), pages)
+
+
+async def fetch_cached_records(database_id):
+    """Async twin of notion_client.fetch_cached_records; shares the same cache."""
+    if not database_id:
+        log.warning("fetch_cached_records called but database_id is missing.")
+        return records.RecordSet([])
+    return await notion_client._metadata_cache.aget(
+        notion_client._normalize_id(database_id),
+        lambda: notion_client._load_database_records(database_id),
+        lambda: _load_database_records(database_id),
+        notion_client._metadata_ttl(database_id))
+
@@ -1,43 +1,131 @@
 # notion_client.py
-import requests
+import os
+import random
 import time
+import threading
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import logging
-
-from flask import render_template
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from config import Config
+import metrics
+import records
 
 log = logging.getLogger(__name__)
 
-def notion_api_request(method, url, headers, payload=None):
-    """A single, reusable function to make Notion API calls."""
+# --- TRANSPORT ---
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# A page create that failed with a generic 5xx may still have been written, so only retry
+# the responses Notion guarantees were not processed.
+CREATE_RETRYABLE_STATUS_CODES = {429, 503}
+
+
+class UncertainWriteError(Exception):
+    """
+    A page create/update failed in a way that leaves it unknown whether Notion applied it (a
+    timeout after the request was sent, a 5xx other than 503). Replaying it could log it twice.
+    """
+
+
+class TokenBucket:
+    """Thread-safe token bucket. reserve() says how long to wait before a request is allowed."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token and returns how long the caller has to wait before using it."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1  # Going negative queues the caller behind earlier reservations
+            return max(0.0, -self._tokens / self.rate)
+
+    def pause(self, seconds):
+        """Drains the bucket so every thread backs off for roughly `seconds` (used on 429s)."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds * self.rate)
+            self._updated = time.monotonic()
+
+
+# Notion's budget (~3 req/s) is per integration, so split it across the gunicorn workers
+_rate_limiter = TokenBucket(rate=Config.NOTION_REQUESTS_PER_SECOND / max(1, Config.WEB_CONCURRENCY),
+                            capacity=Config.NOTION_RATE_BURST)
+
+def _record_call(method, retried=False, rate_limited=False, error=False):
+    """Counts one HTTP attempt in the /metrics Notion counters."""
+    metrics.inc('notion_attempts_total', method=method)
+    if retried: metrics.inc('notion_retries_total', method=method)
+    if rate_limited: metrics.inc('notion_rate_limited_total', method=method)
+    if error: metrics.inc('notion_errors_total', method=method)
+
+
+def _backoff_delay(attempt):
+    """Exponential backoff with jitter: half fixed, half random."""
+    delay = min(Config.NOTION_BACKOFF_MAX, Config.NOTION_BACKOFF_BASE * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _retry_after_seconds(response):
     try:
-        if payload is None: payload = {}
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+# Database label used in metrics -> Config attribute holding its id
+_DATABASE_LABELS = {
+    'transactions': 'TRANSACTIONS_DB_ID',
+    'accounts': 'ACCOUNTS_DB_ID',
+    'categories': 'CATEGORIES_DB_ID',
+    'pillars': 'PILLARS_DB_ID',
+    'investment_transactions': 'INVESTMENT_TRANSACTIONS_DB_ID',
+    'holdings': 'HOLDINGS_DB_ID',
+}
+
+
+def _database_label(url, data=None):
+    """Which database a request touched: from a query URL, or a page's parent (payload or response)."""
+    database_id = None
+    if '/databases/' in url:
+        database_id = url.split('/databases/', 1)[1].split('/', 1)[0]
+    elif isinstance(data, dict):
+        database_id = data.get('parent', {}).get('database_id')
+    if not database_id:
+        return 'page'
+    wanted = _normalize_id(database_id)
+    return next((label for label, attr in _DATABASE_LABELS.items()
+                 if getattr(Config, attr) and _normalize_id(getattr(Config, attr)) == wanted), 'other')
 
-        # Use the SSL_VERIFY config variable
-        verify_ssl = Config.SSL_VERIFY
 
-        if method.lower() == 'post':
-            response = requests.post(url, headers=headers, json=payload, timeout=30, verify=verify_ssl)
-        elif method.lower() == 'patch':
-            response = requests.patch(url, headers=headers, json=payload, timeout=30, verify=verify_ssl)
-        else:
-            response = requests.get(url, headers=headers, timeout=30, verify=verify_ssl)
+def notion_api_request(method, url, headers, payload=None, params=None):
+    """
+    A single, reusable function to make Notion API calls. It is the sync face of
+    notion_async.notion_api_request: the request (rate limit, retries, metrics) runs on the
+    shared event loop and connection pool, and this thread waits for the result.
+    """
+    import notion_async  # Imported here: notion_async builds on this module's helpers
+    return notion_async.run(notion_async.notion_api_request(method, url, headers, payload, params))
+
 
-        response.raise_for_status()  # This will raise an HTTPError for bad responses (4xx, 5xx)
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        error_text = e.response.text if getattr(e, 'response', None) else str(e)
-        log.error(f"Error making Notion API request to {url}: {e}")
-        log.error(f"Response body: {error_text}")
-        # Re-raise the exception so the route can catch it and show the user
-        raise Exception(f"Notion API Error: {error_text}")
+def _api_url(path):
+    return f"{Config.NOTION_API_BASE_URL}/{path}"
 
 
 def _get_auth_headers():
     """Helper to get standard auth headers."""
+    Config.validate()
     return {
         'Authorization': f"Bearer {Config.NOTION_API_KEY}",
         'Content-Type': 'application/json',
@@ -45,75 +133,433 @@ def _get_auth_headers():
     }
 
 
-def fetch_notion_database_pages(database_id, filters=None, sorts=None):
-    """Fetches all pages from a database."""
+def iter_notion_database_pages(database_id, filters=None, sorts=None, page_size=100, max_rows=None,
+                               filter_properties=None):
+    """
+    Streams pages from a database, following next_cursor until it is exhausted (or max_rows is reached).
+    filter_properties limits which properties Notion returns, to keep payloads small.
+    """
     if not database_id:
-        log.warning("fetch_notion_database_pages called but database_id is missing.")
-        return []
-    url = f"https://api.notion.com/v1/databases/{database_id}/query"
+        log.warning("iter_notion_database_pages called but database_id is missing.")
+        return
+    url = _api_url(f"databases/{database_id}/query")
     headers = _get_auth_headers()
-    payload = {}
-    if filters: payload['filter'] = filters
-    if sorts: payload['sorts'] = sorts
+    params = {'filter_properties': list(filter_properties)} if filter_properties else None
+    page_size = max(1, min(page_size, 100))  # Notion caps page_size at 100
+    cursor = None
+    yielded = 0
+
+    while max_rows is None or yielded < max_rows:
+        payload = {'page_size': page_size if max_rows is None else min(page_size, max_rows - yielded)}
+        if filters: payload['filter'] = filters
+        if sorts: payload['sorts'] = sorts
+        if cursor: payload['start_cursor'] = cursor
+
+        # We let the exception bubble up if it fails
+        response_data = notion_api_request('post', url, headers, payload=payload, params=params)
+        for page in response_data.get('results', []):
+            yield page
+            yielded += 1
+            if max_rows is not None and yielded >= max_rows:
+                return
+        cursor = response_data.get('next_cursor')
+        if not response_data.get('has_more') or not cursor:
+            return
+
+
+def fetch_notion_database_pages(database_id, filters=None, sorts=None, page_size=100, max_rows=None,
+                                filter_properties=None):
+    """Fetches all pages from a database (every cursor page, not just the first 100)."""
+    return list(iter_notion_database_pages(database_id, filters=filters, sorts=sorts, page_size=page_size,
+                                           max_rows=max_rows, filter_properties=filter_properties))
+
+
+# --- METADATA CACHE ---
+
+class MetadataCache:
+    """
+    Small in-process cache for databases that rarely change (accounts, pillars, categories).
+    Entries expire after a per-database TTL, the least recently used entry is evicted once
+    max_entries is reached, and expired entries can be served stale while a background
+    thread refreshes them.
+    """
+
+    def __init__(self, max_entries=32, stale_while_revalidate=True, max_stale=3600):
+        self.max_entries = max_entries
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_stale = max_stale
+        self._entries = OrderedDict()  # key -> (value, fetched_at, generation)
+        self._generations = defaultdict(int)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key, loader, ttl):
+        """Returns the cached value for key, calling loader() on a miss."""
+        found, value, generation = self._lookup(key, loader, ttl)
+        if found:
+            return value
+        value = loader()
+        self._store(key, value, generation)
+        return value
+
+    async def aget(self, key, loader, async_loader, ttl):
+        """get() for async callers: a miss awaits async_loader(); stale refreshes still run loader() on a thread."""
+        found, value, generation = self._lookup(key, loader, ttl)
+        if found:
+            return value
+        value = await async_loader()
+        self._store(key, value, generation)
+        return value
+
+    def _lookup(self, key, loader, ttl):
+        """Returns (found, value, generation), scheduling a background refresh for stale hits."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at, _ = entry
+                age = now - fetched_at
+                if age < ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value, None
+                if self.stale_while_revalidate and age < ttl + self.max_stale:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    self._schedule_refresh(key, loader)
+                    return True, value, None
+            self.misses += 1
+            return False, None, self._generations[key]
+
+    def refresh(self, key, loader):
+        """Reloads key synchronously and returns the fresh value."""
+        with self._lock:
+            generation = self._generations[key]
+        value = loader()
+        self._store(key, value, generation)
+        return value
+
+    def invalidate(self, key=None):
+        """Drops one key, or everything when key is None."""
+        with self._lock:
+            keys = list(self._entries) if key is None else [key]
+            for k in keys:
+                self._entries.pop(k, None)
+                # Bumping the generation stops an in-flight refresh from re-inserting old data
+                self._generations[k] += 1
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'stale_hits': self.stale_hits, 'misses': self.misses}
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            if self._generations[key] != generation:
+                return  # Invalidated while we were loading
+            self._entries[key] = (value, time.monotonic(), generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _schedule_refresh(self, key, loader):
+        # Caller holds the lock
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        generation = self._generations[key]
+
+        def _run():
+            try:
+                self._store(key, loader(), generation)
+            except Exception as e:
+                log.warning(f"Background refresh of {key} failed, keeping stale copy: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=_run, name=f"metadata-refresh-{key}", daemon=True).start()
+
+
+_metadata_cache = MetadataCache(max_entries=Config.METADATA_CACHE_MAX_ENTRIES,
+                                stale_while_revalidate=Config.METADATA_CACHE_STALE_WHILE_REVALIDATE,
+                                max_stale=Config.METADATA_CACHE_MAX_STALE)
+
+
+def _normalize_id(notion_id):
+    """Notion returns dashed UUIDs, the .env usually holds undashed ones."""
+    return (notion_id or '').replace('-', '').lower()
+
+
+def _metadata_ttl(database_id):
+    ttls = {_normalize_id(Config.ACCOUNTS_DB_ID): Config.ACCOUNTS_CACHE_TTL,
+            _normalize_id(Config.PILLARS_DB_ID): Config.PILLARS_CACHE_TTL,
+            _normalize_id(Config.CATEGORIES_DB_ID): Config.CATEGORIES_CACHE_TTL}
+    return ttls.get(_normalize_id(database_id), Config.METADATA_CACHE_TTL)
+
+
+def _record_type(database_id):
+    """The record class the metadata cache decodes a database's pages into."""
+    types = {_normalize_id(Config.ACCOUNTS_DB_ID): records.Account,
+             _normalize_id(Config.PILLARS_DB_ID): records.Pillar,
+             _normalize_id(Config.CATEGORIES_DB_ID): records.Category}
+    record_type = types.get(_normalize_id(database_id))
+    if record_type is None:
+        raise ValueError(f"Database {database_id} has no cached record type.")
+    return record_type
+
+
+def _mirror():
+    """The SQLite mirror module when MIRROR_DB_PATH is configured, otherwise None."""
+    if not Config.MIRROR_DB_PATH:
+        return None
+    import mirror  # Imported lazily: mirror imports this module
+    return mirror
+
+
+def _reporting():
+    """The reporting module when REPORTING_DB_PATH is configured, otherwise None."""
+    if not Config.REPORTING_DB_PATH:
+        return None
+    import reporting  # Imported lazily: reporting imports this module
+    return reporting
+
+
+def _load_database_pages(database_id):
+    """Cache loader: reads the local mirror when it is enabled, Notion otherwise."""
+    m = _mirror()
+    name = m.database_name_for(database_id) if m else None
+    if name:
+        m.ensure_fresh(name)
+        return m.get_pages(name)
+    return fetch_notion_database_pages(database_id)
+
+
+def _load_database_records(database_id):
+    """Cache loader: the database's pages decoded into records (the raw pages are not kept)."""
+    return records.decode(_record_type(database_id), _load_database_pages(database_id))
+
+
+def fetch_cached_records(database_id):
+    """
+    The accounts, pillars or categories as a records.RecordSet, served from the metadata cache.
+    Iterate it in Notion's order, or look a record up by id with .get().
+    """
+    if not database_id:
+        log.warning("fetch_cached_records called but database_id is missing.")
+        return records.RecordSet([])
+    return _metadata_cache.get(_normalize_id(database_id),
+                               lambda: _load_database_records(database_id),
+                               _metadata_ttl(database_id))
+
 
-    # We let the exception bubble up if it fails
-    response_data = notion_api_request('post', url, headers, payload=payload)
-    return response_data.get('results', [])
+def refresh_metadata(database_id):
+    """Forces a reload of one cached database."""
+    return _metadata_cache.refresh(_normalize_id(database_id), lambda: _load_database_records(database_id))
 
 
-def fetch_and_process_categories(transaction_type=None):
-    all_category_pages = fetch_notion_database_pages(Config.CATEGORIES_DB_ID)
-    if not all_category_pages: return [], {}
-    all_categories = []
-    for page in all_category_pages:
+def invalidate_metadata(database_id=None):
+    """Drops one cached database, or the whole cache when database_id is None."""
+    _metadata_cache.invalidate(_normalize_id(database_id) if database_id else None)
+
+
+def metadata_cache_stats():
+    return _metadata_cache.stats()
+
+
+def _note_page_write(response_data):
+    """
+    Write-through: pages we create/update are copied into the mirror and applied to the
+    reporting totals, and a write to a cached database drops that cache entry.
+    """
+    if not isinstance(response_data, dict) or response_data.get('object') != 'page':
+        return
+    m = _mirror()
+    if m:
         try:
-            page_type = page['properties'].get('Type', {}).get('select', {}).get('name')
-            if transaction_type and page_type and page_type.lower() != transaction_type.lower():
-                continue
-            name = page['properties']['Name']['title'][0]['plain_text']
-            page_id = page['id']
-            parent_relation = page['properties'].get('Parent Category', {}).get('relation', [])
-            parent_id = parent_relation[0]['id'] if parent_relation else None
-            all_categories.append({'id': page_id, 'name': name, 'parent_id': parent_id})
-        except (KeyError, IndexError): continue
-    parents = [cat for cat in all_categories if not cat['parent_id']]
-    children_map = defaultdict(list)
-    for cat in all_categories:
-        if cat['parent_id']:
-            children_map[cat['parent_id']].append({'id': cat['id'], 'name': cat['name']})
-    def sort_key_other_last(category):
-        is_other = 1 if 'other' in category['name'].lower() else 0
-        return (is_other, category['name'])
-    parents.sort(key=sort_key_other_last)
-    for parent_id in children_map:
-        children_map[parent_id].sort(key=sort_key_other_last)
-    return parents, dict(children_map)
+            m.upsert_page(response_data)
+        except Exception as e:
+            # The write to Notion succeeded; the next sync will pick the page up
+            log.warning(f"Failed to copy page {response_data.get('id')} into the mirror: {e}")
+    r = _reporting()
+    if r:
+        try:
+            r.apply_pages([response_data])
+        except Exception as e:
+            log.warning(f"Failed to apply page {response_data.get('id')} to the reports: {e}")
+    database_id = _normalize_id(response_data.get('parent', {}).get('database_id'))
+    if database_id and database_id in _metadata_cache.keys():
+        _metadata_cache.invalidate(database_id)
+
+
+# --- UNIT OF WORK ---
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Per-process thread pool for concurrent Notion writes (re-created after a fork)."""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    with _executor_lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = ThreadPoolExecutor(max_workers=Config.NOTION_POOL_SIZE, thread_name_prefix='notion-write')
+            _executor_pid = pid
+    return _executor
+
+
+def archive_page(page_id):
+    url = _api_url(f"pages/{page_id}")
+    return notion_api_request('patch', url, _get_auth_headers(), {"archived": True})
+
+
+class UnitOfWork:
+    """
+    Collects independent page creates and runs them concurrently. Either every page is
+    created, or the ones that did succeed are archived again and an exception is raised,
+    so a multi-leg entry (transfer, conversion) is never left half-written.
+    """
 
+    def __init__(self, description="entry"):
+        self.description = description
+        self._payloads = []
+
+    def create_page(self, database_id, properties):
+        self._payloads.append({"parent": {"database_id": database_id}, "properties": properties})
+        return len(self._payloads) - 1
+
+    def commit(self):
+        """Creates all pages and returns them in the order they were added."""
+        url = _api_url("pages")
+        headers = _get_auth_headers()
+        futures = [_get_executor().submit(metrics.bind(notion_api_request), 'post', url, headers, payload)
+                   for payload in self._payloads]
+        wait(futures)
+
+        created, errors = [], []
+        for future in futures:
+            try:
+                created.append(future.result())
+            except Exception as e:
+                errors.append(e)
+        if not errors:
+            return created
+
+        self._compensate(created, errors)
+
+    def _compensate(self, created, errors):
+        error = next((e for e in errors if isinstance(e, UncertainWriteError)), errors[0])
+        failed_rollbacks = []
+        for page in created:
+            try:
+                archive_page(page['id'])
+            except Exception as e:
+                log.error(f"Rollback of page {page['id']} ({self.description}) failed: {e}")
+                failed_rollbacks.append(page['id'])
+        if failed_rollbacks:
+            # Part of the entry is still in Notion, so it must not be replayed
+            raise UncertainWriteError(f"CRITICAL: Failed to log {self.description} and could not undo pages "
+                                      f"{', '.join(failed_rollbacks)}. FIX MANUALLY. Error: {error}")
+        if isinstance(error, UncertainWriteError):
+            raise UncertainWriteError(f"Failed to log {self.description}; the pages that were created were undone, "
+                                      f"but one may have been saved. Check Notion. Error: {error}")
+        raise Exception(f"Failed to log {self.description}, nothing was saved. Error: {error}")
 
 
 # --- HIGH-LEVEL BUSINESS LOGIC ---
 
-def create_expense_or_income(ttype, description, amount, account_id, category_id, pillar_id, currency):
-    """Logs a single expense or income transaction."""
+def _step(steps, name, write):
+    """
+    Runs one write of a submission. `steps` is the outbox's record of what an earlier delivery
+    attempt already wrote (see outbox.DeliverySteps): a step it has seen is skipped, not repeated.
+    """
+    return write() if steps is None else steps.run(name, write)
+
+
+def create_expense_or_income(ttype, description, amount, account_id, category_id, pillar_id, currency,
+                             transaction_date=None):
+    """
+    Logs a single expense or income transaction. transaction_date (YYYY-MM-DD) defaults to today;
+    category and pillar may be left empty for imported rows that still need triage.
+    """
+    url = _api_url("pages")
+    headers = _get_auth_headers()
+    payload = {"parent": {"database_id": Config.TRANSACTIONS_DB_ID},
+               "properties": _expense_or_income_properties(ttype, description, amount, account_id, category_id,
+                                                           pillar_id, currency, transaction_date)}
+
+    return notion_api_request('post', url, headers, payload)
+
+
+def _expense_or_income_properties(ttype, description, amount, account_id, category_id, pillar_id, currency,
+                                  transaction_date=None):
     is_expense = ttype == 'expense'
     final_amount = -abs(amount) if is_expense else abs(amount)
 
     properties = {
         "Description": {"title": [{"text": {"content": description}}]},
         "Amount": {"number": final_amount},
-        "Transaction Date": {"date": {"start": datetime.now().strftime('%Y-%m-%d')}},
+        "Transaction Date": {"date": {"start": transaction_date or datetime.now().strftime('%Y-%m-%d')}},
         "Type": {"select": {"name": "Expense" if is_expense else "Income"}},
         "Account": {"relation": [{"id": account_id}]},
-        "Category": {"relation": [{"id": category_id}]},
-        "Pillar": {"relation": [{"id": pillar_id}]},
         "Currency": {"select": {"name": currency}}
     }
+    if category_id: properties["Category"] = {"relation": [{"id": category_id}]}
+    if pillar_id: properties["Pillar"] = {"relation": [{"id": pillar_id}]}
+    return properties
 
-    url = "https://api.notion.com/v1/pages"
-    headers = _get_auth_headers()
-    payload = {"parent": {"database_id": Config.TRANSACTIONS_DB_ID}, "properties": properties}
 
-    return notion_api_request('post', url, headers, payload)
+def _number(form_data, name):
+    try:
+        return float(form_data.get(name) or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name.replace('_', ' ').capitalize()} must be a number, got {form_data.get(name)!r}.")
+
+
+def validate_transaction_form(form_data):
+    """Raises ValueError for an entry-form submission that could never be logged, before it is queued."""
+    transaction_type = form_data.get('type')
+    if transaction_type not in ('expense', 'income', 'transfer'):
+        raise ValueError(f"Unknown transaction type: {transaction_type}")
+    _number(form_data, 'amount')
+    if transaction_type == 'transfer' and form_data.get('from_account_id') == form_data.get('to_account_id'):
+        raise ValueError("Source and destination accounts cannot be the same.")
+
+
+def log_transaction_form(form_data, steps=None):
+    """
+    Logs an expense/income/transfer submitted from the entry form. Returns the success message.
+    `steps` (from the outbox) makes a redelivery skip the write if it already happened.
+    """
+    transaction_type = form_data.get('type')
+    if transaction_type in ['expense', 'income']:
+        _step(steps, 'transaction', lambda: create_expense_or_income(
+            ttype=transaction_type,
+            description=form_data.get('description', 'No description'),
+            amount=_number(form_data, 'amount'),
+            account_id=form_data.get('from_account_id'),
+            category_id=form_data.get('category_id'),
+            pillar_id=form_data.get('pillar_id'),
+            currency=form_data.get('currency', 'ILS')
+        ))
+        return "✅ Successfully logged transaction."
+    if transaction_type == 'transfer':
+        return _step(steps, 'transfer', lambda: create_transfer_entries(
+            from_account_id=form_data.get('from_account_id'),
+            to_account_id=form_data.get('to_account_id'),
+            amount=_number(form_data, 'amount'),
+            currency=form_data.get('currency', 'ILS')
+        ))
+    raise ValueError(f"Unknown transaction type: {transaction_type}")
 
 
 def create_transfer_entries(from_account_id, to_account_id, amount, currency):
@@ -122,73 +568,109 @@ def create_transfer_entries(from_account_id, to_account_id, amount, currency):
         raise ValueError("Source and destination accounts cannot be the same.")
 
     transfer_id = f"TXF-{int(time.time())}"
-    url = "https://api.notion.com/v1/pages"
-    headers = _get_auth_headers()
 
-    # To get account names, we must fetch them.
-    # This is inefficient, but per your request, we are not caching.
-    all_accounts = fetch_notion_database_pages(Config.ACCOUNTS_DB_ID)
-    from_account_name = next(
-        (p['properties']['Name']['title'][0]['plain_text'] for p in all_accounts if p['id'] == from_account_id),
-        'Unknown')
-    to_account_name = next(
-        (p['properties']['Name']['title'][0]['plain_text'] for p in all_accounts if p['id'] == to_account_id),
-        'Unknown')
-
-    # 1. Debit
-    debit_payload = {"parent": {"database_id": Config.TRANSACTIONS_DB_ID},
-                     "properties": {"Description": {"title": [{"text": {"content": f"Transfer to {to_account_name}"}}]},
-                                    "Amount": {"number": -abs(amount)},
-                                    "Transaction Date": {"date": {"start": datetime.now().strftime('%Y-%m-%d')}},
-                                    "Type": {"select": {"name": "Money Transfer (one account to another)"}},
-                                    "Account": {"relation": [{"id": from_account_id}]},
-                                    "Currency": {"select": {"name": currency}},
-                                    "Transfer ID": {"rich_text": [{"text": {"content": transfer_id}}]}}}
+    # Account names come from the metadata cache
+    all_accounts = fetch_cached_records(Config.ACCOUNTS_DB_ID)
+    from_account_name = _account_name(all_accounts, from_account_id)
+    to_account_name = _account_name(all_accounts, to_account_id)
 
-    try:
-        notion_api_request('post', url, headers, debit_payload)
-    except Exception as e:
-        raise Exception(f"Failed to log debit side of transfer. Error: {e}")
+    # Debit and credit are written concurrently; if either fails, the other is rolled back
+    work = UnitOfWork("transfer")
+    for properties in _transfer_properties(from_account_id, from_account_name, to_account_id, to_account_name,
+                                           amount, currency, transfer_id):
+        work.create_page(Config.TRANSACTIONS_DB_ID, properties)
+    work.commit()
 
-    # 2. Credit
-    credit_payload = {"parent": {"database_id": Config.TRANSACTIONS_DB_ID}, "properties": {
-        "Description": {"title": [{"text": {"content": f"Transfer from {from_account_name}"}}]},
-        "Amount": {"number": abs(amount)}, "Transaction Date": {"date": {"start": datetime.now().strftime('%Y-%m-%d')}},
-        "Type": {"select": {"name": "Money Transfer (one account to another)"}},
-        "Account": {"relation": [{"id": to_account_id}]}, "Currency": {"select": {"name": currency}},
-        "Transfer ID": {"rich_text": [{"text": {"content": transfer_id}}]}}}
+    return f"✅ Successfully logged transfer of {amount} {currency} from {from_account_name} to {to_account_name}."
 
-    try:
-        notion_api_request('post', url, headers, credit_payload)
-    except Exception as e:
-        # This is your "critical" error. We raise a specific message for it.
-        raise Exception(f"CRITICAL: Debit logged, but CREDIT FAILED. FIX MANUALLY. Error: {e}")
 
-    return f"✅ Successfully logged transfer of {amount} {currency} from {from_account_name} to {to_account_name}."
+def _account_name(accounts, account_id):
+    account = accounts.get(account_id)
+    return account.name if account and account.name else 'Unknown'
+
+
+def _transfer_properties(from_account_id, from_account_name, to_account_id, to_account_name, amount, currency,
+                         transfer_id):
+    """Properties for the debit and credit legs of a transfer."""
+    today = datetime.now().strftime('%Y-%m-%d')
+    debit = {
+        "Description": {"title": [{"text": {"content": f"Transfer to {to_account_name}"}}]},
+        "Amount": {"number": -abs(amount)},
+        "Transaction Date": {"date": {"start": today}},
+        "Type": {"select": {"name": "Money Transfer (one account to another)"}},
+        "Account": {"relation": [{"id": from_account_id}]},
+        "Currency": {"select": {"name": currency}},
+        "Transfer ID": {"rich_text": [{"text": {"content": transfer_id}}]}}
+    credit = {
+        "Description": {"title": [{"text": {"content": f"Transfer from {from_account_name}"}}]},
+        "Amount": {"number": abs(amount)},
+        "Transaction Date": {"date": {"start": today}},
+        "Type": {"select": {"name": "Money Transfer (one account to another)"}},
+        "Account": {"relation": [{"id": to_account_id}]},
+        "Currency": {"select": {"name": currency}},
+        "Transfer ID": {"rich_text": [{"text": {"content": transfer_id}}]}}
+    return debit, credit
+
+
+def _cache_metrics():
+    """Hit/miss counts and ratio of the metadata cache, for /metrics."""
+    cache = _metadata_cache.stats()
+    cache_total = cache['hits'] + cache['stale_hits'] + cache['misses']
+    return [
+        ('metadata_cache_requests_total', 'counter', {'result': 'hit'}, cache['hits']),
+        ('metadata_cache_requests_total', 'counter', {'result': 'stale'}, cache['stale_hits']),
+        ('metadata_cache_requests_total', 'counter', {'result': 'miss'}, cache['misses']),
+        ('metadata_cache_hit_ratio', 'gauge', {}, (cache_total - cache['misses']) / cache_total if cache_total else 0),
+        ('metadata_cache_entries', 'gauge', {}, cache['entries']),
+    ]
+
+
+metrics.register_collector(_cache_metrics)
+metrics.describe('notion_request_duration_seconds', 'histogram',
+                 'Notion API calls, including retries, by method, database and calling function.')
+metrics.describe('notion_attempts_total', 'counter', 'HTTP attempts sent to Notion (each retry counts).')
+metrics.describe('notion_retries_total', 'counter', 'Attempts that were retried (429, 5xx, connection errors).')
+metrics.describe('notion_rate_limited_total', 'counter', 'Attempts Notion answered with 429.')
+metrics.describe('notion_errors_total', 'counter', 'Attempts that failed for good.')
 
 
 def find_holding(ticker, account_id):
+    """
+    The records.Holding for (ticker, account_id), or None. Always read from Notion (not the mirror):
+    trades write absolute Quantity/Cost Basis values back, so they must start from the latest copy.
+    """
     filters = {"and": [{"property": "Ticker", "rich_text": {"equals": ticker}},
                        {"property": "Account", "relation": {"contains": account_id}}]}
-    holdings_pages = fetch_notion_database_pages(Config.HOLDINGS_DB_ID, filters=filters)
-    return holdings_pages[0] if holdings_pages else None
+    holdings_pages = fetch_notion_database_pages(Config.HOLDINGS_DB_ID, filters=filters, max_rows=1)
+    return records.Holding.from_page(holdings_pages[0]) if holdings_pages else None
 
 def get_all_holdings():
+    """Every holding page (for callers that need properties beyond records.Holding)."""
+    m = _mirror()
+    if m:
+        m.ensure_fresh('holdings')
+        return m.get_pages('holdings')
     return fetch_notion_database_pages(Config.HOLDINGS_DB_ID)
 
+def get_holding_records():
+    """Every holding as a records.RecordSet, decoded as the pages stream in."""
+    m = _mirror()
+    if m:
+        m.ensure_fresh('holdings')
+        return records.decode(records.Holding, m.iter_pages('holdings'))
+    return records.decode(records.Holding, iter_notion_database_pages(Config.HOLDINGS_DB_ID))
+
 def update_holding(page_id, properties_to_update):
-    url = f"https://api.notion.com/v1/pages/{page_id}"
+    url = _api_url(f"pages/{page_id}")
     headers = _get_auth_headers()
     payload = {"properties": properties_to_update}
     return notion_api_request('patch', url, headers, payload)
 
 
 def create_holding(ticker, account_id, quantity, cost_basis):
-    url = "https://api.notion.com/v1/pages"
+    url = _api_url("pages")
     headers = _get_auth_headers()
-    all_accounts = fetch_notion_database_pages(Config.ACCOUNTS_DB_ID)
-    account_name = next(
-        (p['properties']['Name']['title'][0]['plain_text'] for p in all_accounts if p['id'] == account_id), 'Unknown')
+    account_name = _account_name(fetch_cached_records(Config.ACCOUNTS_DB_ID), account_id)
     holding_id_title = f"{ticker} ({account_name})"
 
     properties = {
@@ -205,64 +687,87 @@ def create_holding(ticker, account_id, quantity, cost_basis):
     return notion_api_request('post', url, headers, payload)
 
 
-def log_investment_transaction(form_data):
+def _check_sale(holding, ticker, quantity):
+    if not holding:
+        raise ValueError(f"Cannot log sale: No existing holding found for {ticker}.")
+    current_qty = holding.quantity or 0
+    if current_qty < quantity:
+        raise ValueError(f"Cannot sell {quantity} shares of {ticker}, you only own {current_qty}.")
+
+
+def validate_investment_form(form_data):
+    """Raises ValueError for an investment submission that could never be logged (e.g. overselling), before it is queued."""
+    if form_data.get('action') == 'Money Conversion':
+        for name in ('from_amount', 'to_amount', 'conversion_rate', 'conversion_fee'):
+            _number(form_data, name)
+        return
+    quantity = _number(form_data, 'quantity')
+    _number(form_data, 'price_per_share')
+    _number(form_data, 'fees')
+    if form_data.get('action') == 'Sell':
+        ticker = form_data.get('ticker', '').upper()
+        _check_sale(find_holding(ticker, form_data.get('account_id')), ticker, quantity)
+
+
+def log_investment_transaction(form_data, steps=None):
     """
     Handles all investment logic (Buy, Sell, Conversion, etc.)
     This is a complex function, so it's good it's isolated here.
+    With `steps` (from the outbox), a redelivery skips the writes that already went through,
+    e.g. it only updates the holding when the transaction itself was logged on the last attempt.
     """
     action = form_data.get('action')
     account_id = form_data.get('account_id')
-    url = "https://api.notion.com/v1/pages"
+    url = _api_url("pages")
     headers = _get_auth_headers()
     success_messages = []
 
     if action == 'Money Conversion':
-        # ... (This logic remains unchanged from previous version) ...
-        from_amount = float(form_data.get('from_amount', 0))
+        from_amount = _number(form_data, 'from_amount')
         from_currency = form_data.get('from_currency')
-        to_amount = float(form_data.get('to_amount', 0))
+        to_amount = _number(form_data, 'to_amount')
         to_currency = form_data.get('to_currency')
-        rate = float(form_data.get('conversion_rate', 0))
-        fee = float(form_data.get('conversion_fee', 0))
+        rate = _number(form_data, 'conversion_rate')
+        fee = _number(form_data, 'conversion_fee')
 
-        debit_payload = {"parent": {"database_id": Config['investment_transactions_db_id']}, "properties": {
+        # Withdrawal, deposit and fee are written concurrently and rolled back together on failure
+        work = UnitOfWork("conversion")
+        work.create_page(Config.INVESTMENT_TRANSACTIONS_DB_ID, {
             "Transaction Name": {"title": [{"text": {"content": f"Convert: Sell {from_amount:,.2f} {from_currency}"}}]},
             "Date": {"date": {"start": datetime.now().strftime('%Y-%m-%d')}},
             "Action": {"select": {"name": "Withdrawal"}}, "Account": {"relation": [{"id": account_id}]},
-            "Price Per Share USD": {"number": from_amount}, "Currency": {"select": {"name": from_currency}}}}
-        debit_response = notion_api_request('post', url, headers, debit_payload)
-        if debit_response.get("error"): return render_template("failure.html",
-                                                                      error_message=f"Failed to log debit side of conversion. Notion said: {debit_response['message']}")
-        success_messages.append("✅ Logged ILS withdrawal.")
-
-        credit_payload = {"parent": {"database_id": Config['investment_transactions_db_id']}, "properties": {
+            "Price Per Share USD": {"number": from_amount}, "Currency": {"select": {"name": from_currency}}})
+        work.create_page(Config.INVESTMENT_TRANSACTIONS_DB_ID, {
             "Transaction Name": {"title": [{"text": {"content": f"Convert: Buy {to_amount:,.2f} {to_currency}"}}]},
             "Date": {"date": {"start": datetime.now().strftime('%Y-%m-%d')}}, "Action": {"select": {"name": "Deposit"}},
             "Account": {"relation": [{"id": account_id}]}, "Price Per Share USD": {"number": to_amount},
-            "Currency": {"select": {"name": to_currency}}, "Conversion Rate": {"number": rate}}}
-        credit_response = notion_api_request('post', url, headers, credit_payload)
-        if credit_response.get("error"): return render_template("failure.html",
-                                                                       error_message=f"CRITICAL: Logged withdrawal but failed to log deposit. FIX MANUALLY. Notion said: {credit_response['message']}")
-        success_messages.append("<br>✅ Logged USD deposit.")
-
+            "Currency": {"select": {"name": to_currency}}, "Conversion Rate": {"number": rate}})
         if fee > 0:
-            fee_payload = {"parent": {"database_id": Config['investment_transactions_db_id']}, "properties": {
+            work.create_page(Config.INVESTMENT_TRANSACTIONS_DB_ID, {
                 "Transaction Name": {"title": [{"text": {"content": "Currency Conversion Fee"}}]},
                 "Date": {"date": {"start": datetime.now().strftime('%Y-%m-%d')}},
                 "Action": {"select": {"name": "Fee/Expense"}}, "Account": {"relation": [{"id": account_id}]},
                 "Price Per Share USD": {"number": -fee}, "Currency": {"select": {"name": "USD"}},
-                "Conversion Fee USD": {"number": fee}}}
-            fee_response = notion_api_request('post', url, headers, fee_payload)
-            if fee_response.get("error"): return render_template("failure.html",
-                                                                        error_message=f"CRITICAL: Conversion logged, but fee failed. ADD MANUALLY. Notion said: {fee_response['message']}")
+                "Conversion Fee USD": {"number": fee}})
+        _step(steps, 'conversion', work.commit)
+        try:
+            import fx  # Imported lazily: numpy is only needed once a conversion is logged
+            fx.record_conversion(datetime.now().strftime('%Y-%m-%d'), from_currency, from_amount, to_currency,
+                                 to_amount)
+        except Exception as e:
+            log.warning(f"Conversion logged, but its rate was not added to the FX store: {e}")
+
+        success_messages.append(f"✅ Logged {from_currency} withdrawal.")
+        success_messages.append(f"<br>✅ Logged {to_currency} deposit.")
+        if fee > 0:
             success_messages.append("<br>✅ Logged conversion fee.")
-        success_messages.append("✅ Conversion logged." )
+        success_messages.append("✅ Conversion logged.")
 
     else:  # Buy, Sell, Dividend, etc.
         ticker = form_data.get('ticker', '').upper()
-        quantity = float(form_data.get('quantity') or 0)
-        price_per_share = float(form_data.get('price_per_share') or 0)
-        fees = float(form_data.get('fees') or 0)
+        quantity = _number(form_data, 'quantity')
+        price_per_share = _number(form_data, 'price_per_share')
+        fees = _number(form_data, 'fees')
         transaction_name = f"{action} {ticker}" if ticker else f"{action} Cash"
 
         log_payload = {"parent": {"database_id": Config.INVESTMENT_TRANSACTIONS_DB_ID},
@@ -271,81 +776,58 @@ def log_investment_transaction(form_data):
         proceeds_from_sale = 0
         cost_of_sold_shares = 0
 
-        if action == 'Sell':
-            # This is the calculation logic we are moving from the route
-            existing_holding_for_gain = find_holding(ticker, account_id)
-            if not existing_holding_for_gain:
-                raise ValueError(f"Cannot log sale: No existing holding found for {ticker}.")
-
-            current_qty_for_gain = existing_holding_for_gain['properties']['Quantity']['number'] or 0
-            if current_qty_for_gain < quantity:
-                raise ValueError(f"Cannot sell {quantity} shares of {ticker}, you only own {current_qty_for_gain}.")
+        # One holding lookup (read fresh from Notion) serves both the gain calculation and the holding update
+        existing_holding = find_holding(ticker, account_id) if action in ['Buy', 'Sell'] else None
 
-            current_cost_basis_for_gain = existing_holding_for_gain['properties']['Total Cost Basis USD']['number'] or 0
-            avg_cost = current_cost_basis_for_gain / current_qty_for_gain if current_qty_for_gain > 0 else 0
+        if action == 'Sell':
+            _check_sale(existing_holding, ticker, quantity)
+            current_qty = existing_holding.quantity or 0
+            current_cost_basis = existing_holding.cost_basis or 0
+            avg_cost = current_cost_basis / current_qty if current_qty > 0 else 0
             cost_of_sold_shares = quantity * avg_cost
             proceeds_from_sale = (quantity * price_per_share) - fees
             gain_from_this_sale = proceeds_from_sale - cost_of_sold_shares
             log_payload["properties"]["Realized Gain/Loss USD"] = {"number": gain_from_this_sale}
 
         # Log the actual transaction
-        notion_api_request('post', url, headers, log_payload)
+        _step(steps, 'transaction', lambda: notion_api_request('post', url, headers, log_payload))
         success_messages = ["✅ Logged investment transaction."]
 
         # Update holdings
         if action == 'Buy':
-            existing_holding = find_holding(ticker, account_id)
             trade_cost = (quantity * price_per_share) + fees
             if existing_holding:
-                current_qty = existing_holding['properties']['Quantity']['number'] or 0
-                current_cost_basis = existing_holding['properties']['Total Cost Basis USD']['number'] or 0
+                current_qty = existing_holding.quantity or 0
+                current_cost_basis = existing_holding.cost_basis or 0
                 properties_to_update = {"Quantity": {"number": current_qty + quantity},
                                         "Total Cost Basis USD": {"number": current_cost_basis + trade_cost}}
-                update_holding(existing_holding['id'], properties_to_update)
+                _step(steps, 'holding', lambda: update_holding(existing_holding.id, properties_to_update))
                 success_messages.append("<br>✅ Updated existing holding.")
             else:
                 # ... (logic to create holding, *without* yfinance) ...
-                create_holding(ticker, account_id, quantity, trade_cost)
+                _step(steps, 'holding', lambda: create_holding(ticker, account_id, quantity, trade_cost))
                 success_messages.append("<br>✅ Created new holding.")
 
         elif action == 'Sell':
-            existing_holding = find_holding(ticker, account_id)
-            # Ensure holding exists (already checked earlier, but good practice)
-            if not existing_holding: return render_template("failure.html",
-                                                                   error_message="Holding not found for update after sale.")
-
-            current_qty = existing_holding['properties']['Quantity']['number'] or 0
-            current_cost_basis = existing_holding['properties']['Total Cost Basis USD']['number'] or 0
-            current_realized_gain = existing_holding['properties'].get('Total Realized Gain/Loss USD', {}).get('number',
-                                                                                                               0)
-            current_proceeds = existing_holding['properties'].get('Total Proceeds from Sales USD', {}).get('number', 0)
-            new_realized_gain = current_realized_gain + gain_from_this_sale
-            new_proceeds = current_proceeds + proceeds_from_sale
+            current_realized_gain = existing_holding.realized_gain or 0
+            current_proceeds = existing_holding.proceeds or 0
             properties_to_update = {
                 "Quantity": {"number": current_qty - quantity},
                 "Total Cost Basis USD": {"number": current_cost_basis - cost_of_sold_shares},
-                "Total Realized Gain/Loss USD": {"number": new_realized_gain},
-                "Total Proceeds from Sales USD": {"number": new_proceeds}
+                "Total Realized Gain/Loss USD": {"number": current_realized_gain + gain_from_this_sale},
+                "Total Proceeds from Sales USD": {"number": current_proceeds + proceeds_from_sale}
             }
-            update_response = update_holding(existing_holding['id'], properties_to_update)
-            if update_response.get("error"): return render_template("failure.html",
-                                                                           error_message=f"LOGGED TXN but FAILED to update holding: {update_response['message']}")
-            success_messages.append("<br>✅ Updated holding with realized gain.")
+            try:
+                _step(steps, 'holding', lambda: update_holding(existing_holding.id, properties_to_update))
+            except UncertainWriteError as e:
+                raise UncertainWriteError(f"LOGGED TXN but FAILED to update holding: {e}")
+            except Exception as e:
+                raise Exception(f"LOGGED TXN but FAILED to update holding: {e}")
             success_messages.append("<br>✅ Updated holding with realized gain.")
 
     return " ".join(success_messages)
 
 def enrich_holdings_with_more_info(ticker=None):
-    if ticker is None:
-        # enrich all tickers
-        holdings_pages = fetch_notion_database_pages(Config.HOLDINGS_DB_ID)
-    else:
-        # enrich a specific ticker
-        holdings_pages = fetch_notion_database_pages(Config.HOLDINGS_DB_ID, filters={"property": "Ticker", "rich_text": {"equals": ticker}})
-
-    update_holding(holdings_pages[0]["id"], properties_to_update = {
-                                                "Country": {"select": {"name":  "USA"}},
-                                                "Sector": {"select": {"name": "temp_sector"}}})
-
-
-
+    """Fills in market data for one ticker's holdings, or all of them (see yfinance_updater)."""
+    import yfinance_updater  # Imported lazily: it imports this module
+    return yfinance_updater.enrich_holdings(tickers=[ticker] if ticker else None)
@@ -0,0 +1,231 @@
+# outbox.py
+"""Durable outbox for form submissions, keyed by idempotency key and delivered step by step."""
+import json
+import logging
+import os
+import threading
+import time
+
+from peewee import SqliteDatabase, Model, CharField, TextField, FloatField, IntegerField, IntegrityError, fn
+from playhouse.migrate import SqliteMigrator, migrate
+
+from config import Config
+import notion_client
+from sqlite_store import SqliteStore
+
+log = logging.getLogger(__name__)
+
+# Submission kind -> function that sends it to Notion and returns the success message
+HANDLERS = {
+    'transaction': notion_client.log_transaction_form,
+    'investment': notion_client.log_investment_transaction,
+}
+# Submission kind -> function that raises ValueError for a submission that could never be logged
+VALIDATORS = {
+    'transaction': notion_client.validate_transaction_form,
+    'investment': notion_client.validate_investment_form,
+}
+
+PENDING, IN_PROGRESS, DONE, FAILED = 'pending', 'in_progress', 'done', 'failed'
+
+db = SqliteDatabase(None, pragmas={'journal_mode': 'wal', 'busy_timeout': 5000})
+_wake = threading.Event()
+_dispatcher = None
+_dispatcher_pid = None
+_dispatcher_lock = threading.Lock()
+
+
+class BaseModel(Model):
+    class Meta:
+        database = db
+
+
+class OutboxEntry(BaseModel):
+    key = CharField(primary_key=True)  # The submission's idempotency key
+    kind = CharField()
+    payload = TextField()  # The form data as JSON
+    status = CharField(default=PENDING, index=True)
+    attempts = IntegerField(default=0)
+    result = TextField(null=True)  # Success message once delivered
+    last_error = TextField(null=True)
+    created_at = FloatField()
+    next_attempt_at = FloatField(default=0)
+    claimed_at = FloatField(null=True)
+    completed_steps = TextField(default='[]')  # JSON list of the steps Notion already accepted
+
+
+class ClaimLostError(Exception):
+    """Another worker re-claimed the entry (this delivery's claim went stale), so this delivery stops."""
+
+
+def _add_missing_columns():
+    # Outboxes created before completed_steps existed get the column
+    columns = {column.name for column in db.get_columns(OutboxEntry._meta.table_name)}
+    if 'completed_steps' not in columns:
+        migrate(SqliteMigrator(db).add_column(OutboxEntry._meta.table_name, 'completed_steps',
+                                              OutboxEntry.completed_steps))
+
+
+_store = SqliteStore(db, 'OUTBOX_DB_PATH', [OutboxEntry], setup=_add_missing_columns)
+init = _store.init
+_ensure_init = _store.ensure_init
+
+
+def submit(kind, form_data, key):
+    """Stores a submission under its key (validated first with OUTBOX_ASYNC). Returns (entry, created)."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown outbox kind: {kind}")
+    _ensure_init()
+    existing = OutboxEntry.get_or_none(OutboxEntry.key == key)
+    if existing is not None:
+        return existing, False
+    if Config.OUTBOX_ASYNC:
+        VALIDATORS[kind](form_data)
+    try:
+        entry = OutboxEntry.create(key=key, kind=kind, payload=json.dumps(form_data), created_at=time.time())
+        return entry, True
+    except IntegrityError:
+        return OutboxEntry.get_by_id(key), False
+
+
+def get(key):
+    _ensure_init()
+    return OutboxEntry.get_or_none(OutboxEntry.key == key)
+
+
+class DeliverySteps:
+    """The steps of one entry Notion already accepted; run() records each write under this delivery's claim."""
+
+    def __init__(self, key, completed, claim):
+        self.key = key
+        self.completed = list(completed)
+        self.claim = claim
+
+    def run(self, name, write):
+        if name in self.completed:
+            log.info(f"Outbox entry {self.key}: skipping step '{name}', it was already written")
+            return None
+        self.renew()
+        result = write()
+        self.completed.append(name)
+        self.renew(completed_steps=json.dumps(self.completed))
+        return result
+
+    def renew(self, **fields):
+        """Updates the row only while this delivery still owns it, moving claimed_at forward."""
+        now = time.time()
+        owned = (OutboxEntry.update(claimed_at=now, **fields)
+                 .where((OutboxEntry.key == self.key) & (OutboxEntry.status == IN_PROGRESS) &
+                        (OutboxEntry.claimed_at == self.claim)).execute()) == 1
+        if not owned:
+            raise ClaimLostError(f"Outbox entry {self.key} was re-claimed by another worker")
+        self.claim = now
+
+
+def _claim(key, ignore_backoff=False):
+    """Atomically moves an entry to in_progress so only one worker/thread delivers it. Returns the claim, or None."""
+    now = time.time()
+    stale_before = now - Config.OUTBOX_CLAIM_TIMEOUT
+    due = float('inf') if ignore_backoff else now
+    claimable = (((OutboxEntry.status == PENDING) & (OutboxEntry.next_attempt_at <= due)) |
+                 ((OutboxEntry.status == IN_PROGRESS) & (OutboxEntry.claimed_at < stale_before)))
+    claimed = (OutboxEntry.update(status=IN_PROGRESS, claimed_at=now)
+               .where((OutboxEntry.key == key) & claimable).execute()) == 1
+    return now if claimed else None
+
+
+def dispatch(key, ignore_backoff=False):
+    """Delivers one entry now and returns its message; a failure leaves it pending, or failed for good."""
+    _ensure_init()
+    claim = _claim(key, ignore_backoff)
+    if claim is None:
+        entry = OutboxEntry.get_by_id(key)
+        if entry.status == DONE:
+            return entry.result
+        if entry.status == FAILED:
+            raise Exception(entry.last_error)
+        return "⏳ This entry is already being logged."
+
+    entry = OutboxEntry.get_by_id(key)
+    steps = DeliverySteps(key, json.loads(entry.completed_steps or '[]'), claim)
+    try:
+        message = HANDLERS[entry.kind](json.loads(entry.payload), steps=steps)
+    except ClaimLostError as e:
+        log.error(f"Outbox delivery of {key} ({entry.kind}) stopped: {e}")
+        raise
+    except Exception as e:
+        attempts = entry.attempts + 1
+        # Validation errors (ValueError) will never succeed, and replaying an uncertain write could log it twice
+        permanent = (isinstance(e, (ValueError, notion_client.UncertainWriteError)) or
+                     attempts >= Config.OUTBOX_MAX_ATTEMPTS)
+        delay = min(300, 5 * 2 ** attempts)
+        (OutboxEntry.update(status=FAILED if permanent else PENDING, attempts=attempts, last_error=str(e),
+                            next_attempt_at=time.time() + delay, claimed_at=None)
+         .where((OutboxEntry.key == key) & (OutboxEntry.claimed_at == steps.claim)).execute())
+        log.error(f"Outbox delivery of {key} ({entry.kind}) failed on attempt {attempts}: {e}")
+        raise
+
+    done = (OutboxEntry.update(status=DONE, attempts=entry.attempts + 1, result=message, last_error=None)
+            .where((OutboxEntry.key == key) & (OutboxEntry.claimed_at == steps.claim)).execute())
+    if not done:
+        # Every step was recorded under our claim, so the worker that took over skips them all
+        log.warning(f"Outbox entry {key} was re-claimed after its last step; leaving it to that worker")
+    return message
+
+
+def drain(limit=50):
+    """Delivers every entry that is due. Returns the number delivered."""
+    _ensure_init()
+    now = time.time()
+    due = (OutboxEntry.select(OutboxEntry.key)
+           .where(((OutboxEntry.status == PENDING) & (OutboxEntry.next_attempt_at <= now)) |
+                  ((OutboxEntry.status == IN_PROGRESS) &
+                   (OutboxEntry.claimed_at < now - Config.OUTBOX_CLAIM_TIMEOUT)))
+           .order_by(OutboxEntry.created_at)
+           .limit(limit))
+    delivered = 0
+    for row in list(due):
+        try:
+            dispatch(row.key)
+            delivered += 1
+        except Exception:
+            pass  # Already recorded on the entry
+    return delivered
+
+
+def _run_dispatcher():
+    while True:
+        _wake.wait(timeout=Config.OUTBOX_POLL_SECONDS)
+        _wake.clear()
+        try:
+            drain()
+        except Exception as e:
+            log.error(f"Outbox dispatcher error: {e}")
+
+
+def start_dispatcher():
+    """Starts this process's background dispatcher (once per process, so it survives gunicorn's fork)."""
+    global _dispatcher, _dispatcher_pid
+    with _dispatcher_lock:
+        if _dispatcher is not None and _dispatcher_pid == os.getpid() and _dispatcher.is_alive():
+            return
+        _dispatcher = threading.Thread(target=_run_dispatcher, name='outbox-dispatcher', daemon=True)
+        _dispatcher_pid = os.getpid()
+        _dispatcher.start()
+
+
+def wake():
+    """Asks the dispatcher to drain now instead of waiting for the next poll."""
+    start_dispatcher()
+    _wake.set()
+
+
+def stats():
+    _ensure_init()
+    counts = {status: 0 for status in (PENDING, IN_PROGRESS, DONE, FAILED)}
+    for row in OutboxEntry.select(OutboxEntry.status, fn.COUNT(OutboxEntry.key).alias('n')).group_by(OutboxEntry.status):
+        counts[row.status] = row.n
+    failed = [{'key': e.key, 'kind': e.kind, 'attempts': e.attempts, 'error': e.last_error,
+               'payload': json.loads(e.payload)}
+              for e in OutboxEntry.select().where(OutboxEntry.status == FAILED).order_by(OutboxEntry.created_at)]
+    return {'counts': counts, 'failed': failed}
@@ -0,0 +1,236 @@
+# portfolio.py
+"""Ledger-replay portfolio engine: positions rebuilt from the Investment Transactions ledger."""
+import argparse
+import json
+import logging
+import math
+import sys
+import time
+
+from config import Config
+import notion_client
+import records
+
+log = logging.getLogger(__name__)
+
+TRADE_ACTIONS = ('Buy', 'Sell')
+METHODS = ('average', 'fifo')
+EPSILON = 1e-9  # Share quantities below this are treated as zero
+
+# Holding property -> (positions column, absolute tolerance before it counts as a change)
+HOLDING_FIELDS = {
+    'Quantity': ('quantity', 1e-9),
+    'Total Cost Basis USD': ('cost_basis', 0.005),
+    'Total Realized Gain/Loss USD': ('realized_gain', 0.005),
+    'Total Proceeds from Sales USD': ('proceeds', 0.005),
+}
+
+
+# --- LEDGER ---
+
+def _ledger_row(trade):
+    return (trade.id, (trade.date or trade.created_time or '')[:10], trade.created_time or '',
+            (trade.ticker or '').upper(), trade.account_id, trade.action, trade.quantity or 0.0, trade.price or 0.0,
+            trade.fees or 0.0)
+
+
+def load_ledger(pages=None):
+    """
+    Buy/Sell trades from Investment Transactions (the mirror when enabled) as a DataFrame. Pages
+    are decoded into records.InvestmentTransaction as they stream in, so the raw pages are never all held.
+    """
+    import pandas as pd
+
+    if pages is None:
+        m = notion_client._mirror()
+        if m:
+            m.ensure_fresh('investment_transactions')
+            pages = m.iter_pages('investment_transactions')
+        else:
+            filters = {"or": [{"property": "Action", "select": {"equals": action}} for action in TRADE_ACTIONS]}
+            pages = notion_client.iter_notion_database_pages(Config.INVESTMENT_TRANSACTIONS_DB_ID, filters=filters)
+
+    rows = [_ledger_row(records.InvestmentTransaction.from_page(page)) for page in pages]
+    columns = ['id', 'date', 'created_time', 'ticker', 'account_id', 'action', 'quantity', 'price', 'fees']
+    ledger = pd.DataFrame(rows, columns=columns)
+    ledger = ledger[ledger['action'].isin(TRADE_ACTIONS) & (ledger['ticker'] != '') & ledger['account_id'].notna()]
+    return ledger.astype({'quantity': float, 'price': float, 'fees': float})
+
+
+# --- REPLAY ---
+
+def replay(ledger, method=None):
+    """
+    Replays the ledger and returns it sorted per position with running columns added:
+    held (shares after the trade), cost_basis (after the trade), cost_of_sold, proceeds,
+    realized_gain and oversold (a sale of more shares than were held at that point).
+    """
+    import numpy as np
+    import pandas as pd
+
+    method = method or Config.COST_BASIS_METHOD
+    if method not in METHODS:
+        raise ValueError(f"Unknown cost basis method: {method}. Use one of: {', '.join(METHODS)}")
+
+    trades = ledger.sort_values(['ticker', 'account_id', 'date', 'created_time'], kind='stable').reset_index(drop=True)
+    position = trades.groupby(['ticker', 'account_id'], sort=False).ngroup().to_numpy()
+    is_buy = (trades['action'] == 'Buy').to_numpy()
+    is_sell = (trades['action'] == 'Sell').to_numpy()
+    qty = np.abs(trades['quantity'].to_numpy())
+    price = trades['price'].to_numpy()
+    fees = trades['fees'].to_numpy()
+    n = len(trades)
+
+    def by_position(values):
+        return pd.Series(values).groupby(position)
+
+    signed = np.where(is_buy, qty, np.where(is_sell, -qty, 0.0))
+    held = by_position(signed).cumsum().to_numpy()
+    held_before = held - signed
+    held = np.where(np.abs(held) < EPSILON, 0.0, held)
+    oversold = is_sell & (held < 0)
+
+    buy_cost = np.where(is_buy, qty * price + fees, 0.0)
+    proceeds = np.where(is_sell, qty * price - fees, 0.0)
+    first_of_position = np.ones(n, dtype=bool)
+    first_of_position[1:] = position[1:] != position[:-1]
+
+    if method == 'average':
+        # Fraction of the cost basis that survives each trade; 0 on a full close
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kept = np.where(is_sell, np.clip(1.0 - qty / held_before, 0.0, 1.0), 1.0)
+        kept[is_sell & (held_before <= EPSILON)] = 0.0
+        kept[is_sell & (held <= 0)] = 0.0
+        # A full close zeroes the basis, so the recurrence restarts on the next row
+        segment_start = first_of_position.copy()
+        segment_start[1:] |= kept[:-1] == 0.0
+        segment = np.cumsum(segment_start)
+        log_kept = np.log(np.where(kept > 0, kept, 1.0))
+        growth = pd.Series(log_kept).groupby(segment).cumsum().to_numpy()
+        scaled = pd.Series(buy_cost * np.exp(-growth)).groupby(segment).cumsum().to_numpy()
+        cost_basis = np.where(kept == 0.0, 0.0, np.exp(growth) * scaled)
+    else:
+        # Cumulative (quantity, cost) of every lot bought, laid end to end across positions
+        lot_qty = np.where(is_buy, qty, 0.0)
+        lot_cost = np.where(is_buy & (qty > 0), buy_cost, 0.0)
+        bought = np.cumsum(lot_qty)
+        bought_cost = np.cumsum(lot_cost)
+        base = bought - by_position(lot_qty).cumsum().to_numpy()  # Shares bought by earlier positions
+        base_cost = bought_cost - by_position(lot_cost).cumsum().to_numpy()
+        lots = is_buy & (qty > 0)
+        xp = np.concatenate(([0.0], bought[lots]))
+        fp = np.concatenate(([0.0], bought_cost[lots]))
+        sold = by_position(np.where(is_sell, qty, 0.0)).cumsum().to_numpy()
+        # Never consume lots past what this position has bought so far (oversold rows are flagged)
+        sold = np.minimum(sold, bought - base)
+        cost_of_first_sold = np.interp(base + sold, xp, fp) - np.interp(base, xp, fp)
+        cost_basis = (bought_cost - base_cost) - cost_of_first_sold
+
+    cost_basis = np.where(np.abs(cost_basis) < EPSILON, 0.0, cost_basis)
+    cost_before = np.where(first_of_position, 0.0, np.concatenate(([0.0], cost_basis[:-1])))
+    cost_of_sold = np.where(is_sell, cost_before + buy_cost - cost_basis, 0.0)
+
+    return trades.assign(held=held, cost_basis=cost_basis, cost_of_sold=cost_of_sold, proceeds=proceeds,
+                         realized_gain=np.where(is_sell, proceeds - cost_of_sold, 0.0), oversold=oversold)
+
+
+def compute_positions(ledger, method=None):
+    """
+    Per-(ticker, account_id) totals: quantity, cost_basis, realized_gain, proceeds and trades.
+    Returns (positions, problems); positions with an oversold trade are left out of positions
+    and described in problems instead.
+    """
+    trades = replay(ledger, method)
+    grouped = trades.groupby(['ticker', 'account_id'], sort=True)
+    positions = grouped.agg(quantity=('held', 'last'), cost_basis=('cost_basis', 'last'),
+                            realized_gain=('realized_gain', 'sum'), proceeds=('proceeds', 'sum'),
+                            trades=('id', 'count'), oversold=('oversold', 'any'))
+    problems = [f"{ticker} in account {account_id}: sells more shares than were bought (trade {row['id']})"
+                for (ticker, account_id), row in trades[trades['oversold']].groupby(['ticker', 'account_id']).first().iterrows()]
+    return positions[~positions['oversold']].drop(columns='oversold'), problems
+
+
+# --- WRITE-BACK ---
+
+def _holding_changes(holding, position):
+    changes = {}
+    for prop_name, (column, tolerance) in HOLDING_FIELDS.items():
+        new_value = float(round(position[column], 9))
+        current = getattr(holding, column) if holding else None
+        if current is not None and math.isclose(current, new_value, abs_tol=tolerance):
+            continue
+        if current is None and holding and abs(new_value) <= tolerance:
+            continue  # An empty number property already means zero
+        changes[prop_name] = {"number": new_value}
+    return changes
+
+
+def reconcile(method=None, dry_run=False, ledger=None):
+    """
+    Replays the ledger and brings the Holdings database in line with it, writing only holdings
+    whose totals differ. Returns a summary dict.
+    """
+    started = time.perf_counter()
+    m = notion_client._mirror()
+    if m and not dry_run:
+        # Incremental syncs keep trades and holdings deleted in Notion; totals written back must not count them
+        m.sync(['investment_transactions', 'holdings'], full=True)
+    ledger = load_ledger() if ledger is None else ledger
+    loaded = time.perf_counter()
+    positions, problems = compute_positions(ledger, method)
+    replayed = time.perf_counter()
+
+    holdings = {}
+    for holding in notion_client.get_holding_records():
+        if holding.key:
+            holdings[(holding.ticker.upper(), holding.account_id)] = holding
+
+    updated, created, changes_by_holding = 0, 0, {}
+    for (ticker, account_id), position in positions.iterrows():
+        holding = holdings.get((ticker, account_id))
+        if holding is None and position['quantity'] <= 0 and abs(position['realized_gain']) < 0.005:
+            continue  # Fully closed and never tracked: nothing worth creating
+        changes = _holding_changes(holding, position)
+        if not changes:
+            continue
+        changes_by_holding[f"{ticker} ({account_id})"] = {name: value['number'] for name, value in changes.items()}
+        if dry_run:
+            continue
+        if holding is None:
+            holding = records.Holding.from_page(notion_client.create_holding(
+                ticker, account_id, changes['Quantity']['number'], changes['Total Cost Basis USD']['number']))
+            changes = {name: value for name, value in changes.items()
+                       if name not in ('Quantity', 'Total Cost Basis USD') and value['number']}
+            created += 1
+            if not changes:
+                continue
+        else:
+            updated += 1
+        notion_client.update_holding(holding.id, changes)
+
+    untracked = sorted(f"{ticker} ({account_id})" for ticker, account_id in holdings
+                       if (ticker, account_id) not in positions.index)
+    summary = {'method': method or Config.COST_BASIS_METHOD, 'trades': len(ledger), 'positions': len(positions),
+               'updated': updated, 'created': created, 'changes': changes_by_holding, 'problems': problems,
+               'untracked_holdings': untracked, 'dry_run': dry_run,
+               'load_seconds': round(loaded - started, 3), 'replay_seconds': round(replayed - loaded, 3)}
+    log.info(f"Portfolio reconcile: {len(ledger)} trades replayed in {replayed - loaded:.3f}s, "
+             f"{len(changes_by_holding)} holdings differ ({'dry run' if dry_run else 'written'})")
+    for problem in problems:
+        log.warning(f"Portfolio reconcile skipped {problem}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild holdings from the Investment Transactions ledger.")
+    parser.add_argument('--method', choices=METHODS, help=f"Cost basis method (default: {Config.COST_BASIS_METHOD})")
+    parser.add_argument('--dry-run', action='store_true', help="Show what would change without writing to Notion")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    print(json.dumps(reconcile(method=args.method, dry_run=args.dry_run), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
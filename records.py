@@ -0,0 +1,145 @@
+# records.py
+"""Typed records for Notion pages, decoding only the properties the app reads."""
+import sys
+
+
+# --- PROPERTY DECODERS ---
+
+def title(prop):
+    return ''.join(t.get('plain_text', '') for t in prop.get('title') or [])
+
+
+def text(prop):
+    return ''.join(t.get('plain_text', '') for t in prop.get('rich_text') or [])
+
+
+def number(prop):
+    return prop.get('number')
+
+
+def checkbox(prop):
+    return bool(prop.get('checkbox'))
+
+
+def select(prop):
+    name = (prop.get('select') or {}).get('name')
+    return sys.intern(name) if name else None
+
+
+def relation(prop):
+    """The first related page id (all our relations hold one page)."""
+    related = prop.get('relation') or []
+    return sys.intern(related[0]['id']) if related else None
+
+
+def date(prop):
+    start = (prop.get('date') or {}).get('start')
+    return start[:10] if start else None
+
+
+class Record:
+    """Base record: subclasses list their (attribute, Notion property, decoder) in FIELDS."""
+    __slots__ = ('id', 'created_time', 'last_edited_time')
+    FIELDS = ()
+
+    def __init__(self, id, created_time=None, last_edited_time=None, **values):
+        self.id = id
+        self.created_time = created_time
+        self.last_edited_time = last_edited_time
+        for attr, _, _ in self.FIELDS:
+            setattr(self, attr, values.get(attr))
+
+    @classmethod
+    def from_page(cls, page):
+        properties = page.get('properties') or {}
+        record = cls.__new__(cls)
+        record.id = page['id']
+        record.created_time = page.get('created_time')
+        record.last_edited_time = page.get('last_edited_time')
+        for attr, prop_name, decoder in cls.FIELDS:
+            setattr(record, attr, decoder(properties.get(prop_name) or {}))
+        return record
+
+    def to_dict(self):
+        values = {'id': self.id}
+        values.update((attr, getattr(self, attr)) for attr, _, _ in self.FIELDS)
+        return values
+
+    def __repr__(self):
+        fields = ', '.join(f"{attr}={getattr(self, attr)!r}" for attr, _, _ in self.FIELDS[:3])
+        return f"{type(self).__name__}({self.id!r}, {fields})"
+
+
+class Account(Record):
+    __slots__ = ('name', 'is_investment')
+    FIELDS = (('name', 'Name', title), ('is_investment', 'Is Investment Account?', checkbox))
+
+
+class Pillar(Record):
+    __slots__ = ('name',)
+    FIELDS = (('name', 'Name', title),)
+
+
+class Category(Record):
+    __slots__ = ('name', 'type', 'parent_id')
+    FIELDS = (('name', 'Name', title), ('type', 'Type', select), ('parent_id', 'Parent Category', relation))
+
+
+class Holding(Record):
+    __slots__ = ('ticker', 'account_id', 'quantity', 'cost_basis', 'realized_gain', 'proceeds')
+    FIELDS = (('ticker', 'Ticker', text), ('account_id', 'Account', relation), ('quantity', 'Quantity', number),
+              ('cost_basis', 'Total Cost Basis USD', number),
+              ('realized_gain', 'Total Realized Gain/Loss USD', number),
+              ('proceeds', 'Total Proceeds from Sales USD', number))
+
+    @property
+    def key(self):
+        """(ticker, account_id), or None for a holding missing either."""
+        return (self.ticker, self.account_id) if self.ticker and self.account_id else None
+
+
+class Transaction(Record):
+    __slots__ = ('description', 'amount', 'date', 'type', 'account_id', 'category_id', 'pillar_id', 'currency',
+                 'transfer_id')
+    FIELDS = (('description', 'Description', title), ('amount', 'Amount', number),
+              ('date', 'Transaction Date', date), ('type', 'Type', select), ('account_id', 'Account', relation),
+              ('category_id', 'Category', relation), ('pillar_id', 'Pillar', relation),
+              ('currency', 'Currency', select), ('transfer_id', 'Transfer ID', text))
+
+
+class InvestmentTransaction(Record):
+    __slots__ = ('name', 'date', 'action', 'account_id', 'ticker', 'quantity', 'price', 'fees', 'currency')
+    FIELDS = (('name', 'Transaction Name', title), ('date', 'Date', date), ('action', 'Action', select),
+              ('account_id', 'Account', relation), ('ticker', 'Ticker', text), ('quantity', 'Quantity', number),
+              ('price', 'Price Per Share USD', number), ('fees', 'Fees USD', number),
+              ('currency', 'Currency', select))
+
+
+class RecordSet:
+    """Records in their original order, plus an id -> record index."""
+    __slots__ = ('records', 'by_id')
+
+    def __init__(self, records):
+        self.records = list(records)
+        self.by_id = {record.id: record for record in self.records}
+
+    def get(self, record_id, default=None):
+        return self.by_id.get(record_id, default)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+
+def decode(record_type, pages):
+    """
+    Pages -> RecordSet of record_type. Archived pages are skipped. pages can be a generator
+    (iter_notion_database_pages, mirror.iter_pages), so a scan never holds every raw page at once.
+    """
+    return RecordSet(record_type.from_page(page) for page in pages
+                     if not page.get('archived') and not page.get('in_trash'))
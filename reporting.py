@@ -0,0 +1,362 @@
+# reporting.py
+"""Spending/income rollups for the Transactions database, materialized in SQLite and updated by deltas."""
+import argparse
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from peewee import (SqliteDatabase, Model, CharField, FloatField, IntegerField, BooleanField, EXCLUDED, fn)
+
+from config import Config
+import notion_client
+import records
+from sqlite_store import SqliteStore
+
+log = logging.getLogger(__name__)
+
+DIMENSIONS = ('month', 'account', 'category', 'pillar')
+TRANSFER_TYPE = 'Money Transfer (one account to another)'
+UNASSIGNED = ''  # Key used for transactions without a category/pillar/account
+
+db = SqliteDatabase(None, pragmas={'journal_mode': 'wal', 'synchronous': 'normal', 'busy_timeout': 5000})
+_sync_lock = threading.Lock()
+
+
+class BaseModel(Model):
+    class Meta:
+        database = db
+
+
+class ReportedTransaction(BaseModel):
+    """What each transaction page currently contributes to the totals (so edits can be reversed)."""
+    id = CharField(primary_key=True)
+    month = CharField()  # YYYY-MM of the Transaction Date
+    type = CharField(null=True)
+    amount = FloatField()
+    currency = CharField()
+    account_id = CharField()
+    category_id = CharField()
+    pillar_id = CharField()
+    transfer_id = CharField(null=True)
+    excluded = BooleanField()  # Transfers are tracked but never counted
+    last_edited_time = CharField()
+
+
+class MonthlyTotal(BaseModel):
+    dimension = CharField()
+    key = CharField()
+    month = CharField()
+    currency = CharField()
+    type = CharField()  # 'Expense', 'Income' or whatever other Type the page had
+    total = FloatField(default=0)
+    count = IntegerField(default=0)
+
+    class Meta:
+        primary_key = False
+        indexes = ((('dimension', 'key', 'month', 'currency', 'type'), True),
+                   (('dimension', 'month'), False))
+
+
+class ReportingState(BaseModel):
+    name = CharField(primary_key=True)
+    watermark = CharField(null=True)  # Highest last_edited_time applied
+    synced_at = FloatField(default=0)
+
+
+def is_enabled():
+    return bool(Config.REPORTING_DB_PATH)
+
+
+_store = SqliteStore(db, 'REPORTING_DB_PATH', [ReportedTransaction, MonthlyTotal, ReportingState])
+init = _store.init
+_ensure_init = _store.ensure_init
+
+
+def is_transactions_page(page):
+    parent = page.get('parent', {}).get('database_id')
+    return bool(parent) and notion_client._normalize_id(parent) == notion_client._normalize_id(Config.TRANSACTIONS_DB_ID)
+
+
+# --- INCREMENTAL MATERIALIZATION ---
+
+def _row_for_page(page):
+    transaction = records.Transaction.from_page(page)
+    date = transaction.date or transaction.created_time or ''
+    return {
+        'id': transaction.id,
+        'month': date[:7],
+        'type': transaction.type,
+        'amount': transaction.amount or 0.0,
+        'currency': transaction.currency or '',
+        'account_id': transaction.account_id or UNASSIGNED,
+        'category_id': transaction.category_id or UNASSIGNED,
+        'pillar_id': transaction.pillar_id or UNASSIGNED,
+        'transfer_id': transaction.transfer_id or None,
+        'excluded': bool(transaction.transfer_id) or transaction.type == TRANSFER_TYPE,
+        'last_edited_time': transaction.last_edited_time or '',
+    }
+
+
+def _add_contribution(deltas, row, sign):
+    if row['excluded']:
+        return
+    keys = {'month': UNASSIGNED, 'account': row['account_id'], 'category': row['category_id'],
+            'pillar': row['pillar_id']}
+    for dimension, key in keys.items():
+        delta = deltas[(dimension, key, row['month'], row['currency'], row['type'] or '')]
+        delta[0] += sign * row['amount']
+        delta[1] += sign
+
+
+def _apply_deltas(deltas):
+    rows = [{'dimension': d, 'key': k, 'month': m, 'currency': c, 'type': t, 'total': total, 'count': count}
+            for (d, k, m, c, t), (total, count) in deltas.items() if total or count]
+    for i in range(0, len(rows), 100):
+        (MonthlyTotal.insert_many(rows[i:i + 100])
+         .on_conflict(conflict_target=[MonthlyTotal.dimension, MonthlyTotal.key, MonthlyTotal.month,
+                                       MonthlyTotal.currency, MonthlyTotal.type],
+                      update={MonthlyTotal.total: MonthlyTotal.total + EXCLUDED.total,
+                              MonthlyTotal.count: MonthlyTotal.count + EXCLUDED.count})
+         .execute())
+
+
+def _previous_rows(ids):
+    previous = {}
+    for i in range(0, len(ids), 500):
+        for row in ReportedTransaction.select().where(ReportedTransaction.id.in_(ids[i:i + 500])).dicts():
+            previous[row['id']] = row
+    return previous
+
+
+def apply_pages(pages, advance_watermark=False):
+    """Applies transaction pages to the totals as deltas; only sync()/rebuild() may advance the watermark."""
+    if not is_enabled():
+        return 0
+    pages = [p for p in pages if is_transactions_page(p)]
+    if not pages:
+        return 0
+    _ensure_init()
+    with db.atomic('IMMEDIATE'):
+        previous = _previous_rows([p['id'] for p in pages])
+        deltas = defaultdict(lambda: [0.0, 0])
+        upserts, deleted, watermark = {}, [], None
+        for page in pages:
+            old = upserts.get(page['id']) or previous.get(page['id'])
+            if old is not None:
+                _add_contribution(deltas, old, -1)
+            if page.get('archived') or page.get('in_trash'):
+                upserts.pop(page['id'], None)
+                previous.pop(page['id'], None)
+                deleted.append(page['id'])
+                continue
+            row = _row_for_page(page)
+            _add_contribution(deltas, row, +1)
+            upserts[page['id']] = row
+            if not watermark or row['last_edited_time'] > watermark:
+                watermark = row['last_edited_time']
+
+        _apply_deltas(deltas)
+        rows = list(upserts.values())
+        for i in range(0, len(rows), 50):
+            ReportedTransaction.insert_many(rows[i:i + 50]).on_conflict_replace().execute()
+        for i in range(0, len(deleted), 500):
+            ReportedTransaction.delete().where(ReportedTransaction.id.in_(deleted[i:i + 500])).execute()
+        if advance_watermark and watermark:
+            state = ReportingState.get_or_none(ReportingState.name == 'transactions')
+            if state is None or not state.watermark or watermark > state.watermark:
+                (ReportingState.insert(name='transactions', watermark=watermark)
+                 .on_conflict(conflict_target=[ReportingState.name], update={ReportingState.watermark: watermark})
+                 .execute())
+    return len(pages)
+
+
+def remove_pages(page_ids):
+    """Takes pages that no longer exist in Notion (e.g. found by a full mirror sync) out of the totals."""
+    if not is_enabled() or not page_ids:
+        return
+    _ensure_init()
+    with db.atomic('IMMEDIATE'):
+        previous = _previous_rows(list(page_ids))
+        deltas = defaultdict(lambda: [0.0, 0])
+        for row in previous.values():
+            _add_contribution(deltas, row, -1)
+        _apply_deltas(deltas)
+        ids = list(previous)
+        for i in range(0, len(ids), 500):
+            ReportedTransaction.delete().where(ReportedTransaction.id.in_(ids[i:i + 500])).execute()
+
+
+# --- SYNC ---
+
+def _mark_synced():
+    (ReportingState.insert(name='transactions', synced_at=time.time())
+     .on_conflict(conflict_target=[ReportingState.name], update={ReportingState.synced_at: time.time()})
+     .execute())
+
+
+def rebuild():
+    """Recomputes every total from scratch (from the mirror when enabled, otherwise from Notion)."""
+    _ensure_init()
+    m = notion_client._mirror()
+    if m:
+        m.ensure_fresh('transactions')
+        pages = m.get_pages('transactions')
+    else:
+        pages = notion_client.fetch_notion_database_pages(Config.TRANSACTIONS_DB_ID)
+    with _sync_lock:
+        with db.atomic('IMMEDIATE'):
+            MonthlyTotal.delete().execute()
+            ReportedTransaction.delete().execute()
+            ReportingState.delete().execute()
+            for i in range(0, len(pages), 500):
+                apply_pages(pages[i:i + 500], advance_watermark=True)
+            _mark_synced()
+    log.info(f"Reporting rebuilt from {len(pages)} transactions")
+    return len(pages)
+
+
+def sync():
+    """Applies transactions edited since the last sync (through the mirror when it is enabled)."""
+    _ensure_init()
+    with _sync_lock:
+        m = notion_client._mirror()
+        if m:
+            count = m.sync(['transactions']).get('transactions', 0)
+        else:
+            state = ReportingState.get_or_none(ReportingState.name == 'transactions')
+            filters = None
+            if state and state.watermark:
+                filters = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": state.watermark}}
+            sorts = [{"timestamp": "last_edited_time", "direction": "ascending"}]
+            count, batch = 0, []
+            for page in notion_client.iter_notion_database_pages(Config.TRANSACTIONS_DB_ID, filters=filters,
+                                                                 sorts=sorts):
+                batch.append(page)
+                if len(batch) >= 500:
+                    count += apply_pages(batch, advance_watermark=True)
+                    batch = []
+            count += apply_pages(batch, advance_watermark=True)
+        _mark_synced()
+    return count
+
+
+def ensure_fresh():
+    """Builds the totals on first use and catches up once they are older than REPORTING_MAX_AGE."""
+    _ensure_init()
+    state = ReportingState.get_or_none(ReportingState.name == 'transactions')
+    if state is None or not state.synced_at:
+        rebuild()
+    elif time.time() - state.synced_at >= Config.REPORTING_MAX_AGE:
+        sync()
+
+
+# --- QUERIES ---
+
+def _names(dimension):
+    database_id = {'account': Config.ACCOUNTS_DB_ID, 'category': Config.CATEGORIES_DB_ID,
+                   'pillar': Config.PILLARS_DB_ID}.get(dimension)
+    if not database_id:
+        return {}
+    return {record.id: record.name for record in notion_client.fetch_cached_records(database_id)}
+
+
+def rollup(dimension, start_month=None, end_month=None, currency=None, base_currency=None):
+    """Monthly spend/income/net rows for a dimension, optionally converted to base_currency per month."""
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown report dimension: {dimension}. Use one of: {', '.join(DIMENSIONS)}")
+    ensure_fresh()
+    query = (MonthlyTotal
+             .select(MonthlyTotal.month, MonthlyTotal.key, MonthlyTotal.currency, MonthlyTotal.type,
+                     fn.SUM(MonthlyTotal.total).alias('total'), fn.SUM(MonthlyTotal.count).alias('count'))
+             .where(MonthlyTotal.dimension == dimension)
+             .group_by(MonthlyTotal.month, MonthlyTotal.key, MonthlyTotal.currency, MonthlyTotal.type))
+    if start_month: query = query.where(MonthlyTotal.month >= start_month)
+    if end_month: query = query.where(MonthlyTotal.month <= end_month)
+    if currency: query = query.where(MonthlyTotal.currency == currency)
+    rows = [row for row in query.dicts() if row['count']]
+    if base_currency:
+        _convert_totals(rows, base_currency.upper())
+
+    names = _names(dimension)
+    report = {}
+    for row in rows:
+        entry = report.setdefault((row['month'], row['key'], row['currency']), {
+            'month': row['month'], 'key': row['key'] or None, 'name': names.get(row['key']),
+            'currency': row['currency'], 'spend': 0.0, 'income': 0.0, 'net': 0.0, 'count': 0})
+        if row['type'] == 'Expense':
+            entry['spend'] -= row['total']
+        elif row['type'] == 'Income':
+            entry['income'] += row['total']
+        entry['net'] += row['total']
+        entry['count'] += row['count']
+    for entry in report.values():
+        for field in ('spend', 'income', 'net'):
+            entry[field] = round(entry[field], 2)
+    return sorted(report.values(), key=lambda e: (e['month'], -e['spend'], e['key'] or ''))
+
+
+def _convert_totals(rows, base_currency):
+    """Converts monthly total rows in place to base_currency where the month has a rate."""
+    import fx
+    import numpy as np
+
+    if not rows:
+        return
+    rates = fx.month_average_rates([r['currency'] for r in rows], [r['month'] for r in rows], base_currency)
+    totals = np.array([r['total'] for r in rows]) * rates
+    for row, converted in zip(rows, totals.tolist()):
+        if converted == converted:  # Not NaN
+            row['total'], row['currency'] = converted, base_currency
+
+
+def balances(base_currency=None, rate_date=None):
+    """Balance of every account per currency, with a total in base_currency as of rate_date."""
+    import fx
+    import numpy as np
+
+    ensure_fresh()
+    query = (ReportedTransaction
+             .select(ReportedTransaction.account_id, ReportedTransaction.currency,
+                     fn.SUM(ReportedTransaction.amount).alias('amount'))
+             .group_by(ReportedTransaction.account_id, ReportedTransaction.currency)
+             .tuples())
+    rows = list(query)
+    account_ids, currencies, amounts = zip(*rows) if rows else ((), (), ())
+    base_currency = (base_currency or '').upper() or None
+    if base_currency:
+        rate_date = rate_date or str(np.datetime64('today'))
+        converted = fx.convert(amounts, currencies, [rate_date] * len(amounts), base_currency)
+    else:
+        converted = np.full(len(amounts), np.nan)
+
+    names = _names('account')
+    result = {}
+    for account_id, currency, amount, value in zip(account_ids, currencies, amounts, converted.tolist()):
+        entry = result.setdefault(account_id, {
+            'account_id': account_id or None, 'name': names.get(account_id), 'balances': {}, 'total': None,
+            'base_currency': base_currency, 'unconverted': []})
+        entry['balances'][currency] = round(amount, 2)
+        if not base_currency:
+            continue
+        if value == value:
+            entry['total'] = round((entry['total'] or 0) + value, 2)
+        else:
+            entry['unconverted'].append(currency)
+    return sorted(result.values(), key=lambda e: (e['name'] or '', e['account_id'] or ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the materialized spending/income reports.")
+    parser.add_argument('command', choices=['rebuild', 'sync'])
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    init()
+    count = rebuild() if args.command == 'rebuild' else sync()
+    print(f"transactions: {count} pages applied")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# sqlite_store.py
+"""Lazily opened local SQLite databases (the mirror, outbox and reporting stores)."""
+import threading
+
+from config import Config
+
+
+class SqliteStore:
+    """Opens a peewee SqliteDatabase at a Config path on first use, creating its tables."""
+
+    def __init__(self, db, path_setting, models, setup=None):
+        self.db = db
+        self.path_setting = path_setting
+        self.models = models
+        self.setup = setup  # Called once the tables exist, e.g. to add columns newer code expects
+        self._lock = threading.Lock()
+        self._path = None  # Set only once the tables exist, so other threads never see a half-open database
+
+    def init(self, path=None):
+        """Opens (and creates, if needed) the database; `path` defaults to the Config setting. Safe to call repeatedly."""
+        path = path or getattr(Config, self.path_setting)
+        if not path:
+            raise ValueError(f"{self.path_setting} is not set.")
+        with self._lock:
+            if self._path != path:
+                if not self.db.is_closed():
+                    self.db.close()
+                self.db.init(path)
+                self.db.create_tables(self.models, safe=True)
+                if self.setup:
+                    self.setup()
+                self._path = path
+
+    def ensure_init(self):
+        if self._path is None:
+            self.init()
@@ -0,0 +1,96 @@
+# startup.py
+"""Cold-start support for gunicorn (see gunicorn.conf.py) and a startup timing report."""
+import logging
+import os
+import time
+
+from config import Config
+import metrics
+
+log = logging.getLogger(__name__)
+
+BOOT_TIME_ENV = 'APP_BOOT_TIME'
+BOOT_TIME = float(os.environ.get(BOOT_TIME_ENV) or time.time())
+
+_phases = {}  # phase -> seconds since boot, in the order they happened
+_first_request_seen = False
+
+
+def mark(phase):
+    """Records that `phase` finished now; returns its seconds since boot."""
+    _phases[phase] = time.time() - BOOT_TIME
+    return _phases[phase]
+
+
+def phases():
+    return dict(_phases)
+
+
+def report():
+    return ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in _phases.items())
+
+
+def _close_databases():
+    # SQLite connections must not cross a fork; workers open their own on first use
+    import mirror
+    import outbox
+    import reporting
+    for db in (mirror.db, outbox.db, reporting.db):
+        if not db.is_closed():
+            db.close()
+
+
+def _close_notion_transport():
+    # The master serves no requests, so don't keep its loop thread and open sockets; workers start their own
+    import notion_async
+    notion_async.shutdown()
+
+
+def prewarm(app=None):
+    """
+    Loads everything the form page needs, and builds the reports if they are enabled and not
+    built yet. Failures are logged, not raised: the workers still start, and the first request
+    loads what is missing.
+    """
+    import bootstrap
+    import notion_client
+    import reporting
+
+    started = time.perf_counter()
+    try:
+        for attr in ('ACCOUNTS_DB_ID', 'PILLARS_DB_ID', 'CATEGORIES_DB_ID'):
+            loaded = time.perf_counter()
+            records = notion_client.fetch_cached_records(getattr(Config, attr))
+            log.info(f"Prewarm: {len(records)} {attr[:-6].lower()} in {time.perf_counter() - loaded:.2f}s")
+        bootstrap.load()
+        if reporting.is_enabled():
+            loaded = time.perf_counter()
+            reporting.ensure_fresh()
+            log.info(f"Prewarm: reports ready in {time.perf_counter() - loaded:.2f}s")
+        if app is not None:
+            app.jinja_env.get_template('index.html')
+    except Exception as e:
+        log.warning(f"Prewarm failed after {time.perf_counter() - started:.2f}s, workers will load on demand: {e}")
+    finally:
+        _close_databases()
+        _close_notion_transport()
+    mark('prewarmed')
+
+
+def first_request():
+    """Called after every request; logs the startup report once per process."""
+    global _first_request_seen
+    if _first_request_seen:
+        return
+    _first_request_seen = True
+    mark('first_request')
+    log.info(f"Startup (pid {os.getpid()}): {report()}")
+
+
+def _startup_metrics():
+    return [('startup_phase_seconds', 'gauge', {'phase': phase}, seconds) for phase, seconds in _phases.items()]
+
+
+metrics.register_collector(_startup_metrics)
+metrics.describe('startup_phase_seconds', 'gauge',
+                 'Seconds from process boot (the gunicorn master start) to the end of each startup phase.')
@@ -33,6 +33,22 @@ parentSelect.addEventListener('change', function() {
 });
 subCategorySelect.addEventListener('change', function() { if(this.value) { finalCategoryIdInput.value = this.value; } });
 
+// Accounts, pillars and every type's categories, fetched once per page load. The versioned URL is
+// cached by the browser, so switching between expense and income never goes to the network.
+let bootstrapPromise = null;
+function loadBootstrap() {
+    if (!bootstrapPromise) {
+        const version = document.body.dataset.bootstrapVersion;
+        bootstrapPromise = fetch(version ? `/api/bootstrap?v=${encodeURIComponent(version)}` : '/api/bootstrap')
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.json();
+            })
+            .catch(error => { bootstrapPromise = null; throw error; });
+    }
+    return bootstrapPromise;
+}
+
 async function setType(type) {
     document.getElementById('type').value = type;
     document.getElementById('expense-btn').classList.toggle('active', type === 'expense');
@@ -68,8 +84,7 @@ async function setType(type) {
         pillarInput.required = true;
         toAccountInput.required = false;
         try {
-            const response = await fetch(`/api/categories/${type}`);
-            const data = await response.json();
+            const data = (await loadBootstrap()).categories[type] || {parents: [], children_map: {}};
             childrenMap = data.children_map;
             parentSelect.innerHTML = '<option value="" disabled selected>-- Select a Parent --</option>';
             subCategoryWrapper.classList.add('hidden');
@@ -81,7 +96,7 @@ async function setType(type) {
                 option.textContent = parent.name;
                 parentSelect.appendChild(option);
             });
-        } catch (error) { console.error('Failed to fetch categories:', error); }
+        } catch (error) { console.error('Failed to load categories:', error); }
     }
 }
 
@@ -179,7 +194,24 @@ invAccount.addEventListener('change', calculateConversionDetails);
 invFromCurrency.addEventListener('change', calculateConversionDetails);
 invToCurrency.addEventListener('change', calculateConversionDetails);
 
+// One key per form load: a resubmitted POST (flaky connection, double tap) reuses it and the server logs it once
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
+function resetIdempotencyKeys() {
+    document.querySelectorAll('.idempotency-key').forEach(input => { input.value = newIdempotencyKey(); });
+}
+
+// Going Back after a submit restores the page from the back/forward cache with the old key, which
+// would make the next (different) entry look like a duplicate of the one already logged
+window.addEventListener('pageshow', function(event) {
+    if (event.persisted) resetIdempotencyKeys();
+});
+
 document.addEventListener('DOMContentLoaded', function() {
+    resetIdempotencyKeys();
     setType('expense');
     showTab('expense');
     handleActionChange();
@@ -0,0 +1,23 @@
+# conftest.py
+"""Shared pytest fixtures: every store lives in a per-test temporary directory."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Points the outbox, reporting and FX stores at tmp_path; Notion is never called."""
+    monkeypatch.setattr(Config, 'OUTBOX_DB_PATH', str(tmp_path / 'outbox.db'))
+    monkeypatch.setattr(Config, 'REPORTING_DB_PATH', str(tmp_path / 'reporting.db'))
+    monkeypatch.setattr(Config, 'MIRROR_DB_PATH', '')
+    monkeypatch.setattr(Config, 'FX_STORE_DIR', str(tmp_path / 'fx_rates'))
+    monkeypatch.setattr(Config, 'FX_SEED_MAX_AGE', 0)
+    monkeypatch.setattr(Config, 'IMPORT_DIR', str(tmp_path / 'imports'))
+    monkeypatch.setattr(Config, 'TRANSACTIONS_DB_ID', 'transactions-db')
+    return tmp_path
@@ -0,0 +1,36 @@
+# test_fx.py
+import numpy as np
+import pytest
+
+import fx
+
+
+@pytest.fixture(autouse=True)
+def rates(storage):
+    fx.add_rates('ILS', ['2024-01-01', '2024-01-10', '2024-02-01'], [3.6, 3.7, 3.8])
+    fx.add_rates('EUR', ['2024-01-05'], [0.9])
+
+
+def test_rates_as_of_use_the_latest_rate_on_or_before_each_day():
+    days = fx.to_days(['2024-01-01', '2024-01-09', '2024-01-10', '2024-01-31', '2025-06-01'])
+    np.testing.assert_allclose(fx.rates_as_of('ILS', days), [3.6, 3.6, 3.7, 3.7, 3.8])
+
+
+def test_days_before_the_first_rate_or_without_a_date_are_nan():
+    rates = fx.rates_as_of('ILS', fx.to_days(['2023-12-31', None]))
+    assert np.isnan(rates).all()
+    assert np.isnan(fx.rates_as_of('GBP', fx.to_days(['2024-01-01']))).all()
+
+
+def test_later_rates_for_a_day_replace_earlier_ones():
+    assert fx.add_rates('ILS', ['2024-01-10', '2024-01-20'], [3.75, 3.72]) == 4
+    days = fx.to_days(['2024-01-10', '2024-01-25'])
+    np.testing.assert_allclose(fx.rates_as_of('ILS', days), [3.75, 3.72])
+
+
+def test_convert_goes_through_usd_at_each_dates_rate():
+    converted = fx.convert([370, 100, 90, 5], ['ILS', 'USD', 'EUR', 'EUR'],
+                           ['2024-01-10', '2024-01-10', '2024-01-10', '2024-01-02'], 'ILS')
+    np.testing.assert_allclose(converted[:3], [370, 370, 370])
+    assert np.isnan(converted[3])  # No EUR rate before 2024-01-05
+    np.testing.assert_allclose(fx.convert([370], ['ILS'], ['2024-01-10'], 'USD'), [100])
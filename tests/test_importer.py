@@ -0,0 +1,78 @@
+# test_importer.py
+import io
+import os
+
+import pytest
+
+from config import Config
+import importer
+import notion_client
+
+STATEMENT = """Date,Description,Amount
+01/03/2024,Coffee  Shop,-12.50
+01/03/2024,Coffee Shop,-12.50
+02/03/2024,,-40
+03/03/2024,Salary,"1,000.00"
+"""
+
+
+def _transaction(date, amount, description):
+    return {'id': f"{date}-{amount}-{description}", 'properties': {
+        'Description': {'title': [{'plain_text': description}]},
+        'Amount': {'number': amount},
+        'Transaction Date': {'date': {'start': date}},
+    }}
+
+
+@pytest.fixture
+def notion(storage, monkeypatch):
+    """Transactions already in Notion, and the ones the import creates (which then show up as existing)."""
+    existing, created, failing = [], [], set()
+
+    def create_expense_or_income(description, amount, transaction_date, **kwargs):
+        if description in failing:
+            raise RuntimeError("Notion is down")
+        created.append((transaction_date, amount, description))
+        existing.append(_transaction(transaction_date, amount, description))
+
+    monkeypatch.setattr(notion_client, 'iter_notion_database_pages', lambda database_id, **kwargs: iter(list(existing)))
+    monkeypatch.setattr(notion_client, 'create_expense_or_income', create_expense_or_income)
+    return existing, created, failing
+
+
+def _rows():
+    return list(importer.parse_statement(io.StringIO(STATEMENT), 'statement.csv'))
+
+
+def test_rows_already_in_notion_are_skipped_once_each(notion):
+    existing, created, _ = notion
+    existing.append(_transaction('2024-03-01', -12.5, 'coffee shop'))
+    state = importer.import_statement(_rows(), 'acc-1', concurrency=1)
+    # One of the two identical coffee rows was already logged; the other is new
+    assert sorted(created) == [('2024-03-01', -12.5, 'Coffee Shop'), ('2024-03-02', -40.0, 'Imported transaction'),
+                               ('2024-03-03', 1000.0, 'Salary')]
+    assert state['imported'] == 3 and state['duplicates'] == 1 and state['status'] == 'done'
+
+
+def test_reimporting_a_statement_creates_nothing(notion):
+    _, created, _ = notion
+    importer.import_statement(_rows(), 'acc-1', concurrency=1)
+    assert len(created) == 4
+    state = importer.import_statement(_rows(), 'acc-1', concurrency=1)
+    # Includes the row without a description, which was written as DEFAULT_DESCRIPTION
+    assert len(created) == 4 and state['duplicates'] == 4 and state['imported'] == 0
+
+
+def test_resumed_import_only_retries_failed_rows(notion):
+    _, created, failing = notion
+    os.makedirs(Config.IMPORT_DIR, exist_ok=True)
+    checkpoint = importer.checkpoint_path('job-1')
+    failing.add('Salary')
+    state = importer.import_statement(_rows(), 'acc-1', concurrency=1, checkpoint=checkpoint)
+    assert state['status'] == 'failed' and state['imported'] == 3 and state['failed'] == 1
+
+    failing.clear()
+    state = importer.import_statement(_rows(), 'acc-1', concurrency=1, checkpoint=checkpoint)
+    assert state['status'] == 'done' and state['imported'] == 4 and state['duplicates'] == 0
+    assert [row for row in created if row[2] == 'Salary'] == [('2024-03-03', 1000.0, 'Salary')]
+    assert len(created) == 4
@@ -0,0 +1,94 @@
+# test_outbox.py
+import json
+
+import pytest
+
+from config import Config
+import outbox
+
+
+@pytest.fixture
+def steps_handler(storage, monkeypatch):
+    """Registers a 'test' kind whose delivery writes two steps, failing the second one on demand."""
+    calls = []
+    failures = []
+
+    def handler(form_data, steps=None):
+        def write(name):
+            def _write():
+                calls.append(name)
+                if failures and failures[0] == name:
+                    failures.pop(0)
+                    raise RuntimeError(f"{name} timed out")
+            return _write
+        steps.run('first', write('first'))
+        steps.run('second', write('second'))
+        return f"Logged {form_data['description']}"
+
+    monkeypatch.setitem(outbox.HANDLERS, 'test', handler)
+    monkeypatch.setitem(outbox.VALIDATORS, 'test', lambda form_data: None)
+    monkeypatch.setattr(Config, 'OUTBOX_ASYNC', False)
+    outbox.init()
+    return calls, failures
+
+
+def test_resubmitting_a_key_returns_the_existing_entry(steps_handler):
+    entry, created = outbox.submit('test', {'description': 'Coffee'}, 'key-1')
+    again, created_again = outbox.submit('test', {'description': 'Something else'}, 'key-1')
+    assert created and not created_again
+    assert again.key == entry.key and json.loads(again.payload) == {'description': 'Coffee'}
+
+
+def test_redelivery_skips_steps_already_written(steps_handler):
+    calls, failures = steps_handler
+    outbox.submit('test', {'description': 'Coffee'}, 'key-1')
+    failures.append('second')
+    with pytest.raises(RuntimeError):
+        outbox.dispatch('key-1')
+    entry = outbox.get('key-1')
+    assert entry.status == outbox.PENDING
+    assert json.loads(entry.completed_steps) == ['first']
+
+    assert outbox.dispatch('key-1', ignore_backoff=True) == "Logged Coffee"
+    assert calls == ['first', 'second', 'second']
+    assert outbox.get('key-1').status == outbox.DONE
+
+
+def test_delivered_entry_is_not_sent_again(steps_handler):
+    calls, _ = steps_handler
+    outbox.submit('test', {'description': 'Coffee'}, 'key-1')
+    assert outbox.dispatch('key-1') == "Logged Coffee"
+    assert outbox.dispatch('key-1', ignore_backoff=True) == "Logged Coffee"
+    assert calls == ['first', 'second']
+
+
+def test_delivery_stops_when_its_claim_is_taken_over(storage, monkeypatch):
+    calls = []
+
+    def handler(form_data, steps=None):
+        steps.run('first', lambda: calls.append('first'))
+        # Another worker re-claims the entry, as it would once the claim went stale
+        outbox.OutboxEntry.update(claimed_at=steps.claim + 1000).where(outbox.OutboxEntry.key == 'key-1').execute()
+        steps.run('second', lambda: calls.append('second'))
+        return "Logged"
+
+    monkeypatch.setitem(outbox.HANDLERS, 'test', handler)
+    monkeypatch.setattr(Config, 'OUTBOX_ASYNC', False)
+    outbox.init()
+    outbox.submit('test', {}, 'key-1')
+    with pytest.raises(outbox.ClaimLostError):
+        outbox.dispatch('key-1')
+    entry = outbox.get('key-1')
+    assert calls == ['first']
+    assert entry.status == outbox.IN_PROGRESS and entry.attempts == 0  # Left to the worker that owns it
+
+
+def test_async_submit_rejects_invalid_forms_before_queueing(steps_handler, monkeypatch):
+    def reject(form_data):
+        raise ValueError("Amount must be a number")
+
+    monkeypatch.setitem(outbox.VALIDATORS, 'test', reject)
+    monkeypatch.setattr(Config, 'OUTBOX_ASYNC', True)
+    with pytest.raises(ValueError):
+        outbox.submit('test', {'amount': 'abc'}, 'key-1')
+    assert outbox.get('key-1') is None
@@ -0,0 +1,93 @@
+# test_portfolio.py
+import pandas as pd
+import pytest
+
+import portfolio
+
+COLUMNS = ['id', 'date', 'created_time', 'ticker', 'account_id', 'action', 'quantity', 'price', 'fees']
+LEDGER = [
+    ('t1', '2024-01-02', '2024-01-02T10:00', 'INTC', 'a1', 'Buy', 10, 20.0, 1.0),
+    ('t2', '2024-01-05', '2024-01-05T10:00', 'INTC', 'a1', 'Buy', 5, 30.0, 0.5),
+    ('t3', '2024-02-01', '2024-02-01T10:00', 'INTC', 'a1', 'Sell', 8, 35.0, 1.0),
+    ('t4', '2024-03-01', '2024-03-01T10:00', 'INTC', 'a1', 'Sell', 7, 25.0, 0.0),  # Full close
+    ('t5', '2024-04-01', '2024-04-01T10:00', 'INTC', 'a1', 'Buy', 4, 22.0, 0.0),
+    ('t6', '2024-01-03', '2024-01-03T10:00', 'INTC', 'a2', 'Buy', 3, 19.0, 0.0),
+    ('t7', '2024-01-04', '2024-01-04T10:00', 'INTC', 'a2', 'Sell', 5, 21.0, 0.0),  # Oversold
+    ('t8', '2024-01-10', '2024-01-10T10:00', 'MSFT', 'a1', 'Buy', 2, 300.0, 2.0),
+    ('t9', '2024-01-10', '2024-01-10T11:00', 'MSFT', 'a1', 'Sell', 1, 310.0, 1.0),
+]
+
+
+def _ledger():
+    return pd.DataFrame(LEDGER, columns=COLUMNS).astype({'quantity': float, 'price': float, 'fees': float})
+
+
+def _replay_by_loop(ledger, method):
+    """Trade-by-trade reference implementation: {id: (held, cost_basis, realized_gain)}."""
+    expected = {}
+    for _, trades in ledger.sort_values(['date', 'created_time']).groupby(['ticker', 'account_id']):
+        held, lots = 0.0, []  # lots: [quantity, cost]
+        for trade in trades.itertuples():
+            if trade.action == 'Buy':
+                held += trade.quantity
+                lots.append([trade.quantity, trade.quantity * trade.price + trade.fees])
+                gain = 0.0
+            else:
+                sold = min(trade.quantity, held)
+                basis = sum(cost for _, cost in lots)
+                if method == 'average':
+                    cost_of_sold = basis * sold / held if held else 0.0
+                    lots = [[held - sold, basis - cost_of_sold]] if held > sold else []
+                else:
+                    cost_of_sold, remaining = 0.0, sold
+                    while remaining > 1e-12 and lots:
+                        quantity, cost = lots[0]
+                        used = min(quantity, remaining)
+                        cost_of_sold += cost * used / quantity
+                        remaining -= used
+                        if used < quantity:
+                            lots[0] = [quantity - used, cost * (quantity - used) / quantity]
+                        else:
+                            lots.pop(0)
+                held -= trade.quantity
+                gain = trade.quantity * trade.price - trade.fees - cost_of_sold
+            expected[trade.id] = (held, sum(cost for _, cost in lots), gain)
+    return expected
+
+
+@pytest.mark.parametrize('method', portfolio.METHODS)
+def test_replay_matches_trade_by_trade_loop(method):
+    ledger = _ledger()
+    replayed = portfolio.replay(ledger, method).set_index('id')
+    for trade_id, (held, cost_basis, realized_gain) in _replay_by_loop(ledger, method).items():
+        row = replayed.loc[trade_id]
+        assert row['held'] == pytest.approx(held), trade_id
+        if row['oversold']:
+            continue
+        assert row['cost_basis'] == pytest.approx(cost_basis, abs=1e-9), trade_id
+        assert row['realized_gain'] == pytest.approx(realized_gain, abs=1e-9), trade_id
+
+
+def test_replay_flags_oversold_sales():
+    replayed = portfolio.replay(_ledger(), 'average').set_index('id')
+    assert replayed['oversold'].tolist().count(True) == 1
+    assert replayed.loc['t7', 'oversold']
+
+
+def test_fifo_sells_oldest_lots_first():
+    replayed = portfolio.replay(_ledger(), 'fifo').set_index('id')
+    # 8 sold from the first lot of 10 (201.0 cost): 2 left at 20.1 each plus the 5-share lot (150.5)
+    assert replayed.loc['t3', 'cost_basis'] == pytest.approx(2 * 20.1 + 150.5)
+
+
+def test_compute_positions_leaves_out_oversold_positions():
+    positions, problems = portfolio.compute_positions(_ledger(), 'average')
+    assert ('INTC', 'a2') not in positions.index
+    assert len(problems) == 1 and 'INTC in account a2' in problems[0]
+    assert positions.loc[('INTC', 'a1'), 'quantity'] == pytest.approx(4)
+    assert positions.loc[('INTC', 'a1'), 'cost_basis'] == pytest.approx(88.0)
+
+
+def test_replay_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        portfolio.replay(_ledger(), 'lifo')
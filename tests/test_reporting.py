@@ -0,0 +1,81 @@
+# test_reporting.py
+import pytest
+
+import reporting
+
+
+@pytest.fixture(autouse=True)
+def store(storage):
+    reporting.init()
+
+
+def _page(page_id, amount, date='2024-03-05', account='acc-1', category='cat-food', type='Expense',
+          edited='2024-03-05T10:00:00.000Z', **extra):
+    page = {
+        'id': page_id, 'parent': {'database_id': 'transactions-db'}, 'created_time': edited,
+        'last_edited_time': edited,
+        'properties': {
+            'Description': {'title': [{'plain_text': f"Transaction {page_id}"}]},
+            'Amount': {'number': amount},
+            'Transaction Date': {'date': {'start': date}},
+            'Type': {'select': {'name': type}},
+            'Account': {'relation': [{'id': account}]},
+            'Category': {'relation': [{'id': category}]},
+            'Pillar': {'relation': []},
+            'Currency': {'select': {'name': 'ILS'}},
+            'Transfer ID': {'rich_text': []},
+        },
+    }
+    page.update(extra)
+    return page
+
+
+def _totals(dimension):
+    """{(key, month, type): (total, count)} without rows an edit emptied."""
+    query = reporting.MonthlyTotal.select().where(reporting.MonthlyTotal.dimension == dimension)
+    return {(row.key, row.month, row.type): (round(row.total, 6), row.count) for row in query if row.count}
+
+
+def test_edit_moves_the_amount_to_its_new_month_and_category():
+    reporting.apply_pages([_page('p1', -50), _page('p2', -20)])
+    reporting.apply_pages([_page('p1', -80, date='2024-04-01', category='cat-rent')])
+    assert _totals('category') == {('cat-food', '2024-03', 'Expense'): (-20, 1),
+                                   ('cat-rent', '2024-04', 'Expense'): (-80, 1)}
+    assert _totals('month') == {('', '2024-03', 'Expense'): (-20, 1), ('', '2024-04', 'Expense'): (-80, 1)}
+
+
+def test_archived_and_removed_pages_leave_the_totals():
+    reporting.apply_pages([_page('p1', -50), _page('p2', -20), _page('p3', 1000, type='Income')])
+    reporting.apply_pages([_page('p1', -50, archived=True)])
+    reporting.remove_pages(['p3', 'never-seen'])
+    assert _totals('account') == {('acc-1', '2024-03', 'Expense'): (-20, 1)}
+    assert reporting.ReportedTransaction.select().count() == 1
+
+
+def test_repeated_edits_in_one_batch_count_once():
+    reporting.apply_pages([_page('p1', -10), _page('p1', -15), _page('p1', -30)])
+    assert _totals('account') == {('acc-1', '2024-03', 'Expense'): (-30, 1)}
+
+
+def test_transfers_and_other_databases_are_not_counted():
+    transfer = _page('p1', -100, type=reporting.TRANSFER_TYPE)
+    other = _page('p2', -5)
+    other['parent'] = {'database_id': 'holdings-db'}
+    reporting.apply_pages([transfer, other, _page('p3', -7)])
+    assert _totals('account') == {('acc-1', '2024-03', 'Expense'): (-7, 1)}
+
+
+def test_deltas_match_a_rebuild_from_the_final_pages():
+    edits = [_page('p1', -50), _page('p2', -20, account='acc-2'), _page('p3', 500, type='Income'),
+             _page('p2', -25, account='acc-1'), _page('p1', -50, archived=True), _page('p4', -9, date='2024-05-02')]
+    for page in edits:
+        reporting.apply_pages([page])
+    incremental = {dimension: _totals(dimension) for dimension in reporting.DIMENSIONS}
+
+    final = {}
+    for page in edits:
+        final[page['id']] = page
+    reporting.MonthlyTotal.delete().execute()
+    reporting.ReportedTransaction.delete().execute()
+    reporting.apply_pages([page for page in final.values() if not page.get('archived')])
+    assert incremental == {dimension: _totals(dimension) for dimension in reporting.DIMENSIONS}
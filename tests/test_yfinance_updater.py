@@ -0,0 +1,87 @@
+# test_yfinance_updater.py
+import pytest
+
+from config import Config
+import notion_client
+import yfinance_updater
+
+QUOTES = {
+    'INTC': {'price': 21.3, 'sector': 'Technology', 'country': 'United States'},
+    'VWRA': {'price': 120.5, 'sector': 'Equity, Global', 'country': 'Ireland'},
+}
+
+
+class CountingProvider(yfinance_updater.LocalQuoteProvider):
+    def __init__(self, quotes):
+        super().__init__(quotes)
+        self.price_calls, self.metadata_calls = [], []
+
+    def fetch_prices(self, tickers):
+        self.price_calls.append(set(tickers))
+        return super().fetch_prices(tickers)
+
+    def fetch_metadata(self, tickers):
+        self.metadata_calls.append(set(tickers))
+        return super().fetch_metadata(tickers)
+
+
+def _holding(holding_id, ticker, sector=None, price=None):
+    return {'id': holding_id, 'properties': {
+        'Ticker': {'rich_text': [{'plain_text': ticker}]},
+        'Sector': {'select': {'name': sector} if sector else None},
+        'Country': {'select': None},
+        'Last Price': {'number': price},
+    }}
+
+
+@pytest.fixture
+def holdings(tmp_path, monkeypatch):
+    pages = [_holding('h1', 'intc'), _holding('h2', 'VWRA', sector='Equity Global', price=120.5),
+             _holding('h3', 'UNKNOWN'), _holding('h4', '')]
+    updates = {}
+    monkeypatch.setattr(notion_client, 'get_all_holdings', lambda: pages)
+    monkeypatch.setattr(notion_client, 'update_holding', lambda page_id, changes: updates.update({page_id: changes}))
+    monkeypatch.setattr(Config, 'ENRICH_PRICE_PROPERTY', 'Last Price')
+    return updates, str(tmp_path / 'reference_cache.json')
+
+
+def test_enrichment_writes_only_changed_properties(holdings):
+    updates, cache_path = holdings
+    provider = CountingProvider(QUOTES)
+    summary = yfinance_updater.enrich_holdings(provider, cache_path=cache_path)
+
+    assert updates == {
+        'h1': {'Country': {'select': {'name': 'United States'}}, 'Sector': {'select': {'name': 'Technology'}},
+               'Last Price': {'number': 21.3}},
+        'h2': {'Country': {'select': {'name': 'Ireland'}}},  # Sector and price already match
+    }
+    assert provider.price_calls == [{'INTC', 'VWRA', 'UNKNOWN'}]
+    assert summary['holdings'] == 3 and summary['updated'] == 2 and summary['failed'] == 0
+
+
+def test_cached_fields_are_not_fetched_again(holdings):
+    _, cache_path = holdings
+    yfinance_updater.enrich_holdings(CountingProvider(QUOTES), cache_path=cache_path)
+    provider = CountingProvider(QUOTES)
+    summary = yfinance_updater.enrich_holdings(provider, cache_path=cache_path)
+    # UNKNOWN has no quote, so it is the only ticker with nothing cached
+    assert provider.price_calls == [{'UNKNOWN'}]
+    assert provider.metadata_calls == [{'UNKNOWN'}]
+    assert summary['prices_fetched'] == 1 and summary['metadata_fetched'] == 1
+
+
+def test_no_price_requests_without_a_price_property(holdings, monkeypatch):
+    updates, cache_path = holdings
+    monkeypatch.setattr(Config, 'ENRICH_PRICE_PROPERTY', '')
+    provider = CountingProvider(QUOTES)
+    summary = yfinance_updater.enrich_holdings(provider, tickers=['intc'], cache_path=cache_path)
+    assert provider.price_calls == []
+    assert summary['prices_fetched'] == 0
+    assert updates == {'h1': {'Country': {'select': {'name': 'United States'}},
+                              'Sector': {'select': {'name': 'Technology'}}}}
+
+
+def test_dry_run_writes_nothing(holdings):
+    updates, cache_path = holdings
+    summary = yfinance_updater.enrich_holdings(CountingProvider(QUOTES), dry_run=True, cache_path=cache_path)
+    assert updates == {} and summary['updated'] == 2
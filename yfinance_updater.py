@@ -0,0 +1,232 @@
+# yfinance_updater.py
+"""Market-data enrichment for the Holdings database."""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from config import Config
+import notion_client
+
+log = logging.getLogger(__name__)
+
+# Seconds each cached field stays valid
+FIELD_TTLS = {
+    'price': 15 * 60,
+    'sector': 30 * 24 * 3600,
+    'country': 30 * 24 * 3600,
+}
+PRICE_FIELDS = {'price'}
+METADATA_FIELDS = {'sector', 'country'}
+
+
+def holding_properties():
+    """Field -> (Notion property, property type) for the fields we write back."""
+    properties = {'country': ('Country', 'select'), 'sector': ('Sector', 'select')}
+    if Config.ENRICH_PRICE_PROPERTY:
+        properties['price'] = (Config.ENRICH_PRICE_PROPERTY, 'number')
+    return properties
+
+
+# --- QUOTE PROVIDERS ---
+
+class YFinanceProvider:
+    """Quotes from Yahoo Finance. yfinance/pandas are imported on first use, not at startup."""
+
+    def fetch_prices(self, tickers):
+        """One batched download for every ticker -> {ticker: last close}."""
+        import yfinance as yf
+        if not tickers:
+            return {}
+        data = yf.download(sorted(tickers), period='5d', interval='1d', progress=False, auto_adjust=False,
+                           group_by='column', threads=True)
+        if data is None or data.empty:
+            return {}
+        closes = data['Close']
+        if getattr(closes, 'ndim', 1) == 1:  # A single ticker comes back as a Series
+            closes = closes.to_frame(name=sorted(tickers)[0])
+        last = closes.ffill().iloc[-1]
+        return {ticker: float(price) for ticker, price in last.items() if price == price}  # Drop NaN
+
+    def fetch_metadata(self, tickers):
+        """Sector/country per ticker. Yahoo has no batch endpoint for these, hence the long TTLs."""
+        import yfinance as yf
+        if not tickers:
+            return {}
+        batch = yf.Tickers(' '.join(sorted(tickers)))
+        metadata = {}
+        for ticker in tickers:
+            try:
+                info = batch.tickers[ticker].info or {}
+            except Exception as e:
+                log.warning(f"No reference data for {ticker}: {e}")
+                continue
+            metadata[ticker] = {'sector': info.get('sector') or info.get('category'), 'country': info.get('country')}
+        return metadata
+
+
+class LocalQuoteProvider:
+    """Quotes from a dict or JSON file: {"INTC": {"price": 21.3, "sector": "Technology", "country": "United States"}}."""
+
+    def __init__(self, quotes):
+        if isinstance(quotes, str):
+            with open(quotes, encoding='utf-8') as f:
+                quotes = json.load(f)
+        self.quotes = {ticker.upper(): values for ticker, values in quotes.items()}
+
+    def fetch_prices(self, tickers):
+        return {t: self.quotes[t]['price'] for t in tickers if self.quotes.get(t, {}).get('price') is not None}
+
+    def fetch_metadata(self, tickers):
+        return {t: {f: self.quotes[t].get(f) for f in METADATA_FIELDS} for t in tickers if t in self.quotes}
+
+
+# --- REFERENCE DATA CACHE ---
+
+class ReferenceCache:
+    """{ticker: {field: {"value": ..., "fetched_at": ...}}} persisted as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError) as e:
+                log.warning(f"Ignoring unreadable reference cache {path}: {e}")
+
+    def expired_fields(self, ticker, now=None):
+        now = now or time.time()
+        cached = self.data.get(ticker, {})
+        return {field for field, ttl in FIELD_TTLS.items()
+                if field not in cached or now - cached[field]['fetched_at'] >= ttl}
+
+    def put(self, ticker, field, value, now=None):
+        self.data.setdefault(ticker, {})[field] = {'value': value, 'fetched_at': now or time.time()}
+
+    def values(self, ticker):
+        return {field: entry['value'] for field, entry in self.data.get(ticker, {}).items()}
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+
+# --- ENGINE ---
+
+def _ticker_of(page):
+    return ''.join(t.get('plain_text', '') for t in page['properties'].get('Ticker', {}).get('rich_text', [])).upper()
+
+
+def _current_value(page, prop_name, prop_type):
+    prop = page['properties'].get(prop_name, {})
+    if prop_type == 'select':
+        return (prop.get('select') or {}).get('name')
+    return prop.get(prop_type)
+
+
+def _changed_properties(page, values):
+    """Notion properties whose value differs from the enriched one (skipping unknown values)."""
+    changes = {}
+    for field, (prop_name, prop_type) in holding_properties().items():
+        new_value = values.get(field)
+        if new_value is None:
+            continue
+        if prop_type == 'number':
+            new_value = round(float(new_value), 4)
+            current = _current_value(page, prop_name, prop_type)
+            if current is not None and abs(current - new_value) < 1e-6:
+                continue
+            changes[prop_name] = {"number": new_value}
+        else:
+            # Select option names can't contain commas
+            new_value = ' '.join(str(new_value).replace(',', ' ').split())
+            if _current_value(page, prop_name, prop_type) == new_value:
+                continue
+            changes[prop_name] = {"select": {"name": new_value}}
+    return changes
+
+
+def enrich_holdings(provider=None, tickers=None, dry_run=False, cache_path=None):
+    """
+    Enriches every holding (or only those for `tickers`). Returns a summary dict with the
+    number of holdings examined, updated and failed, and the tickers that were refreshed from the
+    provider. A holding Notion refuses to update is logged and counted; the pass goes on.
+    """
+    provider = provider or YFinanceProvider()
+    cache = ReferenceCache(Config.ENRICH_CACHE_PATH if cache_path is None else cache_path)
+    holdings = notion_client.get_all_holdings()
+    wanted = {t.upper() for t in tickers} if tickers else None
+    holdings = [h for h in holdings if _ticker_of(h) and (wanted is None or _ticker_of(h) in wanted)]
+    all_tickers = {_ticker_of(h) for h in holdings}
+
+    now = time.time()
+    # Only fields that are written back are fetched (no price calls without ENRICH_PRICE_PROPERTY)
+    written = set(holding_properties())
+    expired = {t: cache.expired_fields(t, now) & written for t in all_tickers}
+    need_prices = {t for t, fields in expired.items() if fields & PRICE_FIELDS}
+    need_metadata = {t for t, fields in expired.items() if fields & METADATA_FIELDS}
+
+    if need_prices:
+        for ticker, price in provider.fetch_prices(need_prices).items():
+            cache.put(ticker, 'price', price, now)
+    if need_metadata:
+        for ticker, metadata in provider.fetch_metadata(need_metadata).items():
+            for field in METADATA_FIELDS:
+                cache.put(ticker, field, metadata.get(field), now)
+    cache.save()
+
+    updated = failed = 0
+    for holding in holdings:
+        changes = _changed_properties(holding, cache.values(_ticker_of(holding)))
+        if not changes:
+            continue
+        if dry_run:
+            log.info(f"[dry run] {_ticker_of(holding)} ({holding['id']}): {changes}")
+            updated += 1
+            continue
+        try:
+            notion_client.update_holding(holding['id'], changes)
+            updated += 1
+        except Exception as e:
+            failed += 1
+            log.error(f"Failed to enrich {_ticker_of(holding)} ({holding['id']}): {e}")
+
+    summary = {'holdings': len(holdings), 'tickers': len(all_tickers), 'updated': updated, 'failed': failed,
+               'prices_fetched': len(need_prices), 'metadata_fetched': len(need_metadata), 'dry_run': dry_run}
+    log.info(f"Holdings enrichment: {summary}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Enrich Notion holdings with prices, sector and country.")
+    parser.add_argument('tickers', nargs='*', help="Only these tickers (default: every holding)")
+    parser.add_argument('--quotes', help="Use a local JSON quotes file instead of yfinance")
+    parser.add_argument('--dry-run', action='store_true', help="Show what would change without writing to Notion")
+    parser.add_argument('--every', type=int, metavar='SECONDS', help="Keep running, one pass every SECONDS")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    provider = LocalQuoteProvider(args.quotes) if args.quotes else YFinanceProvider()
+    while True:
+        try:
+            summary = enrich_holdings(provider, tickers=args.tickers or None, dry_run=args.dry_run)
+            print(json.dumps(summary))
+        except Exception as e:
+            log.error(f"Enrichment pass failed: {e}")
+            if not args.every:
+                return 1
+        if not args.every:
+            return 1 if summary['failed'] else 0
+        time.sleep(args.every)
+
+
+if __name__ == '__main__':
+    sys.exit(main())